@@ -1,672 +1,161 @@
-import io
 import os
+import io
+import json
+import time
+import uuid
 import base64
-import warnings
+import zipfile
+import contextvars
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
-import cv2
-import joblib
-import numpy as np
-import pandas as pd
-import rembg
 from flask import Flask
+from flask import Response
+from flask import g
 from flask import jsonify
 from flask import request
 from flask_cors import CORS
 from PIL import Image
-from skimage.feature import graycomatrix
-from skimage.feature import graycoprops
-from skimage.feature import local_binary_pattern
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import texture
+import tiled
+from artifacts import ArtifactStore
+from artifacts import ArtifactStoreFull
+from feature_store import rescore
+from features import FEATURE_SCHEMA
+from jobs import JobQueue
+from jobs import QueueFull
+from masks import MASK_ENCODINGS
+from memory import ImageTooLarge
+from memory import MemoryBusy
+from metrics import finish_request
+from metrics import metrics_registry
+from metrics import server_timing
+from metrics import stage
+from metrics import start_request
+from model_registry import get_registry
+from pipeline import IMAGE_FORMATS
+from pipeline import admitted_image
+from pipeline import encode_output
+from pipeline import feature_image
+from pipeline import feature_store
+from pipeline import features_from_bytes
+from pipeline import memory_admission
+from pipeline import process_objects
+from pipeline import process_single_image
+from pipeline import rembg_pool
+from pipeline import remove_background
+from pipeline import stored_features
+from result_cache import ResultCache
+from uploads import IMAGE_TYPES
+from uploads import SNIFF_BYTES
+from uploads import UploadRejected
+from uploads import UploadRequest
+from uploads import UploadStats
+from uploads import sniff_type
 
-Image.MAX_IMAGE_PIXELS = None  # Desactivar el límite
 # Configurar Flask
 app = Flask(__name__)
-CORS(app)  # Permitir conexiones desde otros dominios
+# Los archivos subidos se leen en memoria y se comprueban mientras llegan (uploads.py)
+app.request_class = UploadRequest
+# Permitir conexiones desde otros dominios
+CORS(app, expose_headers=["X-Prediction", "X-Image-Info", "Server-Timing"])
 app.config["UPLOAD_FOLDER"] = "uploads"  # Carpeta para las imágenes cargadas
-app.config["ALLOWED_EXTENSIONS"] = {"png", "jpg", "jpeg"}  # Extensiones permitidas
-
-
-# Función para verificar si el archivo tiene una extensión permitida
-def allowed_file(filename):
-    return (
-        "." in filename
-        and filename.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXTENSIONS"]
-    )
-
-
-# Función para eliminar el fondo de la imagen
-def remove_background(input_path, output_path):
-    # Leer la imagen
-    with open(input_path, "rb") as file:
-        image_data = file.read()
-
-    # Abrir la imagen en formato Pillow
-    image = Image.open(io.BytesIO(image_data))
-
-    # Redimensionar la imagen antes de eliminar el fondo (manteniendo la relación de aspecto)
-    image.thumbnail((3000, 3000), Image.LANCZOS)
-    print(f"Dimensiones de la imagen después del cambio: {image.size}")
-
-    # Convertir la imagen a bytes después de redimensionarla
-    with io.BytesIO() as byte_io:
-        image.save(byte_io, format="PNG")
-        image_data_resized = byte_io.getvalue()
-
-    # Eliminar el fondo usando rembg
-    result = rembg.remove(image_data_resized)
-
-    # Convertir el resultado en una imagen de Pillow
-    image = Image.open(io.BytesIO(result)).convert("RGBA")
-
-    # Crear un fondo blanco del mismo tamaño que la imagen procesada
-    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
-    print("Fondo borrado")
-
-    # Combinar la imagen con el fondo blanco
-    final_image = Image.alpha_composite(background, image).convert("RGB")
-
-    # Guardar la imagen procesada en el directorio de salida
-    final_image.save(output_path, "PNG")
-    return output_path
-    #print(f"Imagen guardada en: {output_path}")
-
-
-# Función para extraer características de color
-def extract_color_features(image):
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-    hist = cv2.calcHist(
-        [hsv_image], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256]
-    )
-    hist = cv2.normalize(hist, hist).flatten()
-    return hist
-
-
-# Función para extraer características de textura
-def extract_texture_features(gray_image):
-    lbp = local_binary_pattern(gray_image, P=8, R=1, method="uniform")
-    glcm = graycomatrix(
-        gray_image, distances=[5], angles=[0], levels=256, symmetric=True, normed=True
+# Tamaño máximo de cada imagen subida y del cuerpo de la petición (el de /predict/batch
+# es BATCH_MAX_BYTES); el tipo de archivo se comprueba por su contenido (PNG o JPEG)
+app.config["MAX_UPLOAD_BYTES"] = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_UPLOAD_BYTES"] + 1024 * 1024
+app.config["MODEL_PATH"] = os.environ.get("MODEL_PATH", "papas.pkl")  # Modelo entrenado
+# Guardar en disco la imagen subida y la procesada (solo para depuración)
+app.config["DEBUG_IMAGES"] = os.environ.get("DEBUG_IMAGES", "0") == "1"
+# Lotes: número máximo de imágenes por petición e hilos para procesarlas
+app.config["BATCH_MAX_FILES"] = int(os.environ.get("BATCH_MAX_FILES", 500))
+app.config["BATCH_WORKERS"] = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+app.config["BATCH_MAX_BYTES"] = int(os.environ.get("BATCH_MAX_BYTES", 256 * 1024 * 1024))
+# Límite total de artefactos por petición guardados en disco
+app.config["ARTIFACTS_MAX_BYTES"] = int(os.environ.get("ARTIFACTS_MAX_BYTES", 512 * 1024 * 1024))
+
+# Cada petición escribe en su propio directorio dentro de UPLOAD_FOLDER
+artifact_store = ArtifactStore(
+    app.config["UPLOAD_FOLDER"],
+    max_bytes=app.config["ARTIFACTS_MAX_BYTES"],
+    keep=app.config["DEBUG_IMAGES"],
+)
+
+# Cargar el modelo una sola vez al iniciar el worker (si falla, se cargará en la primera petición)
+model_registry = get_registry(app.config["MODEL_PATH"], validator=FEATURE_SCHEMA.check_model)
+try:
+    model_registry.get()
+except Exception as e:
+    app.logger.warning(f"No se pudo cargar el modelo al iniciar: {e}")
+
+
+# Caché de resultados por contenido de la imagen y versión del modelo
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("RESULT_CACHE_BYTES", 256 * 1024 * 1024)),
+    disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+    disk_max_bytes=int(os.environ.get("RESULT_CACHE_DISK_BYTES", 1024 * 1024 * 1024)),
+)
+
+# Hilos compartidos para procesar las imágenes de /predict/batch
+batch_executor = ThreadPoolExecutor(max_workers=app.config["BATCH_WORKERS"])
+
+# Preparar el worker antes de aceptar peticiones (llamado desde gunicorn.conf.py)
+def warm_up():
+    rembg_pool.warm_up()
+    texture.warm_up()
+    tiled.warm_up()
+    model_registry.get()
+
+
+# Medir cada petición: las etapas del pipeline (metrics.stage) que se ejecutan para
+# ella se devuelven en la cabecera Server-Timing junto con el total. En las
+# respuestas que se envían por partes (ndjson, multipart) la imagen se codifica
+# después de enviar las cabeceras, así que ni ella ni el envío entran en el total.
+@app.before_request
+def start_timing():
+    if metrics_registry.enabled:
+        g.request_start = time.perf_counter()
+        start_request()
+
+
+@app.after_request
+def finish_timing(response):
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    endpoint = request.endpoint or "unknown"
+    metrics_registry.observe("http_request_seconds", total, endpoint=endpoint)
+    metrics_registry.increment(
+        "http_requests_total", endpoint=endpoint, status=str(response.status_code)
     )
-    contrast = graycoprops(glcm, "contrast")[0, 0]
-    return [float(lbp.mean()), float(contrast)]  # Convertir a float
-
-
-# Función para extraer características de forma
-def extract_shape_features(gray_image):
-    contours, _ = cv2.findContours(
-        gray_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
-    )
-    max_contour = max(contours, key=cv2.contourArea)
-    area = cv2.contourArea(max_contour)
-    perimeter = cv2.arcLength(max_contour, True)
-    circularity = 4 * np.pi * (area / (perimeter * perimeter)) if perimeter != 0 else 0
-    return [area, perimeter, circularity]
-
-
-# Función para procesar una sola imagen
-def process_single_image(image_path):
-    try:
-        # Leer la imagen
-        remove = remove_background(image_path, "./uploads/remove_back.png")
-        image = np.array(Image.open(remove))
-        gray_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-
-        # Extraer características
-        color_features = extract_color_features(image)
-        texture_features = extract_texture_features(gray_image)
-        shape_features = extract_shape_features(gray_image)
-
-        # Combinar todas las características en una lista
-        features = color_features.tolist() + texture_features + shape_features
-        return features
-
-    except Exception as e:
-        print(f"Error al procesar la imagen {image_path}: {e}")
-        return None
-
+    response.headers["Server-Timing"] = server_timing(finish_request(), total)
+    return response
 
-# Función para cargar el modelo y realizar la predicción
-def predict_image_class(image_path, model_path="papas.pkl"):
-    # Suprimir advertencias sobre los nombres de características
-    warnings.filterwarnings("ignore", message=".*does not have valid feature names.*")
 
-    # Cargar el modelo .pkl
+# Función para cargar el modelo y realizar la predicción (con `store_key`, las
+# características se guardan en feature_store)
+def predict_image_class(image, model_path=None, store_key=None):
+    # Obtener el modelo ya cargado en el proceso (se recarga solo si cambia el archivo)
+    if model_path is None:
+        model_path = app.config["MODEL_PATH"]
     try:
-        model = joblib.load(model_path)
+        model = get_registry(model_path, validator=FEATURE_SCHEMA.check_model).get()
     except Exception as e:
         print(f"Error al cargar el modelo: {e}")
         return None
 
     # Procesar la imagen y extraer las características
-    features = process_single_image(image_path)
+    features = process_single_image(image, store_key=store_key)
 
     if features is not None:
-        # Convertir las características a un DataFrame con los nombres de las características (si el modelo fue entrenado con nombres)
-        feature_names = [
-            "Color_0",
-            "Color_1",
-            "Color_2",
-            "Color_3",
-            "Color_4",
-            "Color_5",
-            "Color_6",
-            "Color_7",
-            "Color_8",
-            "Color_9",
-            "Color_10",
-            "Color_11",
-            "Color_12",
-            "Color_13",
-            "Color_14",
-            "Color_15",
-            "Color_16",
-            "Color_17",
-            "Color_18",
-            "Color_19",
-            "Color_20",
-            "Color_21",
-            "Color_22",
-            "Color_23",
-            "Color_24",
-            "Color_25",
-            "Color_26",
-            "Color_27",
-            "Color_28",
-            "Color_29",
-            "Color_30",
-            "Color_31",
-            "Color_32",
-            "Color_33",
-            "Color_34",
-            "Color_35",
-            "Color_36",
-            "Color_37",
-            "Color_38",
-            "Color_39",
-            "Color_40",
-            "Color_41",
-            "Color_42",
-            "Color_43",
-            "Color_44",
-            "Color_45",
-            "Color_46",
-            "Color_47",
-            "Color_48",
-            "Color_49",
-            "Color_50",
-            "Color_51",
-            "Color_52",
-            "Color_53",
-            "Color_54",
-            "Color_55",
-            "Color_56",
-            "Color_57",
-            "Color_58",
-            "Color_59",
-            "Color_60",
-            "Color_61",
-            "Color_62",
-            "Color_63",
-            "Color_64",
-            "Color_65",
-            "Color_66",
-            "Color_67",
-            "Color_68",
-            "Color_69",
-            "Color_70",
-            "Color_71",
-            "Color_72",
-            "Color_73",
-            "Color_74",
-            "Color_75",
-            "Color_76",
-            "Color_77",
-            "Color_78",
-            "Color_79",
-            "Color_80",
-            "Color_81",
-            "Color_82",
-            "Color_83",
-            "Color_84",
-            "Color_85",
-            "Color_86",
-            "Color_87",
-            "Color_88",
-            "Color_89",
-            "Color_90",
-            "Color_91",
-            "Color_92",
-            "Color_93",
-            "Color_94",
-            "Color_95",
-            "Color_96",
-            "Color_97",
-            "Color_98",
-            "Color_99",
-            "Color_100",
-            "Color_101",
-            "Color_102",
-            "Color_103",
-            "Color_104",
-            "Color_105",
-            "Color_106",
-            "Color_107",
-            "Color_108",
-            "Color_109",
-            "Color_110",
-            "Color_111",
-            "Color_112",
-            "Color_113",
-            "Color_114",
-            "Color_115",
-            "Color_116",
-            "Color_117",
-            "Color_118",
-            "Color_119",
-            "Color_120",
-            "Color_121",
-            "Color_122",
-            "Color_123",
-            "Color_124",
-            "Color_125",
-            "Color_126",
-            "Color_127",
-            "Color_128",
-            "Color_129",
-            "Color_130",
-            "Color_131",
-            "Color_132",
-            "Color_133",
-            "Color_134",
-            "Color_135",
-            "Color_136",
-            "Color_137",
-            "Color_138",
-            "Color_139",
-            "Color_140",
-            "Color_141",
-            "Color_142",
-            "Color_143",
-            "Color_144",
-            "Color_145",
-            "Color_146",
-            "Color_147",
-            "Color_148",
-            "Color_149",
-            "Color_150",
-            "Color_151",
-            "Color_152",
-            "Color_153",
-            "Color_154",
-            "Color_155",
-            "Color_156",
-            "Color_157",
-            "Color_158",
-            "Color_159",
-            "Color_160",
-            "Color_161",
-            "Color_162",
-            "Color_163",
-            "Color_164",
-            "Color_165",
-            "Color_166",
-            "Color_167",
-            "Color_168",
-            "Color_169",
-            "Color_170",
-            "Color_171",
-            "Color_172",
-            "Color_173",
-            "Color_174",
-            "Color_175",
-            "Color_176",
-            "Color_177",
-            "Color_178",
-            "Color_179",
-            "Color_180",
-            "Color_181",
-            "Color_182",
-            "Color_183",
-            "Color_184",
-            "Color_185",
-            "Color_186",
-            "Color_187",
-            "Color_188",
-            "Color_189",
-            "Color_190",
-            "Color_191",
-            "Color_192",
-            "Color_193",
-            "Color_194",
-            "Color_195",
-            "Color_196",
-            "Color_197",
-            "Color_198",
-            "Color_199",
-            "Color_200",
-            "Color_201",
-            "Color_202",
-            "Color_203",
-            "Color_204",
-            "Color_205",
-            "Color_206",
-            "Color_207",
-            "Color_208",
-            "Color_209",
-            "Color_210",
-            "Color_211",
-            "Color_212",
-            "Color_213",
-            "Color_214",
-            "Color_215",
-            "Color_216",
-            "Color_217",
-            "Color_218",
-            "Color_219",
-            "Color_220",
-            "Color_221",
-            "Color_222",
-            "Color_223",
-            "Color_224",
-            "Color_225",
-            "Color_226",
-            "Color_227",
-            "Color_228",
-            "Color_229",
-            "Color_230",
-            "Color_231",
-            "Color_232",
-            "Color_233",
-            "Color_234",
-            "Color_235",
-            "Color_236",
-            "Color_237",
-            "Color_238",
-            "Color_239",
-            "Color_240",
-            "Color_241",
-            "Color_242",
-            "Color_243",
-            "Color_244",
-            "Color_245",
-            "Color_246",
-            "Color_247",
-            "Color_248",
-            "Color_249",
-            "Color_250",
-            "Color_251",
-            "Color_252",
-            "Color_253",
-            "Color_254",
-            "Color_255",
-            "Color_256",
-            "Color_257",
-            "Color_258",
-            "Color_259",
-            "Color_260",
-            "Color_261",
-            "Color_262",
-            "Color_263",
-            "Color_264",
-            "Color_265",
-            "Color_266",
-            "Color_267",
-            "Color_268",
-            "Color_269",
-            "Color_270",
-            "Color_271",
-            "Color_272",
-            "Color_273",
-            "Color_274",
-            "Color_275",
-            "Color_276",
-            "Color_277",
-            "Color_278",
-            "Color_279",
-            "Color_280",
-            "Color_281",
-            "Color_282",
-            "Color_283",
-            "Color_284",
-            "Color_285",
-            "Color_286",
-            "Color_287",
-            "Color_288",
-            "Color_289",
-            "Color_290",
-            "Color_291",
-            "Color_292",
-            "Color_293",
-            "Color_294",
-            "Color_295",
-            "Color_296",
-            "Color_297",
-            "Color_298",
-            "Color_299",
-            "Color_300",
-            "Color_301",
-            "Color_302",
-            "Color_303",
-            "Color_304",
-            "Color_305",
-            "Color_306",
-            "Color_307",
-            "Color_308",
-            "Color_309",
-            "Color_310",
-            "Color_311",
-            "Color_312",
-            "Color_313",
-            "Color_314",
-            "Color_315",
-            "Color_316",
-            "Color_317",
-            "Color_318",
-            "Color_319",
-            "Color_320",
-            "Color_321",
-            "Color_322",
-            "Color_323",
-            "Color_324",
-            "Color_325",
-            "Color_326",
-            "Color_327",
-            "Color_328",
-            "Color_329",
-            "Color_330",
-            "Color_331",
-            "Color_332",
-            "Color_333",
-            "Color_334",
-            "Color_335",
-            "Color_336",
-            "Color_337",
-            "Color_338",
-            "Color_339",
-            "Color_340",
-            "Color_341",
-            "Color_342",
-            "Color_343",
-            "Color_344",
-            "Color_345",
-            "Color_346",
-            "Color_347",
-            "Color_348",
-            "Color_349",
-            "Color_350",
-            "Color_351",
-            "Color_352",
-            "Color_353",
-            "Color_354",
-            "Color_355",
-            "Color_356",
-            "Color_357",
-            "Color_358",
-            "Color_359",
-            "Color_360",
-            "Color_361",
-            "Color_362",
-            "Color_363",
-            "Color_364",
-            "Color_365",
-            "Color_366",
-            "Color_367",
-            "Color_368",
-            "Color_369",
-            "Color_370",
-            "Color_371",
-            "Color_372",
-            "Color_373",
-            "Color_374",
-            "Color_375",
-            "Color_376",
-            "Color_377",
-            "Color_378",
-            "Color_379",
-            "Color_380",
-            "Color_381",
-            "Color_382",
-            "Color_383",
-            "Color_384",
-            "Color_385",
-            "Color_386",
-            "Color_387",
-            "Color_388",
-            "Color_389",
-            "Color_390",
-            "Color_391",
-            "Color_392",
-            "Color_393",
-            "Color_394",
-            "Color_395",
-            "Color_396",
-            "Color_397",
-            "Color_398",
-            "Color_399",
-            "Color_400",
-            "Color_401",
-            "Color_402",
-            "Color_403",
-            "Color_404",
-            "Color_405",
-            "Color_406",
-            "Color_407",
-            "Color_408",
-            "Color_409",
-            "Color_410",
-            "Color_411",
-            "Color_412",
-            "Color_413",
-            "Color_414",
-            "Color_415",
-            "Color_416",
-            "Color_417",
-            "Color_418",
-            "Color_419",
-            "Color_420",
-            "Color_421",
-            "Color_422",
-            "Color_423",
-            "Color_424",
-            "Color_425",
-            "Color_426",
-            "Color_427",
-            "Color_428",
-            "Color_429",
-            "Color_430",
-            "Color_431",
-            "Color_432",
-            "Color_433",
-            "Color_434",
-            "Color_435",
-            "Color_436",
-            "Color_437",
-            "Color_438",
-            "Color_439",
-            "Color_440",
-            "Color_441",
-            "Color_442",
-            "Color_443",
-            "Color_444",
-            "Color_445",
-            "Color_446",
-            "Color_447",
-            "Color_448",
-            "Color_449",
-            "Color_450",
-            "Color_451",
-            "Color_452",
-            "Color_453",
-            "Color_454",
-            "Color_455",
-            "Color_456",
-            "Color_457",
-            "Color_458",
-            "Color_459",
-            "Color_460",
-            "Color_461",
-            "Color_462",
-            "Color_463",
-            "Color_464",
-            "Color_465",
-            "Color_466",
-            "Color_467",
-            "Color_468",
-            "Color_469",
-            "Color_470",
-            "Color_471",
-            "Color_472",
-            "Color_473",
-            "Color_474",
-            "Color_475",
-            "Color_476",
-            "Color_477",
-            "Color_478",
-            "Color_479",
-            "Color_480",
-            "Color_481",
-            "Color_482",
-            "Color_483",
-            "Color_484",
-            "Color_485",
-            "Color_486",
-            "Color_487",
-            "Color_488",
-            "Color_489",
-            "Color_490",
-            "Color_491",
-            "Color_492",
-            "Color_493",
-            "Color_494",
-            "Color_495",
-            "Color_496",
-            "Color_497",
-            "Color_498",
-            "Color_499",
-            "Color_500",
-            "Color_501",
-            "Color_502",
-            "Color_503",
-            "Color_504",
-            "Color_505",
-            "Color_506",
-            "Color_507",
-            "Color_508",
-            "Color_509",
-            "Color_509",
-            "Color_510",
-            "Color_511",
-            "Textura_LBP",
-            "Textura_GLCM_Contrast",
-            "Forma_Area",
-            "Forma_Perimetro",
-            "Forma_Circularidad",
-        ]
-
-        # Crear un DataFrame con los nombres de las características
-        features_df = pd.DataFrame([features])
-
-        # Realizar la predicción con el DataFrame
-        prediction = model.predict(features_df)
+        # Realizar la predicción con la fila contigua de características
+        with stage("predict"):
+            prediction = model.predict(FEATURE_SCHEMA.as_matrix(features))
         # Convertir la predicción a un tipo serializable (como int)
         prediction = int(prediction[0])
         return prediction
@@ -675,65 +164,655 @@ def predict_image_class(image_path, model_path="papas.pkl"):
         return None
 
 
+# Función para predecir varias filas de características con una sola llamada al modelo
+def predict_feature_rows(rows, model_path=None):
+    if model_path is None:
+        model_path = app.config["MODEL_PATH"]
+    model = get_registry(model_path, validator=FEATURE_SCHEMA.check_model).get()
+
+    with stage("predict"):
+        predictions = model.predict(FEATURE_SCHEMA.as_matrix(rows))
+    return [int(prediction) for prediction in predictions]
+
+
+# Los archivos descomprimidos de un .zip superan BATCH_MAX_BYTES en total
+class BatchTooLarge(Exception):
+    pass
+
+
+# Obtener las imágenes del lote: varios archivos "files" o un .zip en "archive".
+# Produce (nombre, bytes, error); del .zip se omiten los archivos que no son imágenes
+# (solo se leen sus primeros bytes). Cada archivo del .zip se descomprime cuando se
+# pide el siguiente, sin pasar de MAX_UPLOAD_BYTES (aunque su cabecera diga menos)
+# ni de BATCH_MAX_BYTES entre todos (si no, lanza BatchTooLarge).
+def read_batch_files(files):
+    if "archive" in files:
+        max_size = app.config["MAX_UPLOAD_BYTES"]
+        remaining = app.config["BATCH_MAX_BYTES"]
+        with zipfile.ZipFile(files["archive"].stream) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/"):
+                    continue
+                if info.file_size > max_size:
+                    yield name, None, "File too large"
+                    continue
+                with archive.open(info) as member:
+                    head = member.read(SNIFF_BYTES)
+                    if sniff_type(head) not in IMAGE_TYPES:
+                        continue
+                    if info.file_size > remaining:
+                        raise BatchTooLarge()
+                    image_data = head + member.read(min(max_size, remaining) + 1 - len(head))
+                if len(image_data) > max_size:
+                    yield name, None, "File too large"
+                    continue
+                if len(image_data) > remaining:
+                    raise BatchTooLarge()
+                remaining -= len(image_data)
+                yield name, image_data, None
+    else:
+        for file in files.getlist("files"):
+            error = check_image_file(file)
+            if error is None:
+                yield file.filename, file.read(), None
+            else:
+                yield file.filename, None, upload_error_message(error)
+
+
+# Opciones de la imagen procesada que se devuelve (por defecto, PNG completo)
+DEFAULT_IMAGE_OUTPUT = {
+    "image_format": "png",
+    "quality": None,
+    "max_side": None,
+    "mask_bits": 8,
+    "mask_encoding": "png",
+}
+
+
+# Ejecutar el pipeline completo para una imagen subida. Es un generador: primero
+# produce la predicción (None si falla) y después la salida codificada según
+# `output` como (bytes, tipo MIME, metadatos), de modo que la etiqueta se puede
+# enviar antes de codificar la imagen.
+def iter_prediction(image_data, filename, output=None):
+    output = output or DEFAULT_IMAGE_OUTPUT
+    # La caché guarda siempre el PNG completo; otros formatos se obtienen a partir
+    # de él (la máscara no se puede recuperar del PNG compuesto: no usa la caché)
+    canonical = output == DEFAULT_IMAGE_OUTPUT
+    with_image = output["image_format"] != "none"
+
+    # Reintentos de la misma foto con el mismo modelo y ajustes: devolver lo guardado
+    cache_key = None
+    if result_cache.enabled and output["image_format"] != "mask":
+        model_registry.get()
+        with stage("cache"):
+            cache_key = ResultCache.key(
+                image_data, model_registry.model_hash, feature_store.extractor
+            )
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            prediction, image_png = cached
+            yield prediction
+            if canonical:
+                yield image_png, "image/png", {"image_format": "png"}
+            elif with_image:
+                yield encode_output(Image.open(io.BytesIO(image_png)), **output)
+            return
+
+    # Sin imagen en la respuesta basta con las características: si ya están en
+    # feature_store no hace falta decodificar ni quitar el fondo
+    store_key = feature_store.key(image_data)
+    if not with_image:
+        features = stored_features(store_key)
+        if features is not None:
+            yield predict_feature_rows([features])[0]
+            return
+
+    with artifact_store.scope() as artifacts:
+        if app.config["DEBUG_IMAGES"]:
+            artifacts.save(filename, image_data)
+        # Reservar la memoria de la petición, decodificar y eliminar el fondo de la
+        # imagen (un único buffer RGB modificado en el sitio)
+        with admitted_image(image_data) as image, remove_background(image) as processed_image:
+            # Realizar la predicción con la imagen sin fondo
+            prediction = predict_image_class(
+                feature_image(processed_image), store_key=store_key
+            )
+            print("Predicción: ", prediction)
+
+            # Después de la predicción: to_image() compone el buffer sobre blanco
+            # si la versión de las características no lo necesitaba
+            if app.config["DEBUG_IMAGES"]:
+                artifacts.save("remove_back.png", processed_image.to_image())
+            yield prediction
+            if prediction is None or not with_image:
+                return
+
+            # Codificar la imagen procesada directamente desde memoria
+            result = encode_output(processed_image, **output)
+
+    if cache_key is not None and canonical:
+        result_cache.put(cache_key, prediction, result[0])
+    yield result
+
+
+# Predicción e imagen procesada en PNG, o (None, None) si falla la predicción
+def predict_upload(image_data, filename):
+    results = iter_prediction(image_data, filename)
+    prediction = next(results)
+    if prediction is None:
+        return None, None
+    image_png, _, _ = next(results)
+    return prediction, image_png
+
+
+# Contadores de las subidas aceptadas y rechazadas (y de los bytes que no se leyeron)
+upload_stats = UploadStats()
+
+
+# Archivos de la petición (request.files) o una respuesta de error si se rechazó al
+# leerla: cuerpo o archivo demasiado grande (413) o archivo que no es PNG/JPEG (415)
+def parse_upload_files():
+    try:
+        return request.files, None
+    except RequestEntityTooLarge:
+        upload_stats.reject("too_large", request.content_length)
+        return None, (jsonify({"error": "Upload too large"}), 413)
+    except UploadRejected as e:
+        upload_stats.reject(e.reason, request.content_length, e.bytes_read)
+        return None, (jsonify({"error": upload_error_message(e)}), e.status)
+
+
+def upload_error_message(error):
+    return "File too large" if error.status == 413 else "Unsupported file type"
+
+
+# Comprobar que un archivo subido es una imagen por sus primeros bytes (no por la
+# extensión) y contarlo como aceptado o rechazado. Devuelve None o el error
+# (UploadRejected) si el archivo se descartó al leerlo o no es PNG/JPEG.
+def check_image_file(file):
+    stream = file.stream
+    error = stream.rejected
+    if error is None and stream.kind not in IMAGE_TYPES:
+        error = UploadRejected("Tipo de archivo no admitido", 415, "unsupported_type")
+    if error is not None:
+        upload_stats.reject(error.reason, stream.received, stream.received)
+        return error
+    upload_stats.accept(stream.received)
+    return None
+
+
+# Obtener el archivo subido en "file" o una respuesta de error
+def get_uploaded_file():
+    files, error = parse_upload_files()
+    if error is not None:
+        return None, error
+
+    # Verificar si se envió un archivo
+    if "file" not in files:
+        return None, (jsonify({"error": "No file part in the request"}), 400)
+
+    file = files["file"]
+    if file.filename == "":
+        return None, (jsonify({"error": "Invalid or missing file name"}), 400)
+
+    # Verificar que el contenido sea una imagen PNG o JPEG
+    error = check_image_file(file)
+    if error is not None:
+        return None, (jsonify({"error": upload_error_message(error)}), error.status)
+    return file, None
+
+
+# Opciones de la imagen devuelta: ?image=png|jpeg|webp|mask|none, ?quality=1-100
+# (JPEG y WebP), ?max_side=N para una miniatura y, con image=mask, ?mask_bits=1|8
+# y ?mask_encoding=png|rle. Devuelve (opciones, respuesta de error)
+def get_image_output():
+    image_format = request.values.get("image", "png").lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in ("mask", "none") and image_format not in IMAGE_FORMATS:
+        return None, (jsonify({"error": f"Unsupported image format: {image_format}"}), 400)
+
+    try:
+        quality, max_side, mask_bits = (
+            int(request.values[name]) if request.values.get(name) else None
+            for name in ("quality", "max_side", "mask_bits")
+        )
+    except ValueError:
+        return None, (jsonify({"error": "quality, max_side and mask_bits must be integers"}), 400)
+    if quality is not None and not 1 <= quality <= 100:
+        return None, (jsonify({"error": "quality must be between 1 and 100"}), 400)
+    if max_side is not None and max_side < 1:
+        return None, (jsonify({"error": "max_side must be positive"}), 400)
+    if mask_bits not in (None, 1, 8):
+        return None, (jsonify({"error": "mask_bits must be 1 or 8"}), 400)
+    mask_encoding = request.values.get("mask_encoding", "png").lower()
+    if mask_encoding not in MASK_ENCODINGS:
+        return None, (jsonify({"error": f"Unsupported mask encoding: {mask_encoding}"}), 400)
+
+    return {
+        "image_format": image_format,
+        "quality": quality,
+        "max_side": max_side,
+        "mask_bits": mask_bits or 8,
+        "mask_encoding": mask_encoding,
+    }, None
+
+
+# Cuerpo NDJSON: una línea con la predicción y, después, otra con la imagen
+def ndjson_body(prediction, results):
+    yield json.dumps({"prediction": prediction}) + "\n"
+    try:
+        data, _, info = next(results, (None, None, None))
+    except Exception as e:
+        app.logger.error(f"Error al codificar la imagen: {str(e)}")
+        yield json.dumps({"error": "Image encoding failed"}) + "\n"
+        return
+    if data is not None:
+        with stage("base64"):
+            encoded_image = base64.b64encode(data).decode("utf-8")
+        yield json.dumps({"image": encoded_image, **info}) + "\n"
+
+
+# Cuerpo multipart/mixed: una parte JSON con la predicción y otra con la imagen en
+# binario (sus metadatos van en la cabecera X-Image-Info de la parte)
+def multipart_body(prediction, results, boundary):
+    yield (
+        f"--{boundary}\r\nContent-Type: application/json\r\n\r\n"
+        f"{json.dumps({'prediction': prediction})}\r\n"
+    ).encode("utf-8")
+    try:
+        data, mimetype, info = next(results, (None, None, None))
+    except Exception as e:
+        app.logger.error(f"Error al codificar la imagen: {str(e)}")
+        data = None
+    if data is not None:
+        yield (
+            f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+            f"X-Image-Info: {json.dumps(info)}\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n"
+        ).encode("utf-8") + data + b"\r\n"
+    yield f"--{boundary}--\r\n".encode("utf-8")
+
+
+# Respuesta para una imagen que no cabe en el presupuesto de memoria (413) o que
+# no se puede admitir ahora porque el worker no tiene memoria libre (503)
+def memory_error(error):
+    app.logger.warning(str(error))
+    if isinstance(error, MemoryBusy):
+        response = jsonify({"error": "Server busy, try again later"})
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response, 503
+    return jsonify({"error": "Image too large"}), 413
+
+
+# ?response= elige el formato de la respuesta de /predict:
+# - json (por defecto): {"prediction", "image"} con la imagen en Base64
+# - ndjson / multipart: la predicción se envía en cuanto está lista y la imagen
+#   se codifica y se envía después en la misma respuesta
+# - binary: la imagen en binario con la predicción en la cabecera X-Prediction
+#   (y los metadatos, p. ej. de la máscara, en X-Image-Info)
 @app.route("/predict", methods=["POST"])
 def predict():
     try:
-        # Verificar si se envió un archivo
-        if "file" not in request.files:
-            return jsonify({"error": "No file part in the request"}), 400
+        file, error = get_uploaded_file()
+        if error is not None:
+            return error
+        output, error = get_image_output()
+        if error is not None:
+            return error
+        response_format = request.values.get("response", "json").lower()
+        if response_format not in ("json", "ndjson", "multipart", "binary"):
+            return jsonify({"error": f"Unsupported response format: {response_format}"}), 400
+        if response_format == "binary" and output["image_format"] == "none":
+            return jsonify({"error": "A binary response needs an image"}), 400
+
+        # Leer el archivo en memoria (sin guardarlo en disco)
+        results = iter_prediction(file.read(), file.filename, output)
+        prediction = next(results)
+
+        if prediction is None:
+            results.close()
+            return jsonify({"error": "Prediction failed"}), 500
+
+        if response_format == "ndjson":
+            return Response(ndjson_body(prediction, results), mimetype="application/x-ndjson")
+
+        if response_format == "multipart":
+            boundary = uuid.uuid4().hex
+            body = multipart_body(prediction, results, boundary)
+            return Response(body, mimetype=f"multipart/mixed; boundary={boundary}")
+
+        data, mimetype, info = next(results, (None, None, None))
+        if response_format == "binary":
+            response = Response(data, mimetype=mimetype)
+            response.headers["X-Prediction"] = str(prediction)
+            response.headers["X-Image-Info"] = json.dumps(info)
+            return response
+
+        # Retornar la predicción y la imagen (codificada en Base64) en JSON
+        body = {"prediction": prediction}
+        if data is not None:
+            with stage("base64"):
+                body["image"] = base64.b64encode(data).decode("utf-8")
+            if output != DEFAULT_IMAGE_OUTPUT:
+                body.update(info)
+        return jsonify(body), 200
+
+    except ArtifactStoreFull as e:
+        app.logger.warning(str(e))
+        return jsonify({"error": "Server busy, try again later"}), 503
+
+    except (ImageTooLarge, MemoryBusy) as e:
+        return memory_error(e)
+
+    except Exception as e:
+        # Capturar errores inesperados y registrar para depuración
+        app.logger.error(f"Error durante la predicción: {str(e)}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+
+# Predicción por lotes: las imágenes se procesan en paralelo y el modelo se llama
+# una sola vez con la matriz completa de características. Como mucho hay 2 imágenes
+# por hilo de batch_executor en curso: la siguiente se lee (o se descomprime del
+# .zip) cuando termina una, así que los bytes del lote no se acumulan en memoria.
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    pending = {}
+    try:
+        # Un archivo rechazado del lote se reporta por separado, sin cortar la petición
+        request.max_content_length = app.config["BATCH_MAX_BYTES"]
+        request.strict_uploads = False
+        files, error = parse_upload_files()
+        if error is not None:
+            return error
+        if "archive" not in files and "files" not in files:
+            return jsonify({"error": "No files or archive in the request"}), 400
+
+        # Reunir las características (por posición en el lote); los errores se
+        # reportan por imagen
+        results = []
+        rows = {}
+
+        def collect(futures):
+            for future in futures:
+                index = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    rows[index] = future.result()
+                    continue
+                results[index]["error"] = str(error)
+                # Su traza forma un ciclo con el futuro y retendría los bytes de la
+                # imagen hasta la siguiente pasada del recolector
+                error.__traceback__ = None
+
+        max_pending = 2 * app.config["BATCH_WORKERS"]
+        for filename, image_data, error in read_batch_files(files):
+            if len(results) >= app.config["BATCH_MAX_FILES"]:
+                return jsonify({"error": "Too many files in the batch"}), 413
+            results.append({"filename": filename})
+            if error is not None:
+                results[-1]["error"] = error
+                continue
+            if len(pending) >= max_pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            # Con el contexto de la petición, sus etapas entran en su Server-Timing
+            context = contextvars.copy_context()
+            future = batch_executor.submit(context.run, features_from_bytes, image_data)
+            pending[future] = len(results) - 1
+            image_data = None
+        collect(wait(pending).done)
+
+        if rows:
+            indexes = sorted(rows)
+            predictions = predict_feature_rows([rows[index] for index in indexes])
+            for index, prediction in zip(indexes, predictions):
+                results[index]["prediction"] = prediction
+
+        failed = sum(1 for result in results if "error" in result)
+        return jsonify({"count": len(results), "failed": failed, "results": results}), 200
+
+    except zipfile.BadZipFile:
+        return jsonify({"error": "Invalid zip archive"}), 400
+
+    except BatchTooLarge:
+        return jsonify({"error": "Batch too large"}), 413
 
-        file = request.files["file"]
+    except Exception as e:
+        app.logger.error(f"Error durante la predicción por lotes: {str(e)}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
-        # Verificar que el archivo tenga una extensión permitida
-        if file.filename == "" or not allowed_file(file.filename):
-            return jsonify({"error": "Invalid or missing file name"}), 400
+    finally:
+        # Si la petición termina antes de tiempo, no procesar las que no han empezado
+        for future in pending:
+            future.cancel()
 
-        # Crear el directorio de subida si no existe
-        if not os.path.exists(app.config["UPLOAD_FOLDER"]):
-            os.makedirs(app.config["UPLOAD_FOLDER"])
 
-        # Guardar el archivo temporalmente
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-        file.save(file_path)
+# Varios objetos en una foto (p. ej. una bandeja de patatas): cada componente de la
+# máscara de rembg se clasifica por separado con una sola llamada al modelo.
+# Devuelve la etiqueta, la caja [x, y, ancho, alto] y el área de cada objeto (en
+# píxeles de la imagen procesada), el número de objetos por etiqueta y la imagen
+# procesada (mismas opciones ?image= que /predict).
+@app.route("/predict/objects", methods=["POST"])
+def predict_objects():
+    try:
+        file, error = get_uploaded_file()
+        if error is not None:
+            return error
+        output, error = get_image_output()
+        if error is not None:
+            return error
+
+        with admitted_image(file.read()) as image, remove_background(image) as processed_image:
+            objects_image = feature_image(processed_image)
+            rows, components = process_objects(objects_image)
+            predictions = predict_feature_rows(rows) if components else []
+
+            # Las cajas se calcularon sobre la imagen de características
+            scale = processed_image.size[0] / objects_image.size[0]
+            objects = [
+                {
+                    "prediction": prediction,
+                    "box": [round(value * scale) for value in box],
+                    "area": round(area * scale * scale),
+                }
+                for prediction, (_, box, area) in zip(predictions, components)
+            ]
+            counts = {}
+            for prediction in predictions:
+                counts[str(prediction)] = counts.get(str(prediction), 0) + 1
+
+            body = {"count": len(objects), "counts": counts, "objects": objects}
+            if output["image_format"] != "none":
+                data, _, info = encode_output(processed_image, **output)
+                with stage("base64"):
+                    body["image"] = base64.b64encode(data).decode("utf-8")
+                if output != DEFAULT_IMAGE_OUTPUT:
+                    body.update(info)
+        return jsonify(body), 200
+
+    except (ImageTooLarge, MemoryBusy) as e:
+        return memory_error(e)
 
-        # Registrar que el archivo fue guardado
-        app.logger.info(f"Archivo guardado temporalmente en: {file_path}")
+    except Exception as e:
+        app.logger.error(f"Error durante la predicción de objetos: {str(e)}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
-        # Eliminar el fondo de la imagen
-        #background_removed_path = os.path.join(
- #           app.config["UPLOAD_FOLDER"], "background_removed.png"
-       # )
-        #remove_background(file_path, background_removed_path)
 
-        # Realizar la predicción con la imagen sin fondo
-        prediction = predict_image_class(file_path)
-        print("Predicción: ", prediction)
+# Trabajo asíncrono: mismo pipeline que /predict ejecutado por la cola de trabajos
+def run_prediction_job(payload):
+    image_data, filename = payload
+    prediction, image_png = predict_upload(image_data, filename)
+    if prediction is None:
+        raise ValueError("Prediction failed")
+    return prediction, image_png
 
-        if prediction is not None:
-            # Leer la imagen a procesada a enviar al usuario
-            with open("./uploads/remove_back.png", "rb") as image_file:
-                # Codificar la imagen en Base64
-                encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
 
-            # Opcional: borrar los archivos temporales
-            os.remove(file_path)
+job_queue = JobQueue(
+    run_prediction_job,
+    workers=int(os.environ.get("JOB_WORKERS", 2)),
+    max_pending=int(os.environ.get("JOB_QUEUE_SIZE", 16)),
+    ttl=int(os.environ.get("JOB_TTL", 600)),
+    # Bytes de las imágenes procesadas que se conservan hasta que se consultan
+    max_result_bytes=int(os.environ.get("JOB_RESULT_BYTES", 256 * 1024 * 1024)),
+    result_size=lambda result: len(result[1]),
+)
 
-            # Retornar la predicción y la imagen en JSON
-            return jsonify({"prediction": prediction, "image": encoded_image}), 200
 
-            os.remove("./uploads/remove_back.png")
-        else:
-            return jsonify({"error": "Prediction failed"}), 500
+# Enviar una imagen para procesarla en segundo plano; devuelve el id del trabajo
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    file, error = get_uploaded_file()
+    if error is not None:
+        return error
+
+    try:
+        job_id = job_queue.submit((file.read(), file.filename))
+    except QueueFull as e:
+        response = jsonify({"error": "Too many pending jobs, try again later"})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+
+# Estado de la cola de trabajos (pendientes, en curso, terminados)
+@app.route("/jobs", methods=["GET"])
+def jobs_stats():
+    return jsonify(job_queue.stats()), 200
+
+
+# Consultar el estado de un trabajo y, si terminó, su predicción e imagen
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    body = {"job_id": job_id, "status": job["status"]}
+    if job["status"] == "done":
+        prediction, image_png = job["result"]
+        body["prediction"] = prediction
+        body["image"] = base64.b64encode(image_png).decode("utf-8")
+    elif job["status"] == "failed":
+        body["error"] = job["error"]
+    return jsonify(body), 200
+
+
+# Información del modelo cargado (hash, tiempo de carga, recargas)
+@app.route("/model", methods=["GET"])
+def model_info():
+    return jsonify(
+        {
+            **model_registry.info(),
+            "feature_version": FEATURE_SCHEMA.version,
+            "rembg": rembg_pool.info(),
+        }
+    ), 200
+
+
+# Memoria reservada por las peticiones en curso y peticiones admitidas o rechazadas
+@app.route("/memory", methods=["GET"])
+def memory_stats():
+    return jsonify(memory_admission.stats()), 200
+
+
+# Subidas aceptadas y rechazadas (por tamaño o tipo) y bytes rechazados sin leer
+@app.route("/uploads", methods=["GET"])
+def uploads_stats():
+    return jsonify(upload_stats.stats()), 200
+
+
+# Estadísticas de la caché de resultados (aciertos, fallos, tamaño)
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    return jsonify(result_cache.stats()), 200
+
+
+# Estadísticas del almacén de características (filas guardadas, aciertos, fallos)
+@app.route("/features", methods=["GET"])
+def feature_store_stats():
+    return jsonify(feature_store.stats()), 200
+
+
+# Volver a puntuar con el modelo cargado todas las características guardadas en
+# feature_store (p. ej. después de cambiar papas.pkl) sin tocar ninguna imagen.
+# Devuelve el número de filas por etiqueta o, con ?response=ndjson, una línea
+# {"key", "prediction"} por fila (key: SHA-256 de la imagen subida, en hexadecimal).
+@app.route("/features/rescore", methods=["POST"])
+def rescore_features():
+    if not feature_store.enabled:
+        return jsonify({"error": "Feature store disabled"}), 404
+    response_format = request.values.get("response", "json").lower()
+    if response_format not in ("json", "ndjson"):
+        return jsonify({"error": f"Unsupported response format: {response_format}"}), 400
+
+    try:
+        model = model_registry.get()
+        if response_format == "ndjson":
+            body = (
+                "".join(
+                    json.dumps({"key": key, "prediction": int(prediction)}) + "\n"
+                    for key, prediction in zip(keys, predictions)
+                )
+                for keys, predictions in rescore(feature_store, model)
+            )
+            return Response(body, mimetype="application/x-ndjson")
+
+        start = time.perf_counter()
+        counts = {}
+        count = 0
+        with stage("predict"):
+            for _, predictions in rescore(feature_store, model):
+                count += len(predictions)
+                for prediction in predictions.tolist():
+                    counts[str(prediction)] = counts.get(str(prediction), 0) + 1
+        return jsonify(
+            {
+                "count": count,
+                "counts": counts,
+                "seconds": time.perf_counter() - start,
+                "model_sha256": model_registry.model_hash,
+                "extractor": feature_store.extractor,
+            }
+        ), 200
 
     except Exception as e:
-        # Capturar errores inesperados y registrar para depuración
-        app.logger.error(f"Error durante la predicción: {str(e)}")
+        app.logger.error(f"Error al volver a puntuar las características: {str(e)}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 
+# Los contadores de /model, /cache, /features, /jobs, /memory y /uploads también en
+# /metrics
+metrics_registry.add_collector("model", model_registry.info)
+metrics_registry.add_collector("rembg", rembg_pool.info)
+metrics_registry.add_collector("cache", result_cache.stats)
+metrics_registry.add_collector("feature_store", feature_store.stats)
+metrics_registry.add_collector("jobs", job_queue.stats)
+metrics_registry.add_collector("memory", memory_admission.stats)
+metrics_registry.add_collector("uploads", upload_stats.stats)
+
+
+# Métricas del worker en formato Prometheus: histogramas de la duración de cada
+# etapa del pipeline y de cada endpoint, con sus cuantiles, y los contadores de las
+# demás estadísticas. Con ?format=json, solo p50/p95/p99 y media en milisegundos.
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    if request.args.get("format") == "json":
+        return jsonify(
+            {
+                "enabled": metrics_registry.enabled,
+                "stages": metrics_registry.summary("stage_seconds", "stage"),
+                "endpoints": metrics_registry.summary("http_request_seconds", "endpoint"),
+            }
+        ), 200
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 # Iniciar el servidor de Flask
 if __name__ == "__main__":
-    if not os.path.exists(app.config["UPLOAD_FOLDER"]):
-        os.makedirs(app.config["UPLOAD_FOLDER"])
     port = int(os.environ.get("PORT", 8080))
     app.run(host="0.0.0.0", port=port, debug=True)
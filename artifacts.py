@@ -0,0 +1,88 @@
+import io
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+
+class ArtifactStoreFull(Exception):
+    pass
+
+
+# Espacio de trabajo aislado de una petición: cada petición escribe en
+# <root>/<clave única>/ en lugar de rutas fijas compartidas entre hilos.
+class RequestArtifacts:
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.path = os.path.join(store.root, key)
+        self.size = 0
+
+    # Guardar un artefacto (bytes o imagen de Pillow) y devolver su ruta
+    def save(self, name, data):
+        if isinstance(data, Image.Image):
+            with io.BytesIO() as byte_io:
+                data.save(byte_io, format="PNG")
+                data = byte_io.getvalue()
+        self.store._reserve(len(data))
+        self.size += len(data)
+
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, secure_filename(name) or "artifact")
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+
+# Almacén de artefactos por petición con límite de tamaño total.
+# Con keep=True (depuración) los directorios se conservan tras la petición y se
+# eliminan los más antiguos cuando se supera max_bytes.
+class ArtifactStore:
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, keep=False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._total = 0
+        self._kept = OrderedDict()
+
+    def _reserve(self, size):
+        with self._lock:
+            while self._total + size > self.max_bytes and self._kept:
+                key, kept_size = self._kept.popitem(last=False)
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+                self._total -= kept_size
+            if self._total + size > self.max_bytes:
+                raise ArtifactStoreFull(
+                    f"Se superó el límite de artefactos ({self.max_bytes} bytes)"
+                )
+            self._total += size
+
+    @contextmanager
+    def scope(self):
+        artifacts = RequestArtifacts(self, uuid.uuid4().hex)
+        try:
+            yield artifacts
+        finally:
+            self._release(artifacts)
+
+    def _release(self, artifacts):
+        with self._lock:
+            if self.keep and artifacts.size:
+                self._kept[artifacts.key] = artifacts.size
+                return
+            self._total -= artifacts.size
+        shutil.rmtree(artifacts.path, ignore_errors=True)
+
+    def info(self):
+        return {
+            "root": self.root,
+            "total_bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "kept_requests": len(self._kept),
+        }
@@ -0,0 +1,144 @@
+# Memoria reservada al pasar la imagen entre etapas (máscara -> recorte sobre
+# blanco -> características -> PNG): flujo anterior, con una imagen de Pillow
+# nueva en cada paso, frente al ImageBuffer único modificado en el sitio.
+# tracemalloc solo ve las reservas de NumPy y Python; el pico de RSS (VmHWM de
+# Linux) incluye también la memoria de Pillow. Cada variante se mide en un proceso
+# nuevo para que la memoria ya reservada por la otra no oculte su pico.
+#
+# Uso: python -m benchmarks.allocations --size 3000 [--rembg] [--json resultados.json]
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+from rembg.bg import naive_cutout
+
+import texture
+from benchmarks.texture import SAMPLE_IMAGE
+from features import extract_features
+from pipeline import ImageBuffer
+from pipeline import REMBG_MAX_SIDE
+from pipeline import composite_on_white
+from pipeline import encode_png
+from pipeline import rembg_pool
+
+VARIANTS = ("anterior", "buffer")
+
+
+# Flujo anterior: cada paso crea una imagen completa nueva (RGBA en el recorte)
+def run_previous(image, small_mask):
+    mask = small_mask.resize(image.size, Image.LANCZOS)
+    cutout = naive_cutout(image.convert("RGB"), mask).convert("RGBA")
+    background = Image.new("RGBA", cutout.size, (255, 255, 255, 255))
+    processed_image = Image.alpha_composite(background, cutout).convert("RGB")
+    features = extract_features(np.asarray(processed_image))
+    return features, encode_png(processed_image)
+
+
+# Flujo actual: una copia al buffer RGB y todo lo demás sobre él
+def run_buffer(image, small_mask):
+    with ImageBuffer(image) as buffer:
+        mask = small_mask.resize(image.size, Image.LANCZOS)
+        composite_on_white(buffer.array, np.asarray(mask))
+        buffer.composited = True
+        features = extract_features(buffer.array)
+        return features, encode_png(buffer)
+
+
+# Imagen de prueba y máscara a la resolución de rembg (real o una elipse sintética)
+def prepare(size, use_rembg):
+    image = Image.open(SAMPLE_IMAGE).convert("RGB").resize((size, size), Image.LANCZOS)
+    small_image = image.copy()
+    small_image.thumbnail((REMBG_MAX_SIDE, REMBG_MAX_SIDE), Image.LANCZOS)
+    if use_rembg:
+        return image, rembg_pool.predict_mask(small_image)
+    width, height = small_image.size
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(mask, (width // 2, height // 2), (width // 3, height // 3), 0, 0, 360, 255, -1)
+    return image, Image.fromarray(cv2.GaussianBlur(mask, (9, 9), 0))
+
+
+# Memoria residente actual y máxima del proceso en MB (Linux)
+def rss_mb():
+    with open("/proc/self/status") as status:
+        values = dict(line.split(":", 1) for line in status)
+    return int(values["VmRSS"].split()[0]) / 1024, int(values["VmHWM"].split()[0]) / 1024
+
+
+def measure(variant, image, small_mask):
+    run = run_previous if variant == "anterior" else run_buffer
+
+    # Reiniciar el pico de RSS (VmHWM) antes de medir
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+    rss_before, _ = rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    features, image_png = run(image, small_mask)
+    seconds = time.perf_counter() - start
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _, rss_peak = rss_mb()
+
+    stats = snapshot.statistics("filename")
+    return {
+        "seconds": seconds,
+        "rss_increase_mb": rss_peak - rss_before,
+        "tracemalloc_peak_mb": peak / 2**20,
+        "tracemalloc_blocks": sum(stat.count for stat in stats),
+        "features": features.tolist(),
+        "png_bytes": len(image_png),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memoria entre etapas del pipeline")
+    parser.add_argument("--size", type=int, default=3000)
+    parser.add_argument("--rembg", action="store_true", help="Usar la máscara real de rembg")
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.variant:
+        image, small_mask = prepare(args.size, args.rembg)
+        texture.warm_up()
+        print(json.dumps(measure(args.variant, image, small_mask)))
+        return 0
+
+    results = {}
+    for variant in VARIANTS:
+        command = [sys.executable, "-m", "benchmarks.allocations", "--variant", variant]
+        command += ["--size", str(args.size)] + (["--rembg"] if args.rembg else [])
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results[variant] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"Imagen de {args.size}x{args.size} ({args.size * args.size * 3 / 2**20:.1f} MB en RGB)")
+    print(f"{'variante':<10} {'tiempo':>8} {'RSS +MB':>8} {'tracemalloc MB':>15} {'bloques':>8}")
+    for variant, result in results.items():
+        print(
+            f"{variant:<10} {result['seconds']:7.3f}s {result['rss_increase_mb']:8.1f} "
+            f"{result['tracemalloc_peak_mb']:15.1f} {result['tracemalloc_blocks']:8d}"
+        )
+
+    identical = (
+        results["anterior"]["features"] == results["buffer"]["features"]
+        and results["anterior"]["png_bytes"] == results["buffer"]["png_bytes"]
+    )
+    print("Resultados idénticos:", "sí" if identical else "NO")
+
+    if args.json:
+        for result in results.values():
+            del result["features"]
+        with open(args.json, "w") as file:
+            json.dump({"size": args.size, "results": results}, file, indent=2)
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
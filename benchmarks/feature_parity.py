@@ -0,0 +1,76 @@
+# Prueba de regresión del extractor de características (features.py): compara la
+# fila float32 con el vector original (lista construida con .tolist() y skimage)
+# dentro de la tolerancia documentada en features.FEATURE_RTOL.
+#
+# Uso: python -m benchmarks.feature_parity [imágenes ...]
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import texture
+from benchmarks.texture import SAMPLE_IMAGE
+from benchmarks.texture import skimage_texture_features
+from features import FEATURE_COUNT
+from features import FEATURE_RTOL
+from features import extract_color_features
+from features import extract_features
+from features import extract_shape_features
+
+
+# Vector de características tal como lo calculaba process_single_image originalmente
+def reference_features(image):
+    gray_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    color_features = extract_color_features(image)
+    texture_features = skimage_texture_features(gray_image)
+    shape_features = extract_shape_features(gray_image)
+    return color_features.tolist() + texture_features + shape_features
+
+
+# Imágenes de prueba: las indicadas, la muestra del repositorio y una sintética
+def test_images(paths):
+    images = {path: np.asarray(Image.open(path).convert("RGB")) for path in paths}
+    rng = np.random.default_rng(0)
+    synthetic = np.full((480, 640, 3), 255, dtype=np.uint8)
+    cv2.ellipse(synthetic, (320, 240), (180, 120), 0, 0, 360, (170, 130, 80), -1)
+    synthetic[100:380, 140:500] ^= rng.integers(0, 24, (280, 360, 3), dtype=np.uint8)
+    images["sintética"] = synthetic
+    return images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regresión del vector de características")
+    parser.add_argument("images", nargs="*", default=[SAMPLE_IMAGE])
+    args = parser.parse_args(argv)
+
+    texture.warm_up()
+    failures = 0
+    for name, image in test_images(args.images).items():
+        start = time.perf_counter()
+        expected = np.asarray(reference_features(image), dtype=np.float64)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        row = extract_features(image)
+        elapsed = time.perf_counter() - start
+
+        ok = (
+            row.dtype == np.float32
+            and row.shape == (FEATURE_COUNT,)
+            and np.array_equal(row[:512], expected[:512].astype(np.float32))
+            and np.allclose(row, expected, rtol=FEATURE_RTOL, atol=0)
+        )
+        failures += not ok
+        max_error = np.max(np.abs(row - expected) / np.maximum(np.abs(expected), 1e-30))
+        print(
+            f"{name}: {'OK' if ok else 'FALLO'}  error relativo máx. {max_error:.2e}  "
+            f"original {reference_time:.3f} s, fusionado {elapsed:.3f} s"
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
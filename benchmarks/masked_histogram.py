@@ -0,0 +1,116 @@
+# Versión 1 de las características (imagen compuesta sobre blanco) frente a la
+# versión 2 (histograma HSV con la máscara de rembg, sin componer): tiempo de cada
+# una desde el buffer con la máscara ya calculada, peso del blanco añadido en el
+# histograma de la versión 1 y diferencias entre los dos vectores.
+#
+# Uso: python -m benchmarks.masked_histogram [imágenes ...] [--size 3000] [--rembg]
+#      [--repeat 3] [--json resultados.json]
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import texture
+from benchmarks.texture import SAMPLE_IMAGE
+from features import COLOR_BINS
+from features import WHITE_BIN
+from features import _color_histogram
+from features import extract_features
+from pipeline import ImageBuffer
+from pipeline import compute_mask
+from pipeline import composite_on_white
+
+NAMES = ("LBP", "GLCM", "área", "perímetro", "circularidad")
+
+
+# Imagen RGB y máscara a su tamaño (rembg o una elipse difuminada sintética)
+def prepare(path, size, use_rembg):
+    image = Image.open(path).convert("RGB")
+    if size:
+        image.thumbnail((size, size), Image.LANCZOS)
+    if use_rembg:
+        return image, np.asarray(compute_mask(image))
+    width, height = image.size
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(mask, (width // 2, height // 2), (width // 3, height // 3), 0, 0, 360, 255, -1)
+    return image, cv2.GaussianBlur(mask, (9, 9), 0)
+
+
+# Mejor tiempo de `repeat` ejecuciones; cada una parte de una copia del buffer
+# original porque la versión 1 lo compone en el sitio
+def run(version, buffer, mask, repeat):
+    times = []
+    for _ in range(repeat):
+        array = buffer.array.copy()
+        start = time.perf_counter()
+        if version == 1:
+            composite_on_white(array, mask)
+        row = extract_features(array, mask=mask, version=version)
+        times.append(time.perf_counter() - start)
+    return min(times), row, array
+
+
+def compare(name, image, mask, repeat):
+    with ImageBuffer(image) as buffer:
+        time_v1, row_v1, composited = run(1, buffer, mask, repeat)
+        time_v2, row_v2, _ = run(2, buffer, mask, repeat)
+
+    hist = _color_histogram(composited)
+    color_v1, color_v2 = row_v1[:COLOR_BINS], row_v2[:COLOR_BINS]
+    cosine = float(color_v1 @ color_v2) / float(np.linalg.norm(color_v1) * np.linalg.norm(color_v2))
+    return {
+        "image": name,
+        "size": list(image.size),
+        "object_fraction": float(np.count_nonzero(mask >= 128) / mask.size),
+        "white_bin_fraction_v1": float(hist[WHITE_BIN] / hist.sum()),
+        "white_bin_v1": float(color_v1[np.ravel_multi_index(WHITE_BIN, (8, 8, 8))]),
+        "color_cosine": cosine,
+        "seconds_v1": time_v1,
+        "seconds_v2": time_v2,
+        "other_v1": row_v1[COLOR_BINS:].tolist(),
+        "other_v2": row_v2[COLOR_BINS:].tolist(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Histograma con máscara frente a fondo blanco")
+    parser.add_argument("images", nargs="*", default=[SAMPLE_IMAGE])
+    parser.add_argument("--size", type=int, default=3000, help="Lado mayor (0 = sin reducir)")
+    parser.add_argument("--rembg", action="store_true", help="Usar la máscara real de rembg")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    texture.warm_up()
+    results = []
+    for path in args.images:
+        image, mask = prepare(path, args.size, args.rembg)
+        result = compare(path, image, mask, args.repeat)
+        results.append(result)
+
+        width, height = result["size"]
+        print(f"{path} ({width}x{height}, objeto {result['object_fraction']:.1%} de la imagen)")
+        print(
+            f"  tiempo: v1 (componer + extraer) {result['seconds_v1']:.3f} s, "
+            f"v2 (con máscara) {result['seconds_v2']:.3f} s"
+        )
+        print(
+            f"  color: el bin blanco tiene el {result['white_bin_fraction_v1']:.1%} de los "
+            f"píxeles en v1 (valor normalizado {result['white_bin_v1']:.3f}); "
+            f"similitud coseno v1/v2 {result['color_cosine']:.3f}"
+        )
+        for feature, v1, v2 in zip(NAMES, result["other_v1"], result["other_v2"]):
+            print(f"  {feature:<13} v1 {v1:14.4f}  v2 {v2:14.4f}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"size": args.size, "results": results}, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
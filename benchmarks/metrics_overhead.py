@@ -0,0 +1,111 @@
+# Coste de la instrumentación por etapas (metrics.py): tiempo de un `with stage()`
+# vacío con las métricas activadas y desactivadas (METRICS_ENABLED=0), dentro y
+# fuera de una petición, y tiempo del pipeline sin rembg (componer, características
+# y PNG) con y sin métricas, alternando las dos variantes en cada repetición.
+#
+# Uso: python -m benchmarks.metrics_overhead [imagen] [--size 3000] [--repeat 7]
+#      [--calls 200000] [--json resultados.json]
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import texture
+from benchmarks.masked_histogram import prepare
+from benchmarks.texture import SAMPLE_IMAGE
+from metrics import finish_request
+from metrics import metrics_registry
+from metrics import stage
+from metrics import start_request
+from pipeline import ImageBuffer
+from pipeline import encode_output
+from pipeline import feature_image
+from pipeline import process_single_image
+
+
+# Nanosegundos por `with stage()` vacío
+def stage_cost(calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        with stage("benchmark"):
+            pass
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def run_pipeline(image, mask):
+    with ImageBuffer(image) as buffer:
+        buffer.mask[...] = mask
+        row = process_single_image(feature_image(buffer))
+        encode_output(buffer)
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coste de las métricas por etapas")
+    parser.add_argument("image", nargs="?", default=SAMPLE_IMAGE)
+    parser.add_argument("--size", type=int, default=3000, help="Lado mayor (0 = sin reducir)")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    texture.warm_up()
+    results = {}
+    for enabled in (False, True):
+        metrics_registry.enabled = enabled
+        results[f"stage_ns_{'on' if enabled else 'off'}"] = stage_cost(args.calls)
+    start_request()
+    results["stage_ns_request"] = stage_cost(args.calls)
+    finish_request()
+
+    image, mask = prepare(args.image, args.size, use_rembg=False)
+    run_pipeline(image, mask)
+    times = {False: [], True: []}
+    for _ in range(args.repeat):
+        for enabled in (False, True):
+            metrics_registry.enabled = enabled
+            start_request()
+            start = time.perf_counter()
+            run_pipeline(image, mask)
+            times[enabled].append(time.perf_counter() - start)
+            stages = len(finish_request())
+    metrics_registry.enabled = True
+
+    results.update(
+        {
+            "image": args.image,
+            "size": list(image.size),
+            "stages_per_image": stages,
+            "seconds_off": statistics.median(times[False]),
+            "seconds_on": statistics.median(times[True]),
+        }
+    )
+    estimated = stages * results["stage_ns_request"] * 1e-9
+    results["estimated_overhead"] = estimated / results["seconds_off"]
+    results["measured_overhead"] = results["seconds_on"] / results["seconds_off"] - 1
+
+    print(
+        f"with stage(): {results['stage_ns_off']:.0f} ns desactivado, "
+        f"{results['stage_ns_on']:.0f} ns activado, "
+        f"{results['stage_ns_request']:.0f} ns dentro de una petición"
+    )
+    width, height = results["size"]
+    print(
+        f"{args.image} ({width}x{height}): {stages} etapas por imagen, "
+        f"mediana {results['seconds_off'] * 1000:.1f} ms sin métricas, "
+        f"{results['seconds_on'] * 1000:.1f} ms con métricas"
+    )
+    print(
+        f"  coste estimado {estimated * 1e6:.1f} µs ({results['estimated_overhead']:.4%}), "
+        f"diferencia medida {results['measured_overhead']:+.2%} (ruido incluido)"
+    )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
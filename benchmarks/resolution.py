@@ -0,0 +1,128 @@
+# Informe de precisión frente a latencia para distintas resoluciones de trabajo.
+# Compara las predicciones de cada configuración con las de la configuración
+# de referencia (la del pipeline original: 3000 px sin reducir para rembg).
+#
+# Uso: python -m benchmarks.resolution uploads/ --configs 3000:0:3000 3000:640:3000 1500:640:1500
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from model_registry import get_registry
+from pipeline import feature_image
+from pipeline import load_image
+from pipeline import process_single_image
+from pipeline import remove_background
+
+BASELINE = "3000:0:3000"
+DEFAULT_CONFIGS = [BASELINE, "3000:640:3000", "2000:640:2000", "1500:640:1500", "1000:320:1000"]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+# Ejecutar el pipeline con una configuración "decode:rembg:features" y medir cada etapa.
+# La predicción es None si no se pudieron extraer las características (máscara vacía).
+def run_config(image_data, config, model):
+    decode_side, rembg_side, feature_side = (int(value) for value in config.split(":"))
+    timings = {}
+
+    start = time.perf_counter()
+    image = load_image(image_data, max_side=decode_side)
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with remove_background(image, rembg_max_side=rembg_side) as processed_image:
+        timings["rembg"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        features = process_single_image(feature_image(processed_image, max_side=feature_side))
+        timings["features"] = time.perf_counter() - start
+
+    if features is None:
+        return None, timings
+    start = time.perf_counter()
+    prediction = int(model.predict(np.asarray([features]))[0])
+    timings["predict"] = time.perf_counter() - start
+    return prediction, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precisión frente a latencia por resolución")
+    parser.add_argument("images", help="Directorio con imágenes de muestra")
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS)
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "papas.pkl"))
+    parser.add_argument("--json", help="Guardar el informe en este archivo")
+    args = parser.parse_args(argv)
+
+    paths = sorted(
+        os.path.join(args.images, name)
+        for name in os.listdir(args.images)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    if not paths:
+        parser.error(f"no hay imágenes ({', '.join(IMAGE_EXTENSIONS)}) en {args.images}")
+    model = get_registry(args.model).get()
+    configs = [BASELINE] + [config for config in args.configs if config != BASELINE]
+
+    # Acuerdo con la referencia solo en las imágenes que ambas configuraciones procesan
+    report = {
+        config: {"agreement": 0, "compared": 0, "failed": 0, "timings": []}
+        for config in configs
+    }
+    for path in paths:
+        with open(path, "rb") as file:
+            image_data = file.read()
+        reference = None
+        for config in configs:
+            prediction, timings = run_config(image_data, config, model)
+            report[config]["timings"].append(timings)
+            if prediction is None:
+                report[config]["failed"] += 1
+                continue
+            if config == BASELINE:
+                reference = prediction
+            elif reference is not None:
+                report[config]["compared"] += 1
+                report[config]["agreement"] += int(prediction == reference)
+        if reference is not None:
+            report[BASELINE]["compared"] += 1
+            report[BASELINE]["agreement"] += 1
+
+    print(
+        f"{'config':<16}{'acuerdo':>10}{'fallos':>8}"
+        f"{'decode':>10}{'rembg':>10}{'features':>10}{'total':>10}"
+    )
+    summary = {}
+    for config in configs:
+        timings = report[config]["timings"]
+        # Las imágenes que fallan no llegan a la predicción
+        means = {
+            stage: float(np.mean([t[stage] for t in timings if stage in t] or [0.0]))
+            for stage in ("decode", "rembg", "features", "predict")
+        }
+        compared = report[config]["compared"]
+        failed = report[config]["failed"]
+        agreement = report[config]["agreement"] / compared if compared else None
+        summary[config] = {
+            "agreement": agreement,
+            "compared": compared,
+            "failed": failed,
+            "mean_seconds": means,
+        }
+        agreement_text = f"{agreement:.2%}" if agreement is not None else "-"
+        print(
+            f"{config:<16}{agreement_text:>10}{failed:>8}"
+            f"{means['decode']:>10.3f}{means['rembg']:>10.3f}"
+            f"{means['features']:>10.3f}{sum(means.values()):>10.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"images": len(paths), "configs": summary}, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
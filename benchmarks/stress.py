@@ -0,0 +1,66 @@
+# Prueba de estrés de concurrencia para /predict.
+# Envía muchas imágenes distintas a la vez y comprueba que cada respuesta
+# corresponde a su propia entrada (mismo resultado que en ejecución secuencial).
+#
+# Uso: python -m benchmarks.stress --requests 64 --concurrency 16
+import argparse
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from PIL import ImageDraw
+
+from app import app
+from app import result_cache
+
+
+# Crear una imagen sintética única: tamaño y color dependen del índice
+def make_image(index):
+    width, height = 320 + 7 * index, 240 + 5 * index
+    image = Image.new("RGB", (width, height), (30, 90 + index % 100, 40))
+    draw = ImageDraw.Draw(image)
+    color = (150 + index % 100, 110 + (3 * index) % 100, 60 + (7 * index) % 100)
+    draw.ellipse((width // 4, height // 4, 3 * width // 4, 3 * height // 4), fill=color)
+    with io.BytesIO() as byte_io:
+        image.save(byte_io, format="JPEG", quality=90)
+        return byte_io.getvalue()
+
+
+def post_image(index, image_data):
+    client = app.test_client()
+    response = client.post(
+        "/predict", data={"file": (io.BytesIO(image_data), f"potato_{index}.jpg")}
+    )
+    return response.status_code, response.get_json()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de estrés de /predict")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    # La referencia secuencial llenaría la caché de resultados y las peticiones
+    # concurrentes no pasarían por el pipeline: desactivarla
+    result_cache.max_entries = 0
+    images = [make_image(i) for i in range(args.requests)]
+
+    # Resultado de referencia en ejecución secuencial
+    expected = [post_image(i, data) for i, data in enumerate(images)]
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(post_image, range(len(images)), images))
+
+    failures = 0
+    for i, (result, reference) in enumerate(zip(results, expected)):
+        if result[0] != 200 or result != reference:
+            failures += 1
+            print(f"Respuesta {i} no coincide con su entrada: {result[0]} vs {reference[0]}")
+
+    print(f"{len(images) - failures}/{len(images)} respuestas correctas")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
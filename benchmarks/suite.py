@@ -0,0 +1,409 @@
+# Conjunto reproducible de benchmarks del pipeline de clasificación, con los
+# resultados en JSON para comparar entre commits:
+# - pipeline: imágenes de muestra y sintéticas a varias resoluciones por
+#   load_image, remove_background y predict_image_class, con el tiempo de cada etapa
+#   (metrics.stage), el de cada extract_*_features por separado, el pico de RSS y
+#   las imágenes/s de un solo cliente.
+# - load: /predict (u otro endpoint) con el cliente de pruebas de Flask a varias
+#   concurrencias: peticiones/s, latencias p50/p95/p99, códigos de respuesta,
+#   etapas (de Server-Timing) y pico de RSS. Corre en este proceso, sin gunicorn ni
+#   red: mide la aplicación, no el servidor.
+# - compare: dos JSON de la misma prueba; marca las etapas, tiempos y latencias
+#   que empeoran más de --threshold (y de --min-ms) y termina con 1 si hay alguna.
+#
+# Uso: python -m benchmarks.suite pipeline [imágenes o directorios ...]
+#      [--sizes 1000 2000 3000] [--synthetic 1] [--repeat 3] [--json base.json]
+#      python -m benchmarks.suite load [--concurrency 1 2 4 8] [--requests 32]
+#      [--size 1500] [--endpoint /predict] [--query image=none] [--cache] [--json carga.json]
+#      python -m benchmarks.suite compare base.json nuevo.json [--threshold 0.1]
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import pipeline
+import texture
+from benchmarks.allocations import rss_mb
+from benchmarks.texture import SAMPLE_IMAGE
+from features import FEATURE_VERSION
+from features import extract_color_features
+from features import extract_shape_features
+from metrics import finish_request
+from metrics import start_request
+from texture import extract_texture_features
+
+DEFAULT_SIZES = [1000, 2000, 3000]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+# Patata sintética reproducible: elipse marrón con textura sobre un fondo gris
+# claro con ruido, de lado mayor `size`
+def synthetic_image(size, seed=0):
+    rng = np.random.default_rng(seed)
+    width, height = size, round(size * 0.75)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[...] = rng.integers(170, 200, 3, dtype=np.uint8)
+    center = (int(width * rng.uniform(0.4, 0.6)), int(height * rng.uniform(0.4, 0.6)))
+    axes = (int(width * rng.uniform(0.2, 0.3)), int(height * rng.uniform(0.2, 0.3)))
+    color = tuple(int(value) for value in rng.integers((120, 80, 40), (170, 120, 70)))
+    cv2.ellipse(image, center, axes, rng.uniform(0, 180), 0, 360, color, -1)
+    noise = rng.normal(0, 12, (height, width, 1))
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(cv2.GaussianBlur(image, (5, 5), 0))
+
+
+def encode_jpeg(image, quality=90):
+    with io.BytesIO() as byte_io:
+        image.save(byte_io, format="JPEG", quality=quality)
+        return byte_io.getvalue()
+
+
+# Imagen reescalada para que su lado mayor sea `size`
+def resize_to(image, size):
+    scale = size / max(image.size)
+    width, height = image.size
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return image.resize(new_size, Image.LANCZOS)
+
+
+# Imágenes de muestra de los argumentos (archivos o directorios) como (nombre, Pillow)
+def sample_images(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            files.append(path)
+    return [(path, Image.open(path).convert("RGB")) for path in files]
+
+
+# Reiniciar el pico de RSS (VmHWM) del proceso; False si no se puede (no Linux)
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        return rss_mb()[1]
+    except OSError:
+        return None
+
+
+def format_rss(result):
+    return f"{result['peak_rss_mb']:8.0f}" if result["peak_rss_mb"] is not None else f"{'-':>8}"
+
+
+# Percentiles 50/95/99 (en ms) de una lista de segundos
+def percentiles(values):
+    if len(values) == 1:
+        return {f"p{q}_ms": values[0] * 1000 for q in (50, 95, 99)}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {f"p{q}_ms": cuts[q - 1] * 1000 for q in (50, 95, 99)}
+
+
+# Tiempo (s) de cada extract_*_features sobre la imagen completa ya compuesta
+def time_feature_functions(array):
+    timings = {}
+    start = time.perf_counter()
+    extract_color_features(array)
+    timings["extract_color_features"] = time.perf_counter() - start
+    gray_image = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+    start = time.perf_counter()
+    extract_texture_features(gray_image)
+    timings["extract_texture_features"] = time.perf_counter() - start
+    start = time.perf_counter()
+    extract_shape_features(gray_image)
+    timings["extract_shape_features"] = time.perf_counter() - start
+    return timings
+
+
+# Una imagen por el pipeline de /predict (sin HTTP): decodificar, quitar el fondo,
+# predecir y codificar el PNG. Devuelve (predicción, segundos, etapas, funciones)
+def run_pipeline_once(image_data, size):
+    from app import predict_image_class
+
+    start_request()
+    start = time.perf_counter()
+    image = pipeline.load_image(image_data, max_side=size)
+    with pipeline.remove_background(image) as processed_image:
+        features_image = pipeline.feature_image(processed_image)
+        prediction = predict_image_class(features_image)
+        pipeline.encode_output(processed_image)
+        seconds = time.perf_counter() - start
+        stages = {}
+        for name, stage_seconds in finish_request():
+            stages[name] = stages.get(name, 0.0) + stage_seconds
+        functions = time_feature_functions(features_image.composite().array)
+    return prediction, seconds, stages, functions
+
+
+def median_ms(runs):
+    names = {name for run in runs for name in run}
+    return {
+        name: statistics.median(run.get(name, 0.0) for run in runs) * 1000
+        for name in sorted(names)
+    }
+
+
+def benchmark_pipeline(name, image, size, repeat):
+    image_data = encode_jpeg(resize_to(image, size))
+    tracked = reset_peak_rss()
+    runs = [run_pipeline_once(image_data, size) for _ in range(repeat)]
+    seconds = statistics.median(run[1] for run in runs)
+    return {
+        "key": f"{name}@{size}",
+        "image": name,
+        "size": size,
+        "repeat": repeat,
+        "prediction": runs[-1][0],
+        "seconds": seconds,
+        "throughput": 1 / seconds,
+        "stages_ms": median_ms([run[2] for run in runs]),
+        "functions_ms": median_ms([run[3] for run in runs]),
+        "peak_rss_mb": peak_rss_mb() if tracked else None,
+    }
+
+
+def run_pipeline_suite(args):
+    from app import warm_up
+
+    images = sample_images(args.images) if args.images else sample_images([SAMPLE_IMAGE])
+    images += [
+        (f"synthetic-{seed}", synthetic_image(max(args.sizes), seed))
+        for seed in range(args.synthetic)
+    ]
+    warm_up()
+    run_pipeline_once(encode_jpeg(resize_to(images[0][1], min(args.sizes))), min(args.sizes))
+
+    results = []
+    print(f"{'imagen':<40}{'lado':>6}{'s':>8}{'img/s':>8}{'RSS MB':>8}  etapas (ms)")
+    for name, image in images:
+        for size in args.sizes:
+            result = benchmark_pipeline(name, image, size, args.repeat)
+            results.append(result)
+            stages = ", ".join(f"{stage} {ms:.1f}" for stage, ms in result["stages_ms"].items())
+            print(
+                f"{os.path.basename(name)[:39]:<40}{size:>6}{result['seconds']:8.3f}"
+                f"{result['throughput']:8.2f}{format_rss(result)}  {stages}"
+            )
+    return results
+
+
+# Parsear la cabecera Server-Timing: {etapa: segundos}
+def parse_server_timing(header):
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name and params.startswith("dur="):
+            timings[name] = float(params[4:]) / 1000
+    return timings
+
+
+def benchmark_load(client_factory, url, images, concurrency):
+    def post(index):
+        client = client_factory()
+        start = time.perf_counter()
+        response = client.post(
+            url, data={"file": (io.BytesIO(images[index]), f"potato_{index}.jpg")}
+        )
+        seconds = time.perf_counter() - start
+        timings = parse_server_timing(response.headers.get("Server-Timing"))
+        return response.status_code, seconds, timings
+
+    tracked = reset_peak_rss()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(post, range(len(images))))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _, _ in responses:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "key": f"concurrency={concurrency}",
+        "concurrency": concurrency,
+        "requests": len(images),
+        "seconds": elapsed,
+        "throughput": len(images) / elapsed,
+        "statuses": statuses,
+        **percentiles([seconds for _, seconds, _ in responses]),
+        "stages_ms": median_ms([timings for _, _, timings in responses]),
+        "peak_rss_mb": peak_rss_mb() if tracked else None,
+    }
+
+
+def run_load_suite(args):
+    import app as service
+
+    if not args.cache:
+        # Cada concurrencia repite las mismas imágenes: sin caché todas se procesan
+        service.result_cache.max_entries = 0
+    service.warm_up()
+    url = f"{args.endpoint}?{args.query}" if args.query else args.endpoint
+    images = [encode_jpeg(synthetic_image(args.size, seed)) for seed in range(args.requests)]
+    benchmark_load(service.app.test_client, url, images[:1], 1)
+
+    results = []
+    print(
+        f"{'clientes':>8}{'pet/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RSS MB':>8}  códigos"
+    )
+    for concurrency in args.concurrency:
+        result = benchmark_load(service.app.test_client, url, images, concurrency)
+        results.append(result)
+        print(
+            f"{concurrency:>8}{result['throughput']:8.2f}{result['p50_ms']:9.1f}"
+            f"{result['p95_ms']:9.1f}{result['p99_ms']:9.1f}{format_rss(result)}  "
+            f"{result['statuses']}"
+        )
+    return results
+
+
+# Commit, máquina y configuración del pipeline con la que se midió
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(
+            subprocess.run(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numba": texture.numba is not None,
+        "config": {
+            "DECODE_MAX_SIDE": pipeline.DECODE_MAX_SIDE,
+            "REMBG_MAX_SIDE": pipeline.REMBG_MAX_SIDE,
+            "FEATURE_MAX_SIDE": pipeline.FEATURE_MAX_SIDE,
+            "PROCESS_STAGES": sorted(pipeline.PROCESS_STAGES),
+            "FEATURE_VERSION": FEATURE_VERSION,
+        },
+    }
+
+
+# Valores comparables de un resultado: {nombre: (valor, mayor es peor)}
+def comparable(result):
+    values = {
+        "seconds": (result["seconds"] * 1000, True),
+        "throughput": (result["throughput"], False),
+    }
+    for name in ("p50_ms", "p95_ms", "p99_ms"):
+        if name in result:
+            values[name] = (result[name], True)
+    for group in ("stages_ms", "functions_ms"):
+        for name, ms in result.get(group, {}).items():
+            values[f"{group[:-3]}.{name}"] = (ms, True)
+    return values
+
+
+def compare(base, new, threshold, min_ms):
+    if base["suite"] != new["suite"]:
+        print(f"No se pueden comparar resultados de {base['suite']} y de {new['suite']}")
+        return 2
+    print(f"base {base['environment']['commit']} frente a {new['environment']['commit']}")
+    base_results = {result["key"]: result for result in base["results"]}
+    regressions = 0
+    for result in new["results"]:
+        if result["key"] not in base_results:
+            continue
+        base_values = comparable(base_results[result["key"]])
+        for name, (value, higher_is_worse) in comparable(result).items():
+            if name not in base_values or not base_values[name][0]:
+                continue
+            before = base_values[name][0]
+            change = value / before - 1
+            if abs(change) <= threshold:
+                continue
+            worse = change > 0 if higher_is_worse else change < 0
+            # Diferencias de menos de min_ms en etapas muy cortas son ruido
+            if worse and higher_is_worse and value - before < min_ms:
+                continue
+            regressions += worse
+            label = "PEOR " if worse else "mejor"
+            print(
+                f"  {label} {result['key']} {name}: {before:.2f} -> {value:.2f} ({change:+.1%})"
+            )
+    print(f"{regressions} regresiones (umbral {threshold:.0%}, {min_ms} ms)")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del pipeline de clasificación")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pipeline_parser = commands.add_parser("pipeline", help="Etapas del pipeline por resolución")
+    pipeline_parser.add_argument("images", nargs="*", help="Imágenes o directorios de muestra")
+    pipeline_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    pipeline_parser.add_argument("--synthetic", type=int, default=1, help="Imágenes sintéticas")
+    pipeline_parser.add_argument("--repeat", type=int, default=3)
+    pipeline_parser.add_argument("--json", help="Guardar los resultados en este archivo")
+
+    load_parser = commands.add_parser("load", help="Prueba de carga con el cliente de Flask")
+    load_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    load_parser.add_argument("--requests", type=int, default=32, help="Peticiones por nivel")
+    load_parser.add_argument("--size", type=int, default=1500, help="Lado mayor de las imágenes")
+    load_parser.add_argument("--endpoint", default="/predict")
+    load_parser.add_argument("--query", default="", help="Parámetros, p. ej. image=none")
+    load_parser.add_argument(
+        "--cache", action="store_true", help="Mantener la caché de resultados"
+    )
+    load_parser.add_argument("--json", help="Guardar los resultados en este archivo")
+
+    compare_parser = commands.add_parser("compare", help="Comparar dos resultados en JSON")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument("--min-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.base) as base_file, open(args.new) as new_file:
+            return compare(json.load(base_file), json.load(new_file), args.threshold, args.min_ms)
+
+    texture.warm_up()
+    if args.command == "pipeline":
+        results = run_pipeline_suite(args)
+    else:
+        results = run_load_suite(args)
+    if args.json:
+        report = {
+            "suite": args.command,
+            "environment": environment(),
+            "arguments": {name: value for name, value in vars(args).items() if name != "json"},
+            "results": results,
+        }
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# Comparación del motor de textura (texture.py) con la implementación original
+# de skimage: comprueba que los valores son idénticos bit a bit y mide el tiempo.
+#
+# Uso: python -m benchmarks.texture --size 3000 --repeat 3
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+from skimage.feature import graycomatrix
+from skimage.feature import graycoprops
+from skimage.feature import local_binary_pattern
+
+import texture
+
+SAMPLE_IMAGE = "uploads/processed_IMG_20240914_102742.jpg"
+
+
+# Implementación original (la que usaba pipeline.py)
+def skimage_texture_features(gray_image):
+    lbp = local_binary_pattern(gray_image, P=8, R=1, method="uniform")
+    glcm = graycomatrix(
+        gray_image, distances=[5], angles=[0], levels=256, symmetric=True, normed=True
+    )
+    contrast = graycoprops(glcm, "contrast")[0, 0]
+    return [float(lbp.mean()), float(contrast)]
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del motor de textura")
+    parser.add_argument("--size", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    sample = Image.open(SAMPLE_IMAGE).convert("RGB").resize((args.size, args.size), Image.LANCZOS)
+    rng = np.random.default_rng(0)
+    images = {
+        "muestra": cv2.cvtColor(np.asarray(sample), cv2.COLOR_RGB2GRAY),
+        "aleatoria": rng.integers(0, 256, (args.size, args.size), dtype=np.uint8),
+    }
+    engines = ["numpy"] + (["numba"] if texture.numba is not None else [])
+    if texture.numba is not None:
+        # Compilar antes de medir
+        texture.lbp_uniform_mean(images["aleatoria"][:16, :16], engine="numba")
+
+    failures = 0
+    for name, gray_image in images.items():
+        reference_time, reference = best_time(
+            lambda: skimage_texture_features(gray_image), args.repeat
+        )
+        print(f"{name} {gray_image.shape}: skimage {reference_time:.3f} s")
+        for engine in engines:
+            elapsed, result = best_time(
+                lambda: texture.extract_texture_features(gray_image, engine=engine), args.repeat
+            )
+            identical = result == reference
+            failures += not identical
+            print(
+                f"  {engine:<6} {elapsed:.3f} s  x{reference_time / elapsed:.1f}  "
+                f"{'idéntico' if identical else f'DIFERENTE {result} != {reference}'}"
+            )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# Rendimiento (imágenes/s) del pipeline con solo hilos frente al grupo de procesos
+# (PROCESS_STAGES), con 1, 2, 4 y 8 clientes concurrentes.
+#
+# Uso: python -m benchmarks.throughput --stages rembg,features --images 8
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import pipeline
+import texture
+from benchmarks.texture import SAMPLE_IMAGE
+
+
+# Una imagen completa: quitar el fondo y extraer las características
+def run_image(image, stages):
+    if "rembg" in stages:
+        with pipeline.remove_background(image) as processed_image:
+            return pipeline.process_single_image(processed_image)
+    return pipeline.process_single_image(np.asarray(image))
+
+
+def measure(image, stages, clients, images_per_client):
+    def client(_):
+        for _ in range(images_per_client):
+            run_image(image, stages)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+    return clients * images_per_client / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hilos frente a procesos")
+    parser.add_argument("--stages", default="rembg,features")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--images", type=int, default=4, help="Imágenes por cliente")
+    parser.add_argument("--size", type=int, default=3000)
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    stages = {stage for stage in args.stages.split(",") if stage}
+    image = Image.open(SAMPLE_IMAGE).convert("RGB").resize((args.size, args.size), Image.LANCZOS)
+    texture.warm_up()
+
+    results = {}
+    for mode in ("threads", "processes"):
+        pipeline.PROCESS_STAGES = stages if mode == "processes" else set()
+        # Calentar sesiones, compilación de numba y procesos hijos
+        run_image(image, stages)
+        for clients in args.clients:
+            throughput = measure(image, stages, clients, args.images)
+            results.setdefault(mode, {})[clients] = throughput
+            print(f"{mode:<10} clientes={clients:<3} {throughput:6.2f} imágenes/s")
+    pipeline.process_pool.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"stages": sorted(stages), "results": results}, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# Exportar el clasificador (papas.pkl) a ONNX para ejecutarlo con onnxruntime (ver
+# onnx_model.py). Se ejecuta al construir la imagen o al desplegar un modelo nuevo:
+#
+# - Convierte el modelo con skl2onnx (solo hace falta aquí, no en el servicio) y
+#   guarda en el ONNX el hash de papas.pkl, la versión y el número de características.
+# - Comprueba que las predicciones coinciden con las de scikit-learn en un conjunto
+#   de referencia: --reference (.npy o el CSV de pred.py --features), si no las
+#   filas guardadas en el almacén de características (FEATURE_STORE_DIR) y, si no
+#   hay ninguna, filas sintéticas (histogramas de color aleatorios y valores de
+#   textura y forma en una escala logarítmica amplia).
+# - Solo si coinciden escribe papas.onnx; si no se puede convertir o no coinciden
+#   termina con error y el servicio sigue usando el modelo de joblib.
+# - Muestra la latencia por llamada de los dos backends (1 fila y un lote).
+#
+# Uso: python export_onnx.py [--model papas.pkl] [--output papas.onnx]
+#      [--reference filas.npy] [--store DIR] [--rows 2000] [--json resultados.json]
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+import time
+
+import joblib
+import numpy as np
+
+try:
+    import onnx
+    from skl2onnx import to_onnx
+    from skl2onnx.common.data_types import FloatTensorType
+except ImportError:  # sin skl2onnx no se puede exportar: se usa el modelo de joblib
+    onnx = None
+
+from feature_store import iter_row_chunks
+from feature_store import select_store
+from features import COLOR_BINS
+from features import FEATURE_SCHEMA
+from model_registry import file_sha256
+from onnx_model import CLASSES
+from onnx_model import FEATURE_VERSION
+from onnx_model import N_FEATURES
+from onnx_model import SOURCE_SHA256
+from onnx_model import OnnxClassifier
+from onnx_model import onnx_path
+
+# Opsets que admite el onnxruntime de requirements.txt
+TARGET_OPSET = {"": 17, "ai.onnx.ml": 3}
+
+
+# Convertir el modelo de scikit-learn y añadir los metadatos que comprueba
+# OnnxClassifier. La salida es solo la etiqueta y las probabilidades como tensor
+# (sin ZipMap, que devuelve una lista de diccionarios)
+def convert(model, source_sha256, n_features):
+    exported = to_onnx(
+        model,
+        initial_types=[("features", FloatTensorType([None, n_features]))],
+        options={id(model): {"zipmap": False}},
+        target_opset=TARGET_OPSET,
+    )
+    onnx.helper.set_model_props(
+        exported,
+        {
+            SOURCE_SHA256: source_sha256,
+            FEATURE_VERSION: str(getattr(model, "feature_version_", 1)),
+            N_FEATURES: str(n_features),
+            CLASSES: json.dumps(np.asarray(model.classes_).tolist()),
+        },
+    )
+    return exported
+
+
+# Filas de referencia y su origen
+def reference_rows(model, reference=None, store=None, rows=2000, seed=0):
+    if reference:
+        return load_reference(reference)[:rows], reference
+    if store:
+        try:
+            feature_store = select_store(store, model)
+        except ValueError as e:
+            print(f"No se usan las filas guardadas: {e}")
+        else:
+            chunks = iter_row_chunks(feature_store, chunk_rows=rows)
+            keys, matrix = next(chunks, ([], None))
+            if len(keys):
+                return matrix, feature_store.path
+    return synthetic_rows(rows, seed), "sintéticas"
+
+
+# Matriz de un .npy o de las columnas de FEATURE_SCHEMA de un CSV de pred.py
+# --features (se omiten las imágenes que fallaron)
+def load_reference(path):
+    if path.endswith(".npy"):
+        return FEATURE_SCHEMA.as_matrix(np.load(path))
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = [header.index(name) for name in FEATURE_SCHEMA.names]
+        rows = [[row[index] for index in columns] for row in reader if row[columns[0]]]
+    return FEATURE_SCHEMA.as_matrix(np.array(rows, dtype=np.float64))
+
+
+# Filas sintéticas: histogramas de color dispersos normalizados como los de
+# extract_color_features (norma L2) y el resto de valores entre 1e-3 y 1e7
+def synthetic_rows(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    color = rng.random((rows, COLOR_BINS)) * (rng.random((rows, COLOR_BINS)) < 0.1)
+    color[:, 0] += 1e-6
+    color /= np.linalg.norm(color, axis=1, keepdims=True)
+    others = 10.0 ** rng.uniform(-3, 7, (rows, FEATURE_SCHEMA.size - COLOR_BINS))
+    return FEATURE_SCHEMA.as_matrix(np.hstack([color, others]))
+
+
+# Mediana (segundos) de `repeat` llamadas a predict con las filas
+def latency(predict, rows, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predict(rows)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exportar el clasificador a ONNX")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "papas.pkl"))
+    parser.add_argument("--output", help="Por defecto, el modelo con extensión .onnx")
+    parser.add_argument("--reference", help="Filas de referencia (.npy o CSV de pred.py)")
+    parser.add_argument("--store", default=os.environ.get("FEATURE_STORE_DIR"))
+    parser.add_argument("--rows", type=int, default=2000, help="Filas de referencia")
+    parser.add_argument("--batch-size", type=int, default=256, help="Filas del lote medido")
+    parser.add_argument("--repeat", type=int, default=200, help="Llamadas por medición")
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    if onnx is None:
+        print("Para exportar el modelo a ONNX hace falta instalar skl2onnx")
+        return 1
+    output = args.output or onnx_path(args.model)
+
+    source_sha256 = file_sha256(args.model)
+    model = joblib.load(args.model)
+    FEATURE_SCHEMA.check_model(model)
+    rows, source = reference_rows(model, args.reference, args.store, args.rows)
+
+    start = time.perf_counter()
+    try:
+        exported = convert(model, source_sha256, FEATURE_SCHEMA.size)
+    except Exception as e:
+        print(f"No se pudo convertir el modelo: {e}")
+        return 1
+    convert_seconds = time.perf_counter() - start
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    onnx.save_model(exported, tmp_path)
+
+    try:
+        onnx_model = OnnxClassifier(tmp_path)
+        expected = model.predict(rows)
+        predicted = onnx_model.predict(rows)
+        mismatches = int(np.count_nonzero(expected != predicted))
+        batch = rows[: args.batch_size]
+        results = {
+            "model": args.model,
+            "sha256": source_sha256,
+            "reference": source,
+            "rows": len(rows),
+            "mismatches": mismatches,
+            "convert_seconds": convert_seconds,
+            "onnx_bytes": os.path.getsize(tmp_path),
+            "latency": {
+                backend: {
+                    "row_ms": latency(predict, rows[:1], args.repeat) * 1000,
+                    "batch_ms": latency(predict, batch, max(1, args.repeat // 10)) * 1000,
+                }
+                for backend, predict in (("joblib", model.predict), ("onnx", onnx_model.predict))
+            },
+        }
+        if mismatches:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    print(f"Referencia: {len(rows)} filas ({source}), {mismatches} predicciones distintas")
+    for backend, values in results["latency"].items():
+        print(
+            f"  {backend}: {values['row_ms']:.3f} ms por fila, "
+            f"{values['batch_ms']:.3f} ms por lote de {len(batch)}"
+        )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if mismatches:
+        print("Las predicciones no coinciden: no se guarda el modelo ONNX")
+        return 1
+    print(f"Modelo ONNX en {output} ({results['onnx_bytes'] / 2**20:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from features import FeatureSchema
+
+# Bytes de la clave de cada fila: SHA-256 de la imagen subida
+KEY_BYTES = 32
+# Filas por llamada al modelo al volver a puntuar el almacén
+RESCORE_CHUNK_ROWS = 65_536
+
+
+# Identificador del extractor: versión y nombres del vector más los ajustes del
+# pipeline que cambian las características (resoluciones, recorte, modelo de rembg).
+# Filas calculadas con ajustes distintos no se mezclan: cada una va a su directorio.
+def extractor_id(schema, settings):
+    description = {"names": schema.names, "dtype": schema.dtype.str, **settings}
+    digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8"))
+    return f"v{schema.version}-{digest.hexdigest()[:12]}"
+
+
+# Almacén persistente de características por contenido de la imagen: así, cuando
+# cambia el modelo, se vuelven a puntuar las filas guardadas sin decodificar ni
+# pasar por rembg ninguna imagen (ver rescore.py). En <root>/<extractor>/:
+# - meta.json: esquema (nombres, tipo, versión) y ajustes del extractor
+# - features.bin: las filas una detrás de otra (matriz N x 517 para np.memmap)
+# - keys.bin: la clave de cada fila, en el mismo orden
+# Solo se añaden filas, con el archivo bloqueado (flock) para que varios procesos
+# (workers de gunicorn, pred.py) puedan escribir a la vez. La fila se escribe antes
+# que su clave, así que una fila sin clave (proceso interrumpido) se descarta.
+class FeatureStore:
+    def __init__(self, root, schema, settings=None):
+        self.root = root
+        self.schema = schema
+        self.settings = dict(settings or {})
+        self.extractor = extractor_id(schema, self.settings)
+        self.path = os.path.join(root, self.extractor) if root else None
+        self.row_bytes = schema.size * schema.dtype.itemsize
+        self._lock = threading.Lock()
+        # Clave -> número de fila, y bytes de keys.bin ya leídos
+        self._index = {}
+        self._indexed_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            self._write_meta()
+
+    @classmethod
+    def from_env(cls, schema, settings=None):
+        return cls(os.environ.get("FEATURE_STORE_DIR") or None, schema, settings)
+
+    # Abrir un directorio de extractor ya existente con el esquema de su meta.json
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        schema = FeatureSchema(meta["names"], dtype=meta["dtype"], version=meta["version"])
+        store = cls(os.path.dirname(os.path.abspath(path)), schema, meta["settings"])
+        if store.extractor != meta["extractor"]:
+            raise ValueError(f"meta.json no corresponde al extractor {meta['extractor']}")
+        return store
+
+    # Extractores guardados en `root`: {identificador: ruta}
+    @staticmethod
+    def extractors(root):
+        if not root or not os.path.isdir(root):
+            return {}
+        return {
+            name: os.path.join(root, name)
+            for name in sorted(os.listdir(root))
+            if os.path.exists(os.path.join(root, name, "meta.json"))
+        }
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    # Clave de una imagen subida (None si el almacén está desactivado)
+    def key(self, image_data):
+        if not self.enabled:
+            return None
+        return hashlib.sha256(image_data).digest()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _write_meta(self):
+        path = self._file("meta.json")
+        if os.path.exists(path):
+            return
+        meta = {
+            "extractor": self.extractor,
+            "version": self.schema.version,
+            "dtype": self.schema.dtype.str,
+            "names": list(self.schema.names),
+            "settings": self.settings,
+        }
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(meta, file, indent=2)
+        os.replace(tmp_path, path)
+
+    # Añadir al índice las claves que otros procesos han escrito desde la última vez
+    # (se llama con self._lock)
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self._file("keys.bin"))
+        except FileNotFoundError:
+            return
+        size -= size % KEY_BYTES
+        if size <= self._indexed_bytes:
+            return
+        with open(self._file("keys.bin"), "rb") as file:
+            file.seek(self._indexed_bytes)
+            data = file.read(size - self._indexed_bytes)
+        row = self._indexed_bytes // KEY_BYTES
+        for offset in range(0, len(data), KEY_BYTES):
+            self._index.setdefault(data[offset : offset + KEY_BYTES], row)
+            row += 1
+        self._indexed_bytes += len(data)
+
+    # Fila guardada para la clave (ndarray del tipo del esquema) o None
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                self._refresh()
+                row = self._index.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        with open(self._file("features.bin"), "rb") as file:
+            file.seek(row * self.row_bytes)
+            data = file.read(self.row_bytes)
+        return np.frombuffer(data, dtype=self.schema.dtype).copy()
+
+    def put(self, key, features):
+        if key is None:
+            return
+        row = np.ascontiguousarray(features, dtype=self.schema.dtype).reshape(-1)
+        if row.size != self.schema.size:
+            raise ValueError(f"Se esperaban {self.schema.size} características, hay {row.size}")
+        with self._lock, open(self._file("keys.bin"), "ab") as keys_file:
+            # El bloqueo se libera al cerrar el archivo
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            self._refresh()
+            if key in self._index:
+                return
+            rows = self._indexed_bytes // KEY_BYTES
+            # Descartar lo que dejó a medias un proceso interrumpido
+            keys_file.truncate(self._indexed_bytes)
+            with open(self._file("features.bin"), "ab") as file:
+                file.truncate(rows * self.row_bytes)
+                file.write(row.tobytes())
+            keys_file.write(key)
+            keys_file.flush()
+            self._index[key] = rows
+            self._indexed_bytes += KEY_BYTES
+            self.writes += 1
+
+    # Claves (hexadecimal) y matriz de todas las filas guardadas. La matriz es un
+    # np.memmap de solo lectura: las filas se leen del disco a medida que se usan.
+    def rows(self):
+        with self._lock:
+            self._refresh()
+            count = self._indexed_bytes // KEY_BYTES
+        if count == 0:
+            return [], np.empty((0, self.schema.size), dtype=self.schema.dtype)
+        with open(self._file("keys.bin"), "rb") as file:
+            data = file.read(count * KEY_BYTES)
+        keys = [data[start : start + KEY_BYTES].hex() for start in range(0, len(data), KEY_BYTES)]
+        matrix = np.memmap(
+            self._file("features.bin"),
+            dtype=self.schema.dtype,
+            mode="r",
+            shape=(count, self.schema.size),
+        )
+        return keys, matrix
+
+    def stats(self):
+        with self._lock:
+            if self.enabled:
+                self._refresh()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "extractor": self.extractor,
+                "rows": self._indexed_bytes // KEY_BYTES,
+                "bytes": self._indexed_bytes // KEY_BYTES * (self.row_bytes + KEY_BYTES),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_ratio": self.hits / lookups if lookups else None,
+            }
+
+
+# Almacén del extractor que corresponde al modelo (el único de su versión de las
+# características) o el indicado con `extractor`
+def select_store(root, model, extractor=None):
+    extractors = FeatureStore.extractors(root)
+    if extractor is not None:
+        if extractor not in extractors:
+            raise ValueError(f"No hay características del extractor {extractor} en {root}")
+        return FeatureStore.open(extractors[extractor])
+
+    version = getattr(model, "feature_version_", 1)
+    stores = [FeatureStore.open(path) for path in extractors.values()]
+    stores = [store for store in stores if store.schema.version == version]
+    if not stores:
+        raise ValueError(f"No hay características de la versión {version} en {root}")
+    if len(stores) > 1:
+        names = ", ".join(store.extractor for store in stores)
+        raise ValueError(
+            f"Hay varios extractores de la versión {version} ({names}): indica cuál"
+        )
+    return stores[0]
+
+
+# Claves y filas (validadas con el esquema) del almacén por bloques de chunk_rows:
+# con el memmap no se carga la matriz entera en memoria
+def iter_row_chunks(store, chunk_rows=RESCORE_CHUNK_ROWS):
+    keys, matrix = store.rows()
+    for start in range(0, len(keys), chunk_rows):
+        stop = start + chunk_rows
+        yield keys[start:stop], store.schema.as_matrix(matrix[start:stop])
+
+
+# Volver a puntuar todas las filas del almacén con `model`, una llamada al modelo
+# por bloque. Produce (claves, predicciones) de cada bloque.
+def rescore(store, model, chunk_rows=RESCORE_CHUNK_ROWS):
+    for keys, rows in iter_row_chunks(store, chunk_rows):
+        yield keys, model.predict(rows)
@@ -0,0 +1,325 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from masks import MASK_THRESHOLD
+from masks import mask_bbox
+from masks import mask_components
+from metrics import stage
+from texture import extract_texture_features
+from texture import extract_texture_features_region
+
+# Orden del vector: 512 bins de color HSV (8x8x8), LBP, contraste GLCM, área,
+# perímetro y circularidad
+COLOR_BINS = 8 * 8 * 8
+FEATURE_COUNT = COLOR_BINS + 2 + 3
+
+# Región de la imagen sin fondo sobre la que se extraen las características
+# cuando se conoce la máscara de rembg:
+# - "exact" (por defecto): solo se recorre la caja del objeto y el resultado es
+#   idéntico al de la imagen completa (el resto es blanco y se calcula sin mirarlo)
+# - "full": la imagen completa, como antes (interruptor de compatibilidad)
+# - "object": solo el objeto (color con la máscara, textura en la caja y forma del
+#   contorno de la máscara); cambia el vector, el modelo debe entrenarse con él
+FEATURE_CROP = os.environ.get("FEATURE_CROP", "exact")
+FEATURE_CROP_MODES = ("exact", "full", "object")
+
+# Versión del vector de características, que debe coincidir con la del modelo:
+# - 1: imagen compuesta sobre blanco (papas.pkl), con la región de FEATURE_CROP.
+#   El blanco añadido domina el histograma de color.
+# - 2: sin componer sobre blanco. Histograma HSV solo de los píxeles con alfa >=
+#   MASK_THRESHOLD, textura del recorte del objeto con el fondo en blanco y forma
+#   del contorno de la máscara (FEATURE_CROP no se aplica).
+# Un modelo entrenado con la versión 2 lleva el atributo feature_version_ = 2
+# (asignado antes de joblib.dump); los modelos sin él son de la versión 1.
+FEATURE_VERSION = int(os.environ.get("FEATURE_VERSION", 1))
+FEATURE_VERSIONS = (1, 2)
+
+# Bin del histograma 8x8x8 en el que cae el blanco (H=0, S=0, V=255)
+WHITE_BIN = (0, 0, 7)
+
+# Tolerancia frente al vector original (lista de float64): los bins de color son
+# idénticos (calcHist ya devuelve float32); el resto solo difiere por el redondeo
+# a float32, es decir, un error relativo de como mucho 2**-24 (~6e-8).
+FEATURE_RTOL = 1e-7
+
+
+# Esquema fijo del vector de características: nombres, orden y tipo. Se crea una
+# sola vez al importar y se usa para validar las filas antes de llamar al modelo
+# y para comprobar que un modelo recién cargado espera este mismo vector.
+class FeatureSchema:
+    def __init__(self, names, dtype=np.float32, version=1):
+        self.names = tuple(names)
+        self.version = version
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Nombres de características duplicados")
+        self.dtype = np.dtype(dtype)
+        self.size = len(self.names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    # Convertir filas (lista de filas o matriz) en una matriz contigua validada
+    def as_matrix(self, rows):
+        matrix = np.ascontiguousarray(rows, dtype=self.dtype)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if matrix.ndim != 2 or matrix.shape[1] != self.size:
+            raise ValueError(
+                f"Se esperaban {self.size} características, se recibieron {matrix.shape[-1]}"
+            )
+        if not np.isfinite(matrix).all():
+            raise ValueError("Las características contienen valores no finitos")
+        return matrix
+
+    # Comprobar que el modelo fue entrenado con esta versión y este número (y orden)
+    # de características
+    def check_model(self, model):
+        version = getattr(model, "feature_version_", 1)
+        if version != self.version:
+            raise ValueError(
+                f"El modelo usa la versión {version} de las características y el "
+                f"extractor la {self.version} (FEATURE_VERSION)"
+            )
+        n_features = getattr(model, "n_features_in_", None)
+        if n_features is not None and n_features != self.size:
+            raise ValueError(
+                f"El modelo espera {n_features} características y el esquema tiene {self.size}"
+            )
+        names = getattr(model, "feature_names_in_", None)
+        if names is not None and tuple(str(name) for name in names) != self.names:
+            print("Aviso: los nombres de características del modelo no coinciden con el esquema")
+
+
+FEATURE_SCHEMA = FeatureSchema(
+    [f"Color_{i}" for i in range(COLOR_BINS)]
+    + [
+        "Textura_LBP",
+        "Textura_GLCM_Contrast",
+        "Forma_Area",
+        "Forma_Perimetro",
+        "Forma_Circularidad",
+    ],
+    version=FEATURE_VERSION,
+)
+
+# Buffers reutilizados por hilo (HSV y gris) para no reservar memoria en cada imagen
+_buffers = threading.local()
+
+
+# (el buffer crece si hace falta y se devuelve una vista con la forma pedida)
+def _buffer(name, shape):
+    size = int(np.prod(shape))
+    buffer = getattr(_buffers, name, None)
+    if buffer is None or buffer.size < size:
+        buffer = np.empty(size, dtype=np.uint8)
+        setattr(_buffers, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+# Histograma HSV 8x8x8 sin normalizar (opcionalmente solo de los píxeles de `mask`)
+def _color_histogram(image, hsv_image=None, mask=None):
+    hsv_image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV, dst=hsv_image)
+    return cv2.calcHist(
+        [hsv_image], [0, 1, 2], mask, [8, 8, 8], [0, 256, 0, 256, 0, 256]
+    )
+
+
+# Función para extraer características de color
+def extract_color_features(image, hsv_image=None, mask=None):
+    hist = _color_histogram(image, hsv_image=hsv_image, mask=mask)
+    hist = cv2.normalize(hist, hist).flatten()
+    return hist
+
+
+# Función para extraer características de forma
+def extract_shape_features(gray_image):
+    contours, _ = cv2.findContours(
+        gray_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    )
+    max_contour = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(max_contour)
+    perimeter = cv2.arcLength(max_contour, True)
+    circularity = 4 * np.pi * (area / (perimeter * perimeter)) if perimeter != 0 else 0
+    return [area, perimeter, circularity]
+
+
+# Extraer las 517 características de una imagen RGB (ndarray uint8) en una fila
+# float32. `version` (FEATURE_VERSION) elige el vector: con la 1 la imagen ya está
+# compuesta sobre blanco y, si se pasa la máscara de rembg (alfa 0-255), `mode`
+# (FEATURE_CROP) decide sobre qué región se calculan; con la 2 la imagen es la
+# original y la máscara delimita el objeto. Sin máscara (o sin objeto) se usa
+# siempre la imagen completa.
+def extract_features(image, out=None, mask=None, mode=None, version=None):
+    mode = mode or FEATURE_CROP
+    version = version or FEATURE_VERSION
+    if mode not in FEATURE_CROP_MODES:
+        raise ValueError(f"Modo de extracción desconocido: {mode}")
+    if version not in FEATURE_VERSIONS:
+        raise ValueError(f"Versión de características desconocida: {version}")
+    if out is None:
+        out = np.empty(FEATURE_SCHEMA.size, dtype=FEATURE_SCHEMA.dtype)
+
+    if version == 2:
+        bbox = mask_bbox(mask) if mask is not None else None
+        if bbox is not None and _extract_object(image, mask, bbox, out, white_background=True):
+            return out
+        return _extract_full(image, out)
+
+    bbox = mask_bbox(mask) if mask is not None and mode != "full" else None
+    if bbox is not None and mode == "exact" and _extract_exact(image, bbox, out):
+        return out
+    if bbox is not None and mode == "object" and _extract_object(image, mask, bbox, out):
+        return out
+    return _extract_full(image, out)
+
+
+# Características de cada objeto de la foto (componentes de mask_components), en
+# una matriz de filas float32, como si cada uno estuviera solo en ella: con la
+# versión 1, sobre un fondo blanco del tamaño de la imagen (igual que una foto de un
+# solo objeto); con la 2 (o FEATURE_CROP="object"), su caja con su máscara. Los
+# píxeles de los demás objetos y el borde suave de la máscara (alfa por debajo de
+# MASK_THRESHOLD) no forman parte de ningún objeto.
+def extract_objects_features(image, labels, components, out=None, mode=None, version=None):
+    mode = mode or FEATURE_CROP
+    version = version or FEATURE_VERSION
+    if out is None:
+        out = np.empty((len(components), FEATURE_SCHEMA.size), dtype=FEATURE_SCHEMA.dtype)
+
+    height, width = image.shape[:2]
+    for row, (label, (x, y, box_width, box_height), _) in zip(out, components):
+        if version == 2 or mode == "object":
+            object_mask = cv2.compare(
+                labels[y : y + box_height, x : x + box_width], label, cv2.CMP_EQ
+            )
+            crop = image[y : y + box_height, x : x + box_width]
+            _object_features(crop, object_mask, row, white_background=True)
+            continue
+
+        # Caja con el margen blanco que necesita _exact_region_features (recortado
+        # al borde de la imagen) y todo lo que no es el objeto en blanco
+        top, bottom = max(y - 2, 0), min(y + box_height + 2, height)
+        left, right = max(x - 5, 0), min(x + box_width + 5, width)
+        region = image[top:bottom, left:right].copy()
+        region[labels[top:bottom, left:right] != label] = 255
+        if (top, left, bottom, right) == (y - 2, x - 5, y + box_height + 2, x + box_width + 5):
+            _exact_region_features(region, (height, width), (top, left), row)
+        else:
+            # Objeto junto al borde: la imagen completa en blanco con el objeto
+            canvas = np.full_like(image, 255)
+            canvas[top:bottom, left:right] = region
+            _extract_full(canvas, row)
+    return out
+
+
+# Separar los objetos de la máscara de rembg y extraer sus características.
+# Devuelve (matriz de filas, componentes de mask_components)
+def extract_objects(image, mask, min_area=0.0, max_objects=None):
+    labels, components = mask_components(mask, min_area=min_area, max_objects=max_objects)
+    return extract_objects_features(image, labels, components), components
+
+
+# Imagen completa. Cada conversión (HSV, gris) se hace una sola vez sobre buffers
+# reutilizados, y LBP y GLCM comparten un único recorrido del gris (con numba), por
+# lo que se miden juntos en la etapa "texture" (metrics.stage).
+def _extract_full(image, out):
+    height, width = image.shape[:2]
+
+    with stage("color"):
+        hsv_image = _buffer("hsv", (height, width, 3))
+        out[:COLOR_BINS] = extract_color_features(image, hsv_image=hsv_image)
+
+    with stage("texture"):
+        gray_image = cv2.cvtColor(
+            image, cv2.COLOR_RGB2GRAY, dst=_buffer("gray", (height, width))
+        )
+        out[COLOR_BINS : COLOR_BINS + 2] = extract_texture_features(gray_image)
+    with stage("shape"):
+        out[COLOR_BINS + 2 :] = extract_shape_features(gray_image)
+    return out
+
+
+# Mismo resultado que _extract_full recorriendo solo la caja del objeto: fuera de
+# ella la imagen compuesta es blanca (alfa 0), así que el resto se calcula sin mirarla.
+# Devuelve False si el objeto está demasiado cerca del borde (se usa la imagen completa).
+def _extract_exact(image, bbox, out):
+    height, width = image.shape[:2]
+    x, y, box_width, box_height = bbox
+    # Margen que necesitan LBP (2 filas/columnas) y la GLCM (5 columnas)
+    top, bottom = y - 2, y + box_height + 2
+    left, right = x - 5, x + box_width + 5
+    if top < 0 or left < 0 or bottom > height or right > width:
+        return False
+    _exact_region_features(image[top:bottom, left:right], (height, width), (top, left), out)
+    return True
+
+
+# Características de una imagen blanca de tamaño `shape` que solo contiene `region`
+# (en `origin`): la caja del objeto más el margen de 2 filas y 5 columnas blancas
+def _exact_region_features(region, shape, origin, out):
+    height, width = shape
+    region_height, region_width = region.shape[:2]
+
+    # Color: los píxeles fuera de la caja son blancos y caen todos en el mismo bin
+    with stage("color"):
+        crop = region[2 : region_height - 2, 5 : region_width - 5]
+        hist = _color_histogram(crop, hsv_image=_buffer("hsv", crop.shape))
+        hist[WHITE_BIN] += height * width - crop.shape[0] * crop.shape[1]
+        out[:COLOR_BINS] = cv2.normalize(hist, hist).flatten()
+
+    with stage("texture"):
+        gray_region = cv2.cvtColor(
+            region, cv2.COLOR_RGB2GRAY, dst=_buffer("gray", region.shape[:2])
+        )
+        out[COLOR_BINS : COLOR_BINS + 2] = extract_texture_features_region(
+            gray_region, (height, width), origin
+        )
+    # Con un margen blanco hasta el borde, el único contorno externo es el marco
+    with stage("shape"):
+        out[COLOR_BINS + 2 :] = _frame_shape_features(height, width)
+    return out
+
+
+# Solo el objeto: color de los píxeles de la máscara, textura de la caja y forma del
+# contorno de la máscara. Cambia el significado del vector (hay que reentrenar).
+# Con white_background la imagen no está compuesta y el fondo de la caja se pone en
+# blanco solo en el gris de la textura.
+def _extract_object(image, mask, bbox, out, white_background=False):
+    x, y, box_width, box_height = bbox
+    crop = image[y : y + box_height, x : x + box_width]
+    object_mask = cv2.compare(
+        mask[y : y + box_height, x : x + box_width], MASK_THRESHOLD, cv2.CMP_GE
+    )
+    if not object_mask.any():
+        return False
+    _object_features(crop, object_mask, out, white_background)
+    return True
+
+
+# Características de un objeto a partir de su caja (`crop`) y su máscara binaria
+def _object_features(crop, object_mask, out, white_background=False):
+    with stage("color"):
+        out[:COLOR_BINS] = extract_color_features(
+            crop, hsv_image=_buffer("hsv", crop.shape), mask=object_mask
+        )
+    with stage("texture"):
+        gray_crop = cv2.cvtColor(
+            crop, cv2.COLOR_RGB2GRAY, dst=_buffer("gray", crop.shape[:2])
+        )
+        if white_background:
+            cv2.max(gray_crop, cv2.bitwise_not(object_mask), dst=gray_crop)
+        out[COLOR_BINS : COLOR_BINS + 2] = extract_texture_features(gray_crop)
+    with stage("shape"):
+        out[COLOR_BINS + 2 :] = extract_shape_features(object_mask)
+    return out
+
+
+# Forma del marco de la imagen (el contorno que findContours devuelve en _extract_full)
+def _frame_shape_features(height, width):
+    frame = np.array(
+        [[0, 0], [0, height - 1], [width - 1, height - 1], [width - 1, 0]], dtype=np.int32
+    ).reshape((-1, 1, 2))
+    area = cv2.contourArea(frame)
+    perimeter = cv2.arcLength(frame, True)
+    circularity = 4 * np.pi * (area / (perimeter * perimeter)) if perimeter != 0 else 0
+    return [area, perimeter, circularity]
@@ -0,0 +1,11 @@
+# Configuración de gunicorn (se carga automáticamente desde el directorio de trabajo)
+
+
+# Cargar el modelo y las sesiones de rembg antes de que el worker acepte peticiones
+def post_worker_init(worker):
+    from app import warm_up
+
+    try:
+        warm_up()
+    except Exception as e:
+        worker.log.error(f"Error al preparar el worker: {e}")
@@ -0,0 +1,137 @@
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("La cola de trabajos está llena")
+        self.retry_after = retry_after
+
+
+# Cola de trabajos en proceso: submit() devuelve un id inmediatamente y un grupo
+# fijo de hilos ejecuta handler(payload). La cola tiene un tamaño máximo para
+# proteger al worker: si está llena, submit() lanza QueueFull con un Retry-After
+# estimado a partir de la duración media de los trabajos.
+# Los trabajos terminados se conservan ttl segundos y, como mucho, max_result_bytes
+# de resultados entre todos (medidos con result_size): al superarlo se eliminan los
+# que terminaron antes. Se expiran al enviar, consultar y terminar trabajos.
+class JobQueue:
+    def __init__(
+        self,
+        handler,
+        workers=2,
+        max_pending=16,
+        ttl=600,
+        max_result_bytes=256 * 1024 * 1024,
+        result_size=None,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.max_result_bytes = max_result_bytes
+        self.result_size = result_size or (lambda result: 0)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        # Trabajos terminados (id -> bytes del resultado), del más antiguo al último
+        self._finished = OrderedDict()
+        self._result_bytes = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._durations = []
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, payload):
+        self._start()
+        self._expire()
+        job_id = uuid.uuid4().hex
+        job = {"status": "queued", "created": time.time(), "result": None, "error": None}
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise QueueFull(self.retry_after())
+        return job_id
+
+    def get(self, job_id):
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    # Segundos estimados hasta que se libere un hueco en la cola
+    def retry_after(self):
+        with self._lock:
+            durations = list(self._durations)
+        average = sum(durations) / len(durations) if durations else 1.0
+        return max(1, math.ceil(self._queue.qsize() * average / self.workers))
+
+    def _run(self):
+        while True:
+            job_id, payload = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job["status"] = "running"
+            start = time.perf_counter()
+            try:
+                result = self.handler(payload)
+                status, error = "done", None
+            except Exception as e:
+                result, status, error = None, "failed", str(e)
+            duration = time.perf_counter() - start
+            size = self.result_size(result) if result is not None else 0
+            with self._lock:
+                job.update(status=status, result=result, error=error, finished=time.time())
+                self._durations = (self._durations + [duration])[-50:]
+                self._finished[job_id] = size
+                self._result_bytes += size
+            self._expire()
+
+    # Eliminar los trabajos terminados hace más de ttl segundos y, si los resultados
+    # ocupan más de max_result_bytes, los que terminaron antes
+    def _expire(self):
+        limit = time.time() - self.ttl
+        with self._lock:
+            while self._finished:
+                job_id, size = next(iter(self._finished.items()))
+                expired = self._jobs[job_id]["finished"] < limit
+                if not expired and self._result_bytes <= self.max_result_bytes:
+                    break
+                if not expired:
+                    self.evicted += 1
+                del self._finished[job_id]
+                del self._jobs[job_id]
+                self._result_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            statuses = [job["status"] for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "pending": self._queue.qsize(),
+            "max_pending": self._queue.maxsize,
+            "result_bytes": self._result_bytes,
+            "max_result_bytes": self.max_result_bytes,
+            "evicted": self.evicted,
+            **{
+                status: statuses.count(status)
+                for status in ("queued", "running", "done", "failed")
+            },
+        }
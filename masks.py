@@ -0,0 +1,111 @@
+import io
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Alfa mínimo para considerar un píxel parte del objeto en la máscara de 1 bit
+MASK_THRESHOLD = 128
+
+MASK_ENCODINGS = ("png", "rle")
+
+# Secuencia de la máscara de 8 bits en RLE: longitud (uint32) y valor (uint8)
+_RLE8_DTYPE = np.dtype([("count", "<u4"), ("value", "u1")])
+
+
+# Caja envolvente [x, y, ancho, alto] de los píxeles con alfa > 0 (None si no hay objeto)
+def mask_bbox(mask):
+    x, y, width, height = cv2.boundingRect(mask)
+    if width == 0 or height == 0:
+        return None
+    return [x, y, width, height]
+
+
+# Objetos independientes de la máscara: componentes conexas (8 vecinos) de los
+# píxeles con alfa >= MASK_THRESHOLD cuya área es al menos `min_area` (fracción de
+# la imagen). Devuelve el mapa de etiquetas (int32) y una lista de
+# (etiqueta, caja [x, y, ancho, alto], área en píxeles) en orden de lectura (por
+# filas y después por columnas), con como mucho `max_objects` objetos (los mayores).
+def mask_components(mask, min_area=0.0, max_objects=None):
+    binary = cv2.compare(mask, MASK_THRESHOLD, cv2.CMP_GE)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    min_pixels = min_area * mask.size
+    components = [
+        (label, stats[label, :4].tolist(), int(stats[label, cv2.CC_STAT_AREA]))
+        for label in range(1, count)
+        if stats[label, cv2.CC_STAT_AREA] >= min_pixels
+    ]
+    if max_objects is not None and len(components) > max_objects:
+        components = sorted(components, key=lambda component: -component[2])[:max_objects]
+    components.sort(key=lambda component: (component[1][1], component[1][0]))
+    return labels, components
+
+
+# Valores y longitudes de las secuencias de valores iguales de un vector
+def _runs(values):
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, values.size))
+    return values[starts], lengths
+
+
+# Codificar la máscara de rembg para devolverla en lugar de la imagen compuesta:
+# - bits=8: alfa 0-255; bits=1: objeto/fondo con MASK_THRESHOLD
+# - encoding="png": PNG en escala de grises (o de 1 bit)
+# - encoding="rle": recorrido por filas; con 1 bit, longitudes uint32 alternas
+#   empezando por el fondo (estilo COCO); con 8 bits, pares (longitud uint32, valor uint8)
+# - max_side: reducir la máscara antes de codificarla
+# Devuelve (bytes, metadatos). La caja envolvente está en píxeles de la imagen procesada.
+def encode_mask(mask, bits=8, encoding="png", max_side=None):
+    start = time.perf_counter()
+    bbox = mask_bbox(mask)
+    height, width = mask.shape
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+    if bits == 1:
+        mask = mask >= MASK_THRESHOLD
+
+    if encoding == "png":
+        # Un ndarray booleano se guarda como imagen "1" (PNG de 1 bit)
+        with io.BytesIO() as byte_io:
+            Image.fromarray(mask).save(byte_io, format="PNG")
+            data = byte_io.getvalue()
+    else:
+        values, lengths = _runs(mask.ravel())
+        if bits == 1:
+            if values[0]:
+                lengths = np.concatenate(([0], lengths))
+            data = lengths.astype("<u4").tobytes()
+        else:
+            runs = np.empty(values.size, dtype=_RLE8_DTYPE)
+            runs["count"] = lengths
+            runs["value"] = values
+            data = runs.tobytes()
+
+    info = {
+        "bits": bits,
+        "encoding": encoding,
+        "width": mask.shape[1],
+        "height": mask.shape[0],
+        "image_width": width,
+        "image_height": height,
+        "bbox": bbox,
+        "bytes": len(data),
+        "encode_ms": (time.perf_counter() - start) * 1000,
+    }
+    return data, info
+
+
+# Decodificar una máscara codificada con encode_mask (uint8 0-255, o bool con 1 bit)
+def decode_mask(data, info):
+    shape = (info["height"], info["width"])
+    if info["encoding"] == "png":
+        return np.asarray(Image.open(io.BytesIO(data)))
+    if info["bits"] == 1:
+        lengths = np.frombuffer(data, dtype="<u4")
+        values = np.arange(lengths.size) % 2 == 1
+        return np.repeat(values, lengths).reshape(shape)
+    runs = np.frombuffer(data, dtype=_RLE8_DTYPE)
+    return np.repeat(runs["value"], runs["count"]).reshape(shape)
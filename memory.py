@@ -0,0 +1,92 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import observe_stage
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class MemoryBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__("No hay memoria libre en el worker")
+        self.retry_after = retry_after
+
+
+# Control de admisión por memoria del worker: cada petición reserva los bytes que
+# estima que va a usar y, si la suma supera el límite, espera (como mucho
+# `timeout` segundos) a que otras peticiones liberen su reserva. Si no se libera a
+# tiempo lanza MemoryBusy con un Retry-After estimado a partir de la duración media
+# de las reservas; una petición que por sí sola supera el límite lanza ImageTooLarge.
+class MemoryAdmission:
+    def __init__(self, limit, timeout=30.0):
+        self.limit = limit
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._reserved = 0
+        self._peak = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._durations = []
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            limit=int(os.environ.get("WORKER_MEMORY_LIMIT", 1024 * 1024 * 1024)),
+            timeout=float(os.environ.get("ADMISSION_TIMEOUT", 30.0)),
+        )
+
+    @contextmanager
+    def reserve(self, nbytes):
+        if nbytes > self.limit:
+            with self._condition:
+                self._rejected += 1
+            raise ImageTooLarge(
+                f"La imagen necesita {nbytes / 2**20:.0f} MB y el límite del worker "
+                f"es {self.limit / 2**20:.0f} MB"
+            )
+        requested = time.perf_counter()
+        with self._condition:
+            self._waiting += 1
+            admitted = self._condition.wait_for(
+                lambda: self._reserved + nbytes <= self.limit, timeout=self.timeout
+            )
+            self._waiting -= 1
+            if not admitted:
+                self._rejected += 1
+                raise MemoryBusy(self._retry_after())
+            self._reserved += nbytes
+            self._peak = max(self._peak, self._reserved)
+            self._admitted += 1
+
+        start = time.perf_counter()
+        # Tiempo de espera hasta la admisión (etapa "admission" en metrics.py)
+        observe_stage("admission", start - requested)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= nbytes
+                self._durations = (self._durations + [time.perf_counter() - start])[-50:]
+                self._condition.notify_all()
+
+    # Segundos estimados hasta que se libere memoria (con el lock tomado)
+    def _retry_after(self):
+        average = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        return max(1, math.ceil(average))
+
+    def stats(self):
+        with self._condition:
+            return {
+                "limit_bytes": self.limit,
+                "reserved_bytes": self._reserved,
+                "peak_bytes": self._peak,
+                "waiting": self._waiting,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+            }
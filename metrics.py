@@ -0,0 +1,244 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+# Límites (segundos) de los buckets de los histogramas de latencia: unos seis por
+# década, para que los cuantiles interpolados no se alejen mucho del valor real
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0015, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05,
+    0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0,
+    30.0, 60.0,
+)
+# Cuantiles que se calculan a partir de los buckets
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Métricas propias: tipo y descripción (HELP) de cada una
+METRICS = {
+    "stage_seconds": ("histogram", "Duration of each pipeline stage"),
+    "http_request_seconds": ("histogram", "Duration of each request until its headers are sent"),
+    "http_requests_total": ("counter", "Requests served by endpoint and status"),
+}
+
+# Etapas de la petición actual (lista de (etapa, segundos)) para Server-Timing.
+# Es None fuera de una petición (trabajos de la cola, procesos hijos, benchmarks).
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+# Histograma de buckets fijos (como los de Prometheus): el coste de observar un
+# valor no depende de cuántos se han observado y la memoria es constante
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+            self._max = max(self._max, value)
+
+    # (conteos por bucket, no acumulados; suma; número de valores; máximo)
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count, self._max
+
+    # Cuantil estimado por interpolación lineal dentro de su bucket (como
+    # histogram_quantile de Prometheus), sin pasar del máximo observado; None si no
+    # hay valores
+    def quantile(self, q, snapshot=None):
+        counts, _, count, maximum = snapshot or self.snapshot()
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(self.buckets):
+                    return maximum
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, maximum)
+            seen += bucket_count
+        return maximum
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def increment(self, value=1):
+        with self._lock:
+            self.value += value
+
+
+# Registro de las métricas del worker (cada worker de gunicorn tiene el suyo).
+# Además de METRICS, exporta como gauges los valores numéricos de las funciones
+# stats() registradas con add_collector (caché, memoria, subidas, trabajos...).
+class MetricsRegistry:
+    def __init__(self, prefix="papas", enabled=True):
+        self.prefix = prefix
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._series = {name: {} for name in METRICS}
+        self._collectors = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(enabled=os.environ.get("METRICS_ENABLED", "1") == "1")
+
+    # Serie de la métrica `name` con esas etiquetas (se crea la primera vez)
+    def _get(self, name, labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series[name].get(key)
+        if series is None:
+            with self._lock:
+                series = self._series[name].setdefault(
+                    key, Histogram() if METRICS[name][0] == "histogram" else Counter()
+                )
+        return series
+
+    def observe(self, name, value, **labels):
+        self._get(name, labels).observe(value)
+
+    def increment(self, name, value=1, **labels):
+        self._get(name, labels).increment(value)
+
+    def add_collector(self, name, stats):
+        self._collectors[name] = stats
+
+    # Cuantiles (QUANTILES), media y número de valores de cada serie de un histograma,
+    # en milisegundos: {etiqueta: {"count", "mean_ms", "p50_ms", ...}}
+    def summary(self, name="stage_seconds", label="stage"):
+        result = {}
+        for key, histogram in sorted(self._series[name].items()):
+            snapshot = histogram.snapshot()
+            _, total, count, _ = snapshot
+            entry = {"count": count, "mean_ms": total / count * 1000 if count else None}
+            for q in QUANTILES:
+                value = histogram.quantile(q, snapshot)
+                entry[f"p{round(q * 100)}_ms"] = value * 1000 if value is not None else None
+            result[dict(key).get(label, "")] = entry
+        return result
+
+    # Todas las métricas en el formato de texto de Prometheus
+    def render(self):
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            metric = f"{self.prefix}_{name}"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+            series = sorted(self._series[name].items())
+            if kind == "counter":
+                lines += [f"{metric}{_labels(key)} {counter.value}" for key, counter in series]
+                continue
+            quantiles = []
+            for key, histogram in series:
+                snapshot = histogram.snapshot()
+                counts, total, count, _ = snapshot
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f"{metric}_bucket{_labels(key + (('le', str(bound)),))} {cumulative}"
+                    )
+                lines.append(f"{metric}_sum{_labels(key)} {total}")
+                lines.append(f"{metric}_count{_labels(key)} {count}")
+                for q in QUANTILES:
+                    value = histogram.quantile(q, snapshot)
+                    if value is not None:
+                        labels = _labels(key + (("quantile", str(q)),))
+                        quantiles.append(f"{metric}_quantile{labels} {value}")
+            # Cuantiles ya calculados, para consultarlos sin histogram_quantile
+            lines += [
+                f"# HELP {metric}_quantile {description} (quantiles estimated from the buckets)",
+                f"# TYPE {metric}_quantile gauge",
+            ] + quantiles
+
+        for collector, stats in self._collectors.items():
+            for key, value in _flatten(stats()):
+                metric = f"{self.prefix}_{collector}_{key}"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in key) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Valores numéricos de un dict de stats(), con las claves anidadas unidas por "_"
+# (se omiten textos y None; los booleanos pasan a 0/1)
+def _flatten(stats, prefix=""):
+    for key, value in stats.items():
+        name = f"{prefix}{key}".replace("-", "_").replace(".", "_")
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}_")
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+metrics_registry = MetricsRegistry.from_env()
+
+
+# Medir una etapa del pipeline: `with stage("rembg"): ...` la añade al histograma
+# stage_seconds y, dentro de una petición, a su cabecera Server-Timing
+class stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe_stage(self.name, time.perf_counter() - self.start)
+
+
+# Anotar una etapa medida por otro medio (p. ej. la carga del modelo)
+def observe_stage(name, seconds):
+    if not metrics_registry.enabled:
+        return
+    metrics_registry.observe("stage_seconds", seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+# Empezar a anotar las etapas de la petición que atiende el hilo actual
+def start_request():
+    _request_timings.set([])
+
+
+# Dejar de anotar y devolver las etapas de la petición [(etapa, segundos)]
+def finish_request():
+    timings = _request_timings.get()
+    _request_timings.set(None)
+    return timings or []
+
+
+# Valor de la cabecera Server-Timing: la duración (ms) de cada etapa, sumando las
+# que se repiten (p. ej. las imágenes de un lote), más el total si se indica
+def server_timing(timings, total=None):
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
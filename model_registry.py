@@ -0,0 +1,174 @@
+import hashlib
+import os
+import threading
+import time
+import warnings
+
+import joblib
+
+from metrics import observe_stage
+from onnx_model import MODEL_BACKEND
+from onnx_model import MODEL_BACKENDS
+from onnx_model import OnnxClassifier
+from onnx_model import onnx_path
+
+# El modelo se entrenó con nombres de columnas y se le pasa un ndarray con el mismo
+# orden (FEATURE_SCHEMA): silenciar el aviso una sola vez para todos los que lo usan
+warnings.filterwarnings("ignore", message=".*does not have valid feature names.*")
+
+
+# Calcular el hash SHA-256 del archivo del modelo por bloques
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Registro del modelo: se carga una sola vez por proceso y se recarga en caliente
+# cuando cambia el archivo (mtime/tamaño y luego hash). Las peticiones en curso
+# conservan su referencia al modelo anterior, por lo que el cambio es atómico.
+# Con el backend ONNX (onnx_model.py) se carga el modelo exportado junto al archivo
+# y se sigue vigilando el de joblib: su hash identifica el modelo en ambos casos.
+class ModelRegistry:
+    def __init__(self, model_path, check_interval=2.0, validator=None, backend=None):
+        self.model_path = model_path
+        self.check_interval = check_interval
+        # Función opcional que rechaza (lanzando una excepción) modelos incompatibles
+        self.validator = validator
+        self.backend = backend or MODEL_BACKEND
+        if self.backend not in MODEL_BACKENDS:
+            raise ValueError(f"Backend del modelo desconocido: {self.backend}")
+        self._backend = None
+        self._lock = threading.Lock()
+        self._model = None
+        self._hash = None
+        self._stat = None
+        self._load_seconds = None
+        self._loaded_at = None
+        self._reloads = 0
+        self._last_check = 0.0
+        self._last_error = None
+        # Por qué no se usa el modelo ONNX con el backend "auto" (None si se usa)
+        self._onnx_error = None
+
+    # Obtener el modelo actual (comprobando cambios como mucho cada check_interval)
+    def get(self):
+        model = self._model
+        if model is None or time.monotonic() - self._last_check >= self.check_interval:
+            self._maybe_reload()
+            model = self._model
+        return model
+
+    def _maybe_reload(self):
+        # Si otro hilo ya está recargando, seguir sirviendo el modelo actual
+        blocking = self._model is None
+        if not self._lock.acquire(blocking=blocking):
+            return
+        try:
+            self._last_check = time.monotonic()
+            try:
+                st = os.stat(self.model_path)
+                # También cambia el modelo si se exporta (o se borra) el de ONNX
+                stat_key = (st.st_mtime_ns, st.st_size, self._onnx_stat())
+                if self._model is not None and stat_key == self._stat:
+                    return
+
+                model_hash = file_sha256(self.model_path)
+                same_onnx = self._stat is not None and stat_key[2] == self._stat[2]
+                if self._model is not None and model_hash == self._hash and same_onnx:
+                    self._stat = stat_key
+                    return
+
+                start = time.perf_counter()
+                model, backend, onnx_error = self._load(model_hash)
+                load_seconds = time.perf_counter() - start
+                observe_stage("model_load", load_seconds)
+                if self.validator is not None:
+                    self.validator(model)
+            except Exception as e:
+                self._last_error = str(e)
+                if self._model is None:
+                    raise
+                print(f"Error al recargar el modelo, se mantiene el anterior: {e}")
+                return
+
+            if self._model is not None:
+                self._reloads += 1
+            # Sustituir la referencia de una sola vez
+            self._model = model
+            self._backend = backend
+            self._onnx_error = onnx_error
+            self._hash = model_hash
+            self._stat = stat_key
+            self._load_seconds = load_seconds
+            self._loaded_at = time.time()
+            self._last_error = None
+            print(f"Modelo cargado ({model_hash[:12]}, {backend}) en {load_seconds:.3f} s")
+        finally:
+            self._lock.release()
+
+    def _onnx_stat(self):
+        if self.backend == "joblib":
+            return None
+        try:
+            st = os.stat(onnx_path(self.model_path))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    # Cargar el modelo con el backend configurado. Devuelve (modelo, backend, motivo
+    # por el que no se usa el modelo ONNX)
+    def _load(self, model_hash):
+        onnx_error = None
+        if self.backend != "joblib":
+            try:
+                return OnnxClassifier.load(self.model_path, model_hash), "onnx", None
+            except Exception as e:
+                if self.backend == "onnx":
+                    raise
+                # Sin modelo exportado (lo normal sin export_onnx.py) no se avisa, pero
+                # /model muestra el motivo: en la imagen de Docker sí debería haberlo
+                if os.path.exists(onnx_path(self.model_path)):
+                    onnx_error = str(e)
+                    print(f"No se puede usar el modelo ONNX, se usa el de joblib: {e}")
+                else:
+                    onnx_error = f"No existe {onnx_path(self.model_path)} (export_onnx.py)"
+        return joblib.load(self.model_path), "joblib", onnx_error
+
+    @property
+    def model_hash(self):
+        return self._hash
+
+    # Información del modelo cargado para exponerla en la API
+    def info(self):
+        return {
+            "path": self.model_path,
+            "loaded": self._model is not None,
+            "backend": self._backend,
+            "onnx_error": self._onnx_error,
+            "sha256": self._hash,
+            "load_seconds": self._load_seconds,
+            "loaded_at": self._loaded_at,
+            "reloads": self._reloads,
+            "last_error": self._last_error,
+        }
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+# Obtener (o crear) el registro compartido para una ruta de modelo
+def get_registry(model_path, check_interval=None, validator=None):
+    if check_interval is None:
+        check_interval = float(os.environ.get("MODEL_CHECK_INTERVAL", 2.0))
+    with _registries_lock:
+        registry = _registries.get(model_path)
+        if registry is None:
+            registry = ModelRegistry(
+                model_path, check_interval=check_interval, validator=validator
+            )
+            _registries[model_path] = registry
+        return registry
@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+
+# Backend del clasificador:
+# - "auto" (por defecto): el modelo ONNX exportado junto a papas.pkl (export_onnx.py)
+#   si existe y corresponde a ese mismo papas.pkl; si no, el modelo de joblib
+# - "onnx": solo el modelo ONNX (falla si no se puede usar)
+# - "joblib": siempre el modelo de scikit-learn
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "auto")
+MODEL_BACKENDS = ("auto", "onnx", "joblib")
+# Hilos de onnxruntime por llamada al clasificador (una fila tarda microsegundos:
+# repartirla entre hilos solo añade sincronización)
+CLASSIFIER_INTRA_OP_THREADS = int(os.environ.get("CLASSIFIER_INTRA_OP_THREADS", 1))
+
+# Metadatos que export_onnx.py guarda en el modelo ONNX
+SOURCE_SHA256 = "source_sha256"
+FEATURE_VERSION = "feature_version"
+N_FEATURES = "n_features"
+CLASSES = "classes"
+
+
+# Ruta del modelo ONNX exportado a partir de un modelo de joblib (papas.pkl -> papas.onnx)
+def onnx_path(model_path):
+    return os.path.splitext(model_path)[0] + ".onnx"
+
+
+# Clasificador exportado a ONNX ejecutado con onnxruntime (el mismo que usa rembg),
+# sin importar scikit-learn. Tiene lo que el resto del código usa del modelo de
+# joblib: predict() sobre la matriz de FEATURE_SCHEMA, n_features_in_, classes_ y
+# feature_version_ (para FEATURE_SCHEMA.check_model). Una sola sesión por modelo:
+# run() se puede llamar desde varios hilos a la vez.
+class OnnxClassifier:
+    def __init__(self, path, intra_op_threads=None):
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = intra_op_threads or CLASSIFIER_INTRA_OP_THREADS
+        sess_opts.inter_op_num_threads = 1
+        self.path = path
+        self.session = ort.InferenceSession(
+            path, sess_opts, providers=["CPUExecutionProvider"]
+        )
+        self.metadata = self.session.get_modelmeta().custom_metadata_map
+        self._input = self.session.get_inputs()[0].name
+        # La primera salida es la etiqueta (la segunda, las probabilidades)
+        self._label = self.session.get_outputs()[0].name
+        self.n_features_in_ = int(self.metadata[N_FEATURES])
+        self.feature_version_ = int(self.metadata.get(FEATURE_VERSION, 1))
+        self.classes_ = np.array(json.loads(self.metadata[CLASSES]))
+
+    # Cargar el modelo ONNX de `model_path` comprobando que se exportó a partir del
+    # archivo con hash `source_sha256` (si no, lanza ValueError)
+    @classmethod
+    def load(cls, model_path, source_sha256):
+        model = cls(onnx_path(model_path))
+        exported_from = model.metadata.get(SOURCE_SHA256)
+        if exported_from != source_sha256:
+            raise ValueError(
+                f"{model.path} se exportó a partir de otro modelo "
+                f"({(exported_from or '?')[:12]}): vuelve a ejecutar export_onnx.py"
+            )
+        return model
+
+    def predict(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.float32)
+        return self.session.run([self._label], {self._input: rows})[0]
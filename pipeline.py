@@ -0,0 +1,464 @@
+import io
+import os
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+from feature_store import FeatureStore
+from features import FEATURE_CROP
+from features import FEATURE_SCHEMA
+from features import FEATURE_VERSION
+from features import extract_features
+from features import extract_objects
+from masks import encode_mask
+from memory import ImageTooLarge
+from memory import MemoryAdmission
+from metrics import stage
+from procpool import StageProcessPool
+from procpool import empty_shared_array
+from procpool import release
+from rembg_pool import RembgSessionPool
+from tiled import can_decode_tiled
+from tiled import decode_png_tiled
+from tiled import thumbnail_size
+from tiled import tiled_decode_bytes
+
+# El límite de Pillow se sustituye por MAX_IMAGE_PIXELS y el presupuesto de memoria
+Image.MAX_IMAGE_PIXELS = None
+
+# Resoluciones de trabajo (lado mayor en píxeles):
+# - DECODE_MAX_SIDE: imagen decodificada y devuelta al usuario. Con JPEG se usa el
+#   modo draft para decodificar directamente a una escala reducida cercana a este
+#   tamaño; DECODE_REDUCING_GAP=1 se acerca al máximo (más rápido), 2 es el valor
+#   por defecto de Pillow (más calidad).
+# - REMBG_MAX_SIDE: imagen que se pasa a rembg. u2net trabaja a 320x320, así que
+#   mandarle 3000 px solo cuesta tiempo; la máscara se reescala después (0 = sin reducir).
+# - FEATURE_MAX_SIDE: imagen sobre la que se calculan color, textura y forma.
+DECODE_MAX_SIDE = int(os.environ.get("DECODE_MAX_SIDE", 3000))
+DECODE_REDUCING_GAP = float(os.environ.get("DECODE_REDUCING_GAP", 2.0))
+REMBG_MAX_SIDE = int(os.environ.get("REMBG_MAX_SIDE", 640))
+FEATURE_MAX_SIDE = int(os.environ.get("FEATURE_MAX_SIDE", 3000))
+
+# Modo de varios objetos: área mínima de un objeto (fracción de la imagen) y número
+# máximo de objetos por foto (se quedan los mayores)
+OBJECT_MIN_AREA = float(os.environ.get("OBJECT_MIN_AREA", 0.002))
+MAX_OBJECTS = int(os.environ.get("MAX_OBJECTS", 100))
+
+# Filas copiadas o compuestas a la vez sobre el buffer de la imagen
+STRIP_ROWS = 64
+
+# Memoria de cada petición: una imagen cuya decodificación completa no cabe en
+# REQUEST_MEMORY_BUDGET (bytes) se decodifica por bloques (tiled.py) si es un PNG
+# que lo permite, y si no se rechaza, igual que las de más de MAX_IMAGE_PIXELS.
+# La memoria estimada se reserva en memory_admission (WORKER_MEMORY_LIMIT para
+# todas las peticiones del worker) mientras dura la petición.
+REQUEST_MEMORY_BUDGET = int(os.environ.get("REQUEST_MEMORY_BUDGET", 256 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 400_000_000))
+# Bytes por píxel de la imagen decodificada por Pillow (RGB ocupa 4) y de las etapas
+# posteriores a la resolución de trabajo: buffer RGB y máscara, imagen de Pillow,
+# HSV y gris de las características y la copia que se codifica
+DECODED_BYTES_PER_PIXEL = 4
+WORKING_BYTES_PER_PIXEL = 16
+memory_admission = MemoryAdmission.from_env()
+
+# Etapas que se ejecutan en un grupo de procesos en lugar de en el hilo de la
+# petición ("rembg", "features"), separadas por comas, y número de procesos
+PROCESS_STAGES = {stage for stage in os.environ.get("PROCESS_STAGES", "").split(",") if stage}
+PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", os.cpu_count() or 1))
+process_pool = StageProcessPool(workers=PROCESS_WORKERS)
+
+# Sesiones de rembg reutilizadas entre peticiones (una por hilo de gunicorn)
+rembg_pool = RembgSessionPool.from_env()
+
+# Características ya calculadas, por contenido de la imagen (FEATURE_STORE_DIR; sin
+# él no se guardan). Los ajustes que cambian el vector separan las filas guardadas.
+feature_store = FeatureStore.from_env(
+    FEATURE_SCHEMA,
+    {
+        "feature_crop": FEATURE_CROP,
+        "decode_max_side": DECODE_MAX_SIDE,
+        "decode_reducing_gap": DECODE_REDUCING_GAP,
+        "rembg_model": rembg_pool.model_name,
+        "rembg_max_side": REMBG_MAX_SIDE,
+        "feature_max_side": FEATURE_MAX_SIDE,
+    },
+)
+
+
+# Función para decodificar la imagen subida directamente desde memoria
+# (por bloques de filas si `tiled`, ver plan_decode)
+def load_image(image_data, max_side=None, reducing_gap=None, tiled=False):
+    with stage("decode"):
+        return _load_image(image_data, max_side or DECODE_MAX_SIDE, reducing_gap, tiled)
+
+
+def _load_image(image_data, max_side, reducing_gap, tiled):
+    if tiled:
+        image = Image.fromarray(decode_png_tiled(image_data, max_side))
+        print(f"Dimensiones de la imagen después del cambio (por bloques): {image.size}")
+        return image
+    image = Image.open(io.BytesIO(image_data))
+
+    # Redimensionar la imagen antes de eliminar el fondo (manteniendo la relación de aspecto).
+    # thumbnail() aplica draft() en JPEG, así que no se decodifica la imagen completa.
+    image.thumbnail(
+        (max_side, max_side),
+        Image.LANCZOS,
+        reducing_gap=reducing_gap or DECODE_REDUCING_GAP,
+    )
+    print(f"Dimensiones de la imagen después del cambio: {image.size}")
+    # Si no hacía falta reducirla, thumbnail() no la ha decodificado todavía: hacerlo
+    # aquí para que la etapa "decode" no se cuente en la siguiente
+    image.load()
+
+    # El flujo anterior pasaba por PNG, que descarta el EXIF: no aplicar la orientación
+    image.info = {}
+    return image
+
+
+# Memoria estimada (bytes) para procesar una imagen subida, calculada a partir de su
+# cabecera sin decodificarla, y si hay que decodificarla por bloques para que quepa
+# en REQUEST_MEMORY_BUDGET. Devuelve (bytes, por bloques) o lanza ImageTooLarge.
+def plan_decode(image_data, max_side=None, reducing_gap=None):
+    max_side = max_side or DECODE_MAX_SIDE
+    reducing_gap = reducing_gap or DECODE_REDUCING_GAP
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f"La imagen tiene {width}x{height} píxeles")
+
+    out_width, out_height = thumbnail_size(width, height, max_side)
+    working = out_width * out_height * WORKING_BYTES_PER_PIXEL
+    # Con JPEG, draft() (como en thumbnail) solo configura la escala del decodificador
+    if max(width, height) > max_side:
+        image.draft(None, (int(max_side * reducing_gap), int(max_side * reducing_gap)))
+    decoded_width, decoded_height = image.size
+    memory = decoded_width * decoded_height * DECODED_BYTES_PER_PIXEL + working
+    if memory <= REQUEST_MEMORY_BUDGET:
+        return memory, False
+
+    if can_decode_tiled(image_data):
+        memory = tiled_decode_bytes(width, height, max_side) + working
+        if memory <= REQUEST_MEMORY_BUDGET:
+            return memory, True
+    raise ImageTooLarge(
+        f"La imagen de {width}x{height} necesita {memory / 2**20:.0f} MB "
+        f"(presupuesto {REQUEST_MEMORY_BUDGET / 2**20:.0f} MB)"
+    )
+
+
+# Decodificar una imagen subida reservando antes su memoria en memory_admission:
+# la reserva dura todo el bloque `with` (hasta liberar el ImageBuffer y codificar
+# la respuesta). Puede lanzar ImageTooLarge o memory.MemoryBusy.
+@contextmanager
+def admitted_image(image_data, max_side=None):
+    memory, tiled = plan_decode(image_data, max_side)
+    with memory_admission.reserve(memory):
+        yield load_image(image_data, max_side=max_side, tiled=tiled)
+
+
+# Tabla (alfa, valor) -> valor del canal tras recortar con la máscara
+# (rembg.bg.naive_cutout) y componer sobre blanco (Image.alpha_composite), con la
+# misma aritmética entera que Pillow: el resultado es idéntico bit a bit.
+def _composite_table():
+    alpha = np.arange(256, dtype=np.uint32)[:, None]
+    value = np.arange(256, dtype=np.uint32)[None, :]
+    cutout = value * alpha + 128
+    cutout = ((cutout >> 8) + cutout) >> 8
+    blended = (cutout * alpha + 255 * (255 - alpha)) * 128 + (128 << 7)
+    return ((((blended >> 8) + blended) >> 8) >> 7).astype(np.uint8)
+
+
+_COMPOSITE_TABLE = _composite_table()
+
+
+# Copiar una imagen de Pillow a un ndarray ya reservado por bloques de filas:
+# np.asarray() de la imagen completa duplicaría el pico de memoria
+def copy_image(image, out):
+    width, height = image.size
+    for start in range(0, height, STRIP_ROWS):
+        stop = min(start + STRIP_ROWS, height)
+        out[start:stop] = np.asarray(image.crop((0, start, width, stop)))
+    return out
+
+
+# Imagen decodificada como un único buffer RGB (ndarray uint8) que recorre todas
+# las etapas: la máscara se aplica sobre él en el sitio y las características se
+# leen del mismo buffer. Si alguna etapa corre en el grupo de procesos, el buffer
+# vive en memoria compartida y los hijos trabajan sobre él sin copiarlo.
+# La máscara de rembg (alfa 0-255) se conserva junto a la imagen en `mask`, y
+# `composited` indica si el fondo ya se ha puesto en blanco.
+class ImageBuffer:
+    def __init__(self, image, shared=False):
+        # Imagen de Pillow original (rembg la reduce a 320x320 sin tocar el buffer)
+        self.image = image if image.mode == "RGB" else image.convert("RGB")
+        width, height = self.image.size
+        self.blocks = []
+        self.descriptor = None
+        self.mask_descriptor = None
+        self.composited = False
+        if shared:
+            image_shm, self.descriptor = empty_shared_array((height, width, 3), np.uint8)
+            mask_shm, self.mask_descriptor = empty_shared_array((height, width), np.uint8)
+            self.blocks = [image_shm, mask_shm]
+            self.array = np.ndarray((height, width, 3), dtype=np.uint8, buffer=image_shm.buf)
+            self.mask = np.ndarray((height, width), dtype=np.uint8, buffer=mask_shm.buf)
+        else:
+            self.array = np.empty((height, width, 3), dtype=np.uint8)
+            self.mask = np.empty((height, width), dtype=np.uint8)
+        copy_image(self.image, self.array)
+
+    @property
+    def size(self):
+        return self.image.size
+
+    # Componer sobre blanco en el sitio si remove_background() no lo hizo
+    def composite(self):
+        if not self.composited:
+            with stage("composite"):
+                composite_on_white(self.array, self.mask)
+            self.composited = True
+        return self
+
+    # Copia de la imagen procesada como imagen de Pillow (para codificarla o guardarla)
+    def to_image(self):
+        return Image.fromarray(self.composite().array)
+
+    def close(self):
+        self.image = None
+        if self.blocks:
+            self.array = None
+            self.mask = None
+            release(*self.blocks)
+            self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Recortar con la máscara y componer sobre blanco en el sitio, por bloques de filas
+# para que los índices temporales de la tabla no ocupen tanto como la imagen
+def composite_on_white(array, mask):
+    table = _COMPOSITE_TABLE.ravel()
+    for start in range(0, array.shape[0], STRIP_ROWS):
+        strip = array[start : start + STRIP_ROWS]
+        index = (mask[start : start + STRIP_ROWS, :, None].astype(np.uint16) << 8) | strip
+        np.take(table, index, out=strip)
+    return array
+
+
+# Calcular la máscara de rembg (imagen "L" del tamaño de la original)
+def compute_mask(image, rembg_max_side=None):
+    if rembg_max_side is None:
+        rembg_max_side = REMBG_MAX_SIDE
+
+    with stage("rembg"):
+        if rembg_max_side and max(image.size) > rembg_max_side:
+            # Calcular la máscara sobre una copia reducida y reescalarla a la original
+            small_image = image.copy()
+            small_image.thumbnail((rembg_max_side, rembg_max_side), Image.LANCZOS)
+            return rembg_pool.predict_mask(small_image).resize(image.size, Image.LANCZOS)
+        return rembg_pool.predict_mask(image)
+
+
+# Eliminar el fondo de un buffer en el proceso actual (modificándolo en el sitio
+# si `composite`) y guardar la máscara en `mask`
+def apply_background_mask(array, mask, rembg_max_side=None, image=None, composite=True):
+    if image is None:
+        image = Image.fromarray(array)
+    copy_image(compute_mask(image, rembg_max_side), mask)
+    if composite:
+        with stage("composite"):
+            composite_on_white(array, mask)
+    print("Fondo borrado")
+    return array
+
+
+# Función para eliminar el fondo de la imagen: recibe una imagen de Pillow y
+# devuelve un ImageBuffer con el fondo en blanco (hay que cerrarlo al terminar).
+# Con la versión 2 de las características (features.FEATURE_VERSION) solo se
+# calcula la máscara: el buffer se compone después, si se pide la imagen procesada.
+def remove_background(image, rembg_max_side=None, composite=None):
+    if composite is None:
+        composite = FEATURE_VERSION == 1
+    buffer = ImageBuffer(image, shared=bool(PROCESS_STAGES))
+    try:
+        if "rembg" in PROCESS_STAGES:
+            # Las etapas del proceso hijo se miden allí: aquí, la llamada completa
+            with stage("rembg"):
+                process_pool.remove_background(
+                    buffer.descriptor, buffer.mask_descriptor, rembg_max_side, composite=composite
+                )
+        else:
+            apply_background_mask(
+                buffer.array, buffer.mask, rembg_max_side, image=buffer.image, composite=composite
+            )
+        buffer.composited = composite
+    except Exception:
+        buffer.close()
+        raise
+    return buffer
+
+
+# Imagen a la resolución usada para extraer características. Si el ImageBuffer ya
+# cabe en FEATURE_MAX_SIDE se devuelve tal cual (sin copias); si no, otro ImageBuffer
+# reducido junto con su máscara. Una imagen de Pillow se devuelve como ndarray.
+def feature_image(image, max_side=None):
+    max_side = max_side or FEATURE_MAX_SIDE
+    if isinstance(image, ImageBuffer):
+        if max(image.size) <= max_side:
+            return image
+        with stage("feature_resize"):
+            small_image = Image.fromarray(image.array)
+            small_image.thumbnail((max_side, max_side), Image.LANCZOS)
+            small_buffer = ImageBuffer(small_image)
+            small_mask = Image.fromarray(image.mask).resize(small_image.size, Image.LANCZOS)
+            copy_image(small_mask, small_buffer.mask)
+            small_buffer.composited = image.composited
+            return small_buffer
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return np.asarray(image)
+
+
+# Función para procesar una sola imagen ya sin fondo (ndarray RGB o ImageBuffer).
+# Con un ImageBuffer se pasa también la máscara (ver features.FEATURE_CROP).
+# Devuelve la fila de 517 características en float32. Con `store_key` (clave de
+# feature_store de la imagen subida) la fila se guarda en el almacén.
+def process_single_image(image, store_key=None):
+    try:
+        with stage("features"):
+            features = _process_single_image(image)
+
+    except Exception as e:
+        print(f"Error al procesar la imagen: {e}")
+        return None
+
+    save_features(store_key, features)
+    return features
+
+
+def _process_single_image(image):
+    if isinstance(image, ImageBuffer):
+        if "features" in PROCESS_STAGES:
+            return process_pool.extract_features(
+                image.array,
+                mask=image.mask,
+                descriptor=image.descriptor,
+                mask_descriptor=image.mask_descriptor,
+            )
+        return extract_features(image.array, mask=image.mask)
+    if "features" in PROCESS_STAGES:
+        return process_pool.extract_features(image)
+    return extract_features(image)
+
+
+# Características de cada objeto de un ImageBuffer ya sin fondo (ver
+# features.extract_objects). Devuelve (matriz de filas, [(etiqueta, caja, área)])
+# con las cajas y áreas en píxeles de `image`
+def process_objects(image, min_area=None, max_objects=None):
+    if min_area is None:
+        min_area = OBJECT_MIN_AREA
+    if max_objects is None:
+        max_objects = MAX_OBJECTS
+    with stage("features"):
+        if "features" in PROCESS_STAGES:
+            return process_pool.extract_objects(
+                image.array,
+                image.mask,
+                descriptor=image.descriptor,
+                mask_descriptor=image.mask_descriptor,
+                min_area=min_area,
+                max_objects=max_objects,
+            )
+        return extract_objects(image.array, image.mask, min_area=min_area, max_objects=max_objects)
+
+
+# Fila guardada en feature_store para la clave, o None (hay que calcularla)
+def stored_features(store_key):
+    if store_key is None:
+        return None
+    with stage("feature_store"):
+        return feature_store.get(store_key)
+
+
+def save_features(store_key, features):
+    if store_key is None or features is None:
+        return
+    try:
+        with stage("feature_store"):
+            feature_store.put(store_key, features)
+    except OSError as e:
+        # Sin almacén se sigue sirviendo: solo se pierde la fila guardada
+        print(f"Error al guardar las características: {e}")
+
+
+# Decodificar, quitar el fondo y extraer las características de una imagen subida
+# (o tomarlas de feature_store si ya se calcularon con los mismos ajustes)
+def features_from_bytes(image_data):
+    store_key = feature_store.key(image_data)
+    features = stored_features(store_key)
+    if features is not None:
+        return features
+    with admitted_image(image_data) as image, remove_background(image) as processed_image:
+        features = process_single_image(feature_image(processed_image), store_key=store_key)
+    if features is None:
+        raise ValueError("No se pudieron extraer características de la imagen")
+    return features
+
+
+# Formatos de la imagen devuelta: nombre para Pillow y tipo MIME
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+# Calidad por defecto de JPEG/WebP
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+
+
+# Codificar la imagen procesada (Pillow o ImageBuffer) en memoria, en el formato
+# pedido y, si se indica max_side, reducida a una miniatura
+def encode_image(image, image_format="png", quality=None, max_side=None):
+    if isinstance(image, ImageBuffer):
+        image = image.to_image()
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    options = {} if image_format == "png" else {"quality": quality or IMAGE_QUALITY}
+    with io.BytesIO() as byte_io:
+        image.save(byte_io, format=pil_format, **options)
+        return byte_io.getvalue()
+
+
+# Codificar la imagen procesada como PNG en memoria
+def encode_png(image):
+    return encode_image(image, "png")
+
+
+# Codificar la salida pedida en /predict: la imagen procesada o, con
+# image_format="mask", solo la máscara de rembg del ImageBuffer.
+# Devuelve (bytes, tipo MIME, metadatos)
+def encode_output(
+    image, image_format="png", quality=None, max_side=None, mask_bits=8, mask_encoding="png"
+):
+    with stage("encode"):
+        return _encode_output(image, image_format, quality, max_side, mask_bits, mask_encoding)
+
+
+def _encode_output(image, image_format, quality, max_side, mask_bits, mask_encoding):
+    if image_format == "mask":
+        data, info = encode_mask(
+            image.mask, bits=mask_bits, encoding=mask_encoding, max_side=max_side
+        )
+        mimetype = "image/png" if mask_encoding == "png" else "application/octet-stream"
+        return data, mimetype, {"image_format": "mask", "mask": info}
+    data = encode_image(image, image_format, quality=quality, max_side=max_side)
+    return data, IMAGE_FORMATS[image_format][1], {"image_format": image_format}
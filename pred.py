@@ -1,659 +1,356 @@
-import io
+# Clasificación por lotes sin servidor: recorre directorios (o una lista de
+# archivos) y pasa cada imagen por el mismo pipeline que /predict (pipeline.py y
+# features.py) en un grupo de procesos, uno por núcleo. El modelo se llama en el
+# proceso principal con lotes de filas.
+#
+# - Memoria acotada: las rutas se leen a medida que se procesan y como mucho hay
+#   2 imágenes por proceso en curso; cada proceso lee su imagen y reserva su
+#   memoria (REQUEST_MEMORY_BUDGET) como en el servicio.
+# - Reanudable: cada lote de resultados se añade a un checkpoint JSONL; al volver
+#   a lanzar el mismo comando se saltan las imágenes que ya están en él (también
+#   las que fallaron, salvo con --retry-failed). Al terminar se escribe la salida
+#   (CSV, Parquet o JSONL, por la extensión o --format) y se borra el checkpoint.
+# - Los resultados salen en el orden en que terminan, no en el de las rutas.
+#
+# Uso: python pred.py fotos/ [más directorios o imágenes ...] -o resultados.csv
+#      [--manifest lista.txt] [--features] [--workers N] [--batch-size 256]
+#      [--model papas.pkl] [--checkpoint resultados.csv.checkpoint.jsonl]
+import argparse
+import csv
+import json
+import multiprocessing
 import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
 
-import cv2
-import joblib
-import numpy as np
-import pandas as pd
-from flask import Flask
-from flask import jsonify
-from flask import request
-from PIL import Image
-from skimage.feature import graycomatrix
-from skimage.feature import graycoprops
-from skimage.feature import local_binary_pattern
-
-# Configurar Flask
-app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = "uploads"  # Carpeta para las imágenes cargadas
-app.config["ALLOWED_EXTENSIONS"] = {"png", "jpg", "jpeg"}  # Extensiones permitidas
-
-
-# Función para verificar si el archivo tiene una extensión permitida
-def allowed_file(filename):
-    return (
-        "." in filename
-        and filename.rsplit(".", 1)[1].lower() in app.config["ALLOWED_EXTENSIONS"]
-    )
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # sin pyarrow no se puede escribir Parquet
+    pyarrow = None
 
+from features import FEATURE_SCHEMA
+from model_registry import get_registry
 
-# Función para extraer características de color
-def extract_color_features(image):
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
-    hist = cv2.calcHist(
-        [hsv_image], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256]
-    )
-    hist = cv2.normalize(hist, hist).flatten()
-    return hist
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+OUTPUT_FORMATS = ("csv", "parquet", "jsonl")
+# Filas por bloque al convertir el checkpoint en la salida final
+OUTPUT_CHUNK_ROWS = 10_000
 
 
-# Función para extraer características de textura
-def extract_texture_features(gray_image):
-    lbp = local_binary_pattern(gray_image, P=8, R=1, method="uniform")
-    glcm = graycomatrix(
-        gray_image, distances=[5], angles=[0], levels=256, symmetric=True, normed=True
-    )
-    contrast = graycoprops(glcm, "contrast")[0, 0]
-    return [float(lbp.mean()), float(contrast)]  # Convertir a float
+# Preparar cada proceso del grupo: una sola sesión de rembg con su parte de los
+# núcleos, sin grupo de procesos propio y, salvo con --verbose, sin los mensajes
+# del pipeline de cada imagen. Ctrl+C lo gestiona solo el proceso principal.
+def _init_worker(threads, verbose):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ["PROCESS_STAGES"] = ""
+    os.environ.setdefault("REMBG_POOL_SIZE", "1")
+    os.environ.setdefault("REMBG_INTRA_OP_THREADS", str(threads))
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+    import texture
+    import tiled
+
+    texture.warm_up()
+    tiled.warm_up()
+
+
+# Tarea de cada proceso: características de una imagen (como en /predict/batch)
+def _features_task(path):
+    from pipeline import features_from_bytes
+    from uploads import IMAGE_TYPES
+    from uploads import sniff_type
+
+    with open(path, "rb") as file:
+        image_data = file.read()
+    if sniff_type(image_data) not in IMAGE_TYPES:
+        raise ValueError("Unsupported file type")
+    return features_from_bytes(image_data)
+
+
+# Rutas de las imágenes: los directorios se recorren (ordenados) y los archivos de
+# la lista (--manifest, una ruta por línea, relativa a la lista) se toman tal cual
+def iter_paths(inputs, manifest=None):
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest) as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield os.path.normpath(os.path.join(base, line))
+    for path in inputs:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+# Leer el checkpoint: rutas ya procesadas y si guarda las características. Una
+# última línea incompleta (proceso interrumpido a mitad de escritura) se recorta;
+# con retry_failed se quitan también las imágenes que fallaron.
+def load_checkpoint(path, retry_failed=False):
+    done = set()
+    with_features = None
+    if not os.path.exists(path):
+        return done, with_features
+
+    kept = []
+    valid_bytes = 0
+    with open(path, "rb") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_bytes += len(line)
+            if retry_failed and record["error"] is not None:
+                continue
+            if with_features is None:
+                with_features = "features" in record
+            done.add(record["path"])
+            kept.append(line)
+
+    if retry_failed or valid_bytes < os.path.getsize(path):
+        with open(path + ".tmp", "wb") as file:
+            file.writelines(kept)
+        os.replace(path + ".tmp", path)
+    return done, with_features
+
+
+# Predicción de las filas por lotes (una llamada al modelo cada batch_size
+# imágenes) y escritura de los resultados en el checkpoint
+class Classifier:
+    def __init__(self, model_path, checkpoint, with_features=False, batch_size=256):
+        self.model = get_registry(model_path, validator=FEATURE_SCHEMA.check_model).get()
+        self.checkpoint = open(checkpoint, "a")
+        self.with_features = with_features
+        self.batch_size = batch_size
+        self.rows = []
+        self.paths = []
+        self.processed = 0
+        self.failed = 0
 
+    def add(self, path, features):
+        self.paths.append(path)
+        self.rows.append(features)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
 
-# Función para extraer características de forma
-def extract_shape_features(gray_image):
-    contours, _ = cv2.findContours(
-        gray_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    def add_error(self, path, error):
+        self.failed += 1
+        record = {"path": path, "prediction": None, "error": str(error) or repr(error)}
+        if self.with_features:
+            record["features"] = None
+        self._write([record])
+
+    # Predecir las filas pendientes con una sola llamada al modelo y guardarlas
+    def flush(self):
+        if not self.rows:
+            return
+        predictions = self.model.predict(FEATURE_SCHEMA.as_matrix(self.rows))
+        records = []
+        for path, row, prediction in zip(self.paths, self.rows, predictions):
+            record = {"path": path, "prediction": int(prediction), "error": None}
+            if self.with_features:
+                record["features"] = row.tolist()
+            records.append(record)
+        self.rows, self.paths = [], []
+        self._write(records)
+
+    def _write(self, records):
+        self.checkpoint.writelines(json.dumps(record) + "\n" for record in records)
+        self.checkpoint.flush()
+        self.processed += len(records)
+
+    def close(self):
+        self.flush()
+        self.checkpoint.close()
+
+
+# Procesar las imágenes pendientes con `workers` procesos y como mucho 2 por
+# proceso en curso. Devuelve False si se interrumpió (Ctrl+C)
+def run(paths, done, classifier, workers, verbose=False, progress_interval=10.0):
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # forkserver evita hacer fork del proceso principal con el modelo ya cargado
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_init_worker,
+        initargs=(threads, verbose),
     )
-    max_contour = max(contours, key=cv2.contourArea)
-    area = cv2.contourArea(max_contour)
-    perimeter = cv2.arcLength(max_contour, True)
-    circularity = 4 * np.pi * (area / (perimeter * perimeter)) if perimeter != 0 else 0
-    return [area, perimeter, circularity]
+    pending = {}
+    start = last_report = time.perf_counter()
 
+    def collect(futures):
+        nonlocal last_report
+        for future in futures:
+            path = pending.pop(future)
+            try:
+                classifier.add(path, future.result())
+            except BrokenProcessPool:
+                # Un proceso murió (p. ej. sin memoria): no es un error de la imagen
+                raise
+            except Exception as e:
+                classifier.add_error(path, e)
+        now = time.perf_counter()
+        if now - last_report >= progress_interval:
+            last_report = now
+            report(classifier, now - start)
 
-# Función para procesar una sola imagen
-def process_single_image(image_path):
     try:
-        image = np.array(Image.open(image_path))
-        gray_image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        for path in paths:
+            if path in done:
+                continue
+            if len(pending) >= 2 * workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending[executor.submit(_features_task, path)] = path
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    except KeyboardInterrupt:
+        executor.shutdown(wait=False, cancel_futures=True)
+        classifier.flush()
+        return False
+    executor.shutdown()
+    classifier.flush()
+    report(classifier, time.perf_counter() - start)
+    return True
 
-        # Extraer características
-        color_features = extract_color_features(image)
-        texture_features = extract_texture_features(gray_image)
-        shape_features = extract_shape_features(gray_image)
 
-        # Combinar todas las características en una lista
-        features = color_features.tolist() + texture_features + shape_features
-        return features
+def report(classifier, elapsed):
+    rate = classifier.processed / elapsed if elapsed else 0.0
+    print(
+        f"{classifier.processed} imágenes ({classifier.failed} con error) en {elapsed:.1f} s: "
+        f"{rate:.2f} imágenes/s",
+        flush=True,
+    )
 
-    except Exception as e:
-        print(f"Error al procesar la imagen {image_path}: {e}")
-        return None
 
+# Registros del checkpoint por bloques de OUTPUT_CHUNK_ROWS
+def iter_chunks(checkpoint):
+    chunk = []
+    with open(checkpoint) as file:
+        for line in file:
+            chunk.append(json.loads(line))
+            if len(chunk) >= OUTPUT_CHUNK_ROWS:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
 
-# Función para cargar el modelo y realizar la predicción
-def predict_image_class(image_path, model_path="papas.pkl"):
-    try:
-        model = joblib.load(model_path)
-    except Exception as e:
-        print(f"Error al cargar el modelo: {e}")
-        return None
-
-    features = process_single_image(image_path)
-
-    if features is not None:
-        feature_names = [
-            "Color_0",
-            "Color_1",
-            "Color_2",
-            "Color_3",
-            "Color_4",
-            "Color_5",
-            "Color_6",
-            "Color_7",
-            "Color_8",
-            "Color_9",
-            "Color_10",
-            "Color_11",
-            "Color_12",
-            "Color_13",
-            "Color_14",
-            "Color_15",
-            "Color_16",
-            "Color_17",
-            "Color_18",
-            "Color_19",
-            "Color_20",
-            "Color_21",
-            "Color_22",
-            "Color_23",
-            "Color_24",
-            "Color_25",
-            "Color_26",
-            "Color_27",
-            "Color_28",
-            "Color_29",
-            "Color_30",
-            "Color_31",
-            "Color_32",
-            "Color_33",
-            "Color_34",
-            "Color_35",
-            "Color_36",
-            "Color_37",
-            "Color_38",
-            "Color_39",
-            "Color_40",
-            "Color_41",
-            "Color_42",
-            "Color_43",
-            "Color_44",
-            "Color_45",
-            "Color_46",
-            "Color_47",
-            "Color_48",
-            "Color_49",
-            "Color_50",
-            "Color_51",
-            "Color_52",
-            "Color_53",
-            "Color_54",
-            "Color_55",
-            "Color_56",
-            "Color_57",
-            "Color_58",
-            "Color_59",
-            "Color_60",
-            "Color_61",
-            "Color_62",
-            "Color_63",
-            "Color_64",
-            "Color_65",
-            "Color_66",
-            "Color_67",
-            "Color_68",
-            "Color_69",
-            "Color_70",
-            "Color_71",
-            "Color_72",
-            "Color_73",
-            "Color_74",
-            "Color_75",
-            "Color_76",
-            "Color_77",
-            "Color_78",
-            "Color_79",
-            "Color_80",
-            "Color_81",
-            "Color_82",
-            "Color_83",
-            "Color_84",
-            "Color_85",
-            "Color_86",
-            "Color_87",
-            "Color_88",
-            "Color_89",
-            "Color_90",
-            "Color_91",
-            "Color_92",
-            "Color_93",
-            "Color_94",
-            "Color_95",
-            "Color_96",
-            "Color_97",
-            "Color_98",
-            "Color_99",
-            "Color_100",
-            "Color_101",
-            "Color_102",
-            "Color_103",
-            "Color_104",
-            "Color_105",
-            "Color_106",
-            "Color_107",
-            "Color_108",
-            "Color_109",
-            "Color_110",
-            "Color_111",
-            "Color_112",
-            "Color_113",
-            "Color_114",
-            "Color_115",
-            "Color_116",
-            "Color_117",
-            "Color_118",
-            "Color_119",
-            "Color_120",
-            "Color_121",
-            "Color_122",
-            "Color_123",
-            "Color_124",
-            "Color_125",
-            "Color_126",
-            "Color_127",
-            "Color_128",
-            "Color_129",
-            "Color_130",
-            "Color_131",
-            "Color_132",
-            "Color_133",
-            "Color_134",
-            "Color_135",
-            "Color_136",
-            "Color_137",
-            "Color_138",
-            "Color_139",
-            "Color_140",
-            "Color_141",
-            "Color_142",
-            "Color_143",
-            "Color_144",
-            "Color_145",
-            "Color_146",
-            "Color_147",
-            "Color_148",
-            "Color_149",
-            "Color_150",
-            "Color_151",
-            "Color_152",
-            "Color_153",
-            "Color_154",
-            "Color_155",
-            "Color_156",
-            "Color_157",
-            "Color_158",
-            "Color_159",
-            "Color_160",
-            "Color_161",
-            "Color_162",
-            "Color_163",
-            "Color_164",
-            "Color_165",
-            "Color_166",
-            "Color_167",
-            "Color_168",
-            "Color_169",
-            "Color_170",
-            "Color_171",
-            "Color_172",
-            "Color_173",
-            "Color_174",
-            "Color_175",
-            "Color_176",
-            "Color_177",
-            "Color_178",
-            "Color_179",
-            "Color_180",
-            "Color_181",
-            "Color_182",
-            "Color_183",
-            "Color_184",
-            "Color_185",
-            "Color_186",
-            "Color_187",
-            "Color_188",
-            "Color_189",
-            "Color_190",
-            "Color_191",
-            "Color_192",
-            "Color_193",
-            "Color_194",
-            "Color_195",
-            "Color_196",
-            "Color_197",
-            "Color_198",
-            "Color_199",
-            "Color_200",
-            "Color_201",
-            "Color_202",
-            "Color_203",
-            "Color_204",
-            "Color_205",
-            "Color_206",
-            "Color_207",
-            "Color_208",
-            "Color_209",
-            "Color_210",
-            "Color_211",
-            "Color_212",
-            "Color_213",
-            "Color_214",
-            "Color_215",
-            "Color_216",
-            "Color_217",
-            "Color_218",
-            "Color_219",
-            "Color_220",
-            "Color_221",
-            "Color_222",
-            "Color_223",
-            "Color_224",
-            "Color_225",
-            "Color_226",
-            "Color_227",
-            "Color_228",
-            "Color_229",
-            "Color_230",
-            "Color_231",
-            "Color_232",
-            "Color_233",
-            "Color_234",
-            "Color_235",
-            "Color_236",
-            "Color_237",
-            "Color_238",
-            "Color_239",
-            "Color_240",
-            "Color_241",
-            "Color_242",
-            "Color_243",
-            "Color_244",
-            "Color_245",
-            "Color_246",
-            "Color_247",
-            "Color_248",
-            "Color_249",
-            "Color_250",
-            "Color_251",
-            "Color_252",
-            "Color_253",
-            "Color_254",
-            "Color_255",
-            "Color_256",
-            "Color_257",
-            "Color_258",
-            "Color_259",
-            "Color_260",
-            "Color_261",
-            "Color_262",
-            "Color_263",
-            "Color_264",
-            "Color_265",
-            "Color_266",
-            "Color_267",
-            "Color_268",
-            "Color_269",
-            "Color_270",
-            "Color_271",
-            "Color_272",
-            "Color_273",
-            "Color_274",
-            "Color_275",
-            "Color_276",
-            "Color_277",
-            "Color_278",
-            "Color_279",
-            "Color_280",
-            "Color_281",
-            "Color_282",
-            "Color_283",
-            "Color_284",
-            "Color_285",
-            "Color_286",
-            "Color_287",
-            "Color_288",
-            "Color_289",
-            "Color_290",
-            "Color_291",
-            "Color_292",
-            "Color_293",
-            "Color_294",
-            "Color_295",
-            "Color_296",
-            "Color_297",
-            "Color_298",
-            "Color_299",
-            "Color_300",
-            "Color_301",
-            "Color_302",
-            "Color_303",
-            "Color_304",
-            "Color_305",
-            "Color_306",
-            "Color_307",
-            "Color_308",
-            "Color_309",
-            "Color_310",
-            "Color_311",
-            "Color_312",
-            "Color_313",
-            "Color_314",
-            "Color_315",
-            "Color_316",
-            "Color_317",
-            "Color_318",
-            "Color_319",
-            "Color_320",
-            "Color_321",
-            "Color_322",
-            "Color_323",
-            "Color_324",
-            "Color_325",
-            "Color_326",
-            "Color_327",
-            "Color_328",
-            "Color_329",
-            "Color_330",
-            "Color_331",
-            "Color_332",
-            "Color_333",
-            "Color_334",
-            "Color_335",
-            "Color_336",
-            "Color_337",
-            "Color_338",
-            "Color_339",
-            "Color_340",
-            "Color_341",
-            "Color_342",
-            "Color_343",
-            "Color_344",
-            "Color_345",
-            "Color_346",
-            "Color_347",
-            "Color_348",
-            "Color_349",
-            "Color_350",
-            "Color_351",
-            "Color_352",
-            "Color_353",
-            "Color_354",
-            "Color_355",
-            "Color_356",
-            "Color_357",
-            "Color_358",
-            "Color_359",
-            "Color_360",
-            "Color_361",
-            "Color_362",
-            "Color_363",
-            "Color_364",
-            "Color_365",
-            "Color_366",
-            "Color_367",
-            "Color_368",
-            "Color_369",
-            "Color_370",
-            "Color_371",
-            "Color_372",
-            "Color_373",
-            "Color_374",
-            "Color_375",
-            "Color_376",
-            "Color_377",
-            "Color_378",
-            "Color_379",
-            "Color_380",
-            "Color_381",
-            "Color_382",
-            "Color_383",
-            "Color_384",
-            "Color_385",
-            "Color_386",
-            "Color_387",
-            "Color_388",
-            "Color_389",
-            "Color_390",
-            "Color_391",
-            "Color_392",
-            "Color_393",
-            "Color_394",
-            "Color_395",
-            "Color_396",
-            "Color_397",
-            "Color_398",
-            "Color_399",
-            "Color_400",
-            "Color_401",
-            "Color_402",
-            "Color_403",
-            "Color_404",
-            "Color_405",
-            "Color_406",
-            "Color_407",
-            "Color_408",
-            "Color_409",
-            "Color_410",
-            "Color_411",
-            "Color_412",
-            "Color_413",
-            "Color_414",
-            "Color_415",
-            "Color_416",
-            "Color_417",
-            "Color_418",
-            "Color_419",
-            "Color_420",
-            "Color_421",
-            "Color_422",
-            "Color_423",
-            "Color_424",
-            "Color_425",
-            "Color_426",
-            "Color_427",
-            "Color_428",
-            "Color_429",
-            "Color_430",
-            "Color_431",
-            "Color_432",
-            "Color_433",
-            "Color_434",
-            "Color_435",
-            "Color_436",
-            "Color_437",
-            "Color_438",
-            "Color_439",
-            "Color_440",
-            "Color_441",
-            "Color_442",
-            "Color_443",
-            "Color_444",
-            "Color_445",
-            "Color_446",
-            "Color_447",
-            "Color_448",
-            "Color_449",
-            "Color_450",
-            "Color_451",
-            "Color_452",
-            "Color_453",
-            "Color_454",
-            "Color_455",
-            "Color_456",
-            "Color_457",
-            "Color_458",
-            "Color_459",
-            "Color_460",
-            "Color_461",
-            "Color_462",
-            "Color_463",
-            "Color_464",
-            "Color_465",
-            "Color_466",
-            "Color_467",
-            "Color_468",
-            "Color_469",
-            "Color_470",
-            "Color_471",
-            "Color_472",
-            "Color_473",
-            "Color_474",
-            "Color_475",
-            "Color_476",
-            "Color_477",
-            "Color_478",
-            "Color_479",
-            "Color_480",
-            "Color_481",
-            "Color_482",
-            "Color_483",
-            "Color_484",
-            "Color_485",
-            "Color_486",
-            "Color_487",
-            "Color_488",
-            "Color_489",
-            "Color_490",
-            "Color_491",
-            "Color_492",
-            "Color_493",
-            "Color_494",
-            "Color_495",
-            "Color_496",
-            "Color_497",
-            "Color_498",
-            "Color_499",
-            "Color_500",
-            "Color_501",
-            "Color_502",
-            "Color_503",
-            "Color_504",
-            "Color_505",
-            "Color_506",
-            "Color_507",
-            "Color_508",
-            "Color_509",
-            "Color_509",
-            "Color_510",
-            "Color_511",
-            "Textura_LBP",
-            "Textura_GLCM_Contrast",
-            "Forma_Area",
-            "Forma_Perimetro",
-            "Forma_Circularidad",
-        ]
-
-        features_df = pd.DataFrame([features])
-
-        prediction = model.predict(features_df)
-        prediction = int(prediction[0])
-        return prediction
-    else:
-        print("No se pudieron extraer características de la imagen.")
-        return None
 
+def columns(with_features):
+    return ["path", "prediction", "error"] + (list(FEATURE_SCHEMA.names) if with_features else [])
 
-@app.route("/predict", methods=["POST"])
-def predict():
-    try:
-        # Verificar si el diccionario "file" está presente en la solicitud
-        if "file" not in request.files:
-            return jsonify({"error": "No file part in the request"}), 400
-        jsonify({"Sillego"})
 
-        # Obtener el archivo enviado
-        file = request.files["file"]
+def csv_row(record, with_features):
+    row = [record["path"], record["prediction"], record["error"]]
+    if with_features:
+        row += record["features"] or [""] * FEATURE_SCHEMA.size
+    return row
+
+
+# Escribir la salida final a partir del checkpoint (sin cargarlo entero en memoria)
+def write_output(checkpoint, output, output_format, with_features):
+    if output_format == "jsonl":
+        os.replace(checkpoint, output)
+        return
+
+    names = columns(with_features)
+    if output_format == "csv":
+        with open(output + ".tmp", "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(names)
+            for chunk in iter_chunks(checkpoint):
+                writer.writerows(csv_row(record, with_features) for record in chunk)
+    else:
+        fields = [
+            pyarrow.field("path", pyarrow.string()),
+            pyarrow.field("prediction", pyarrow.int64()),
+            pyarrow.field("error", pyarrow.string()),
+        ] + [pyarrow.field(name, pyarrow.float32()) for name in names[3:]]
+        schema = pyarrow.schema(fields)
+        with pyarrow.parquet.ParquetWriter(output + ".tmp", schema) as writer:
+            for chunk in iter_chunks(checkpoint):
+                data = {name: [record[name] for record in chunk] for name in names[:3]}
+                for index, name in enumerate(names[3:]):
+                    data[name] = [
+                        record["features"][index] if record["features"] else None
+                        for record in chunk
+                    ]
+                writer.write_table(pyarrow.table(data, schema=schema))
+    os.replace(output + ".tmp", output)
+    os.remove(checkpoint)
+
 
-        # Verificar si el archivo tiene un nombre válido y una extensión permitida
-        if file.filename == "" or not allowed_file(file.filename):
-            return jsonify({"error": "Invalid or missing file name"}), 400
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clasificar directorios de imágenes")
+    parser.add_argument("inputs", nargs="*", help="Directorios o imágenes")
+    parser.add_argument("-o", "--output", required=True, help="Archivo de resultados")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Por defecto, la extensión")
+    parser.add_argument("--manifest", help="Archivo con una ruta de imagen por línea")
+    parser.add_argument("--features", action="store_true", help="Guardar las características")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=256, help="Filas por llamada al modelo")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "papas.pkl"))
+    parser.add_argument("--checkpoint", help="Por defecto, <salida>.checkpoint.jsonl")
+    parser.add_argument("--retry-failed", action="store_true", help="Reintentar los errores")
+    parser.add_argument("--progress", type=float, default=10.0, help="Segundos entre informes")
+    parser.add_argument("--verbose", action="store_true", help="Mensajes del pipeline")
+    args = parser.parse_args(argv)
 
-        # Guardar el archivo cargado en la carpeta de subida
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], file.filename)
-        file.save(file_path)
+    if not args.inputs and not args.manifest:
+        parser.error("indica al menos un directorio, una imagen o --manifest")
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if output_format not in OUTPUT_FORMATS:
+        parser.error(f"formato de salida desconocido: {output_format}")
+    if output_format == "parquet" and pyarrow is None:
+        parser.error("para escribir Parquet hace falta instalar pyarrow")
+    checkpoint = args.checkpoint or args.output + ".checkpoint.jsonl"
 
-        # Realizar la predicción con la imagen guardada
-        prediction = predict_image_class(file_path)
+    done, with_features = load_checkpoint(checkpoint, retry_failed=args.retry_failed)
+    if with_features is not None and with_features != args.features:
+        parser.error(
+            f"el checkpoint {checkpoint} se creó {'con' if with_features else 'sin'} --features"
+        )
+    if done:
+        print(f"Reanudando: {len(done)} imágenes ya procesadas en {checkpoint}")
 
-        # Si la predicción fue exitosa, devolver la respuesta con el resultado
-        if prediction is not None:
-            os.remove(file_path)  # Eliminar el archivo después de usarlo
-            return jsonify({"prediction": prediction}), 200
-        else:
-            return jsonify({"error": "Prediction failed"}), 500
+    classifier = Classifier(
+        args.model, checkpoint, with_features=args.features, batch_size=args.batch_size
+    )
+    try:
+        finished = run(
+            iter_paths(args.inputs, args.manifest),
+            done,
+            classifier,
+            max(1, args.workers),
+            verbose=args.verbose,
+            progress_interval=args.progress,
+        )
+    finally:
+        classifier.close()
+    if not finished:
+        print(f"Interrumpido: {classifier.processed} imágenes guardadas en {checkpoint}")
+        print("Vuelve a lanzar el mismo comando para continuar")
+        return 130
 
-    except Exception as e:
-        # En caso de error, devolver un mensaje de error
-        return jsonify({"error": f"Error during prediction: {str(e)}"}), 500
+    write_output(checkpoint, args.output, output_format, args.features)
+    print(f"Resultados en {args.output}")
+    return 0
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5002, debug=True)
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Copiar un ndarray a un bloque de memoria compartida y devolver (bloque, descriptor)
+def share_array(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+# Reservar un bloque compartido vacío donde el proceso hijo escribirá el resultado
+def empty_shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return shm, (shm.name, tuple(shape), dtype.str)
+
+
+# Abrir en el proceso hijo un bloque creado por el padre (sin copiar los datos)
+def attach_array(descriptor):
+    name, shape, dtype = descriptor
+    # Los hijos comparten el resource_tracker del padre, que es quien libera el bloque
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def release(*blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+# Tareas ejecutadas en los procesos hijos (importan el pipeline bajo demanda)
+def _remove_background_task(source, mask_target, rembg_max_side, composite=True):
+    from pipeline import apply_background_mask
+
+    source_shm, image = attach_array(source)
+    mask_shm, mask = attach_array(mask_target)
+    try:
+        # El fondo se elimina en el mismo bloque; la máscara va a su propio bloque
+        apply_background_mask(image, mask, rembg_max_side, composite=composite)
+    finally:
+        del image, mask
+        source_shm.close()
+        mask_shm.close()
+
+
+def _extract_features_task(source, mask_source=None):
+    from features import extract_features
+
+    source_shm, image = attach_array(source)
+    mask_shm, mask = attach_array(mask_source) if mask_source is not None else (None, None)
+    try:
+        return extract_features(image, mask=mask)
+    finally:
+        del image, mask
+        source_shm.close()
+        if mask_shm is not None:
+            mask_shm.close()
+
+
+def _extract_objects_task(source, mask_source, min_area, max_objects):
+    from features import extract_objects
+
+    source_shm, image = attach_array(source)
+    mask_shm, mask = attach_array(mask_source)
+    try:
+        return extract_objects(image, mask, min_area=min_area, max_objects=max_objects)
+    finally:
+        del image, mask
+        source_shm.close()
+        mask_shm.close()
+
+
+# Grupo persistente de procesos para las etapas que dependen del GIL (rembg con
+# el pre/post-proceso de Pillow, y la extracción de características). Las imágenes
+# viajan por memoria compartida en lugar de serializarse con pickle.
+# Si un hijo muere (p. ej. lo mata el OOM killer) el grupo queda roto: fallan las
+# tareas en curso y el siguiente uso crea un grupo nuevo.
+class StageProcessPool:
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # forkserver evita hacer fork de un proceso con varios hilos (gunicorn)
+                method = "spawn"
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    method = "forkserver"
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(method)
+                )
+            return self._executor
+
+    # Ejecutar una tarea en el grupo y esperar su resultado. Si el grupo ya estaba
+    # roto al enviarla se envía a uno nuevo; si se rompe mientras se ejecuta, se
+    # descarta y BrokenProcessPool llega a la petición, que falla (no se reintenta
+    # porque las tareas modifican las imágenes compartidas en el sitio).
+    def _run(self, task, *args):
+        executor = self._get_executor()
+        try:
+            future = executor.submit(task, *args)
+        except BrokenProcessPool:
+            self._discard(executor)
+            executor = self._get_executor()
+            future = executor.submit(task, *args)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    # Sustituir un grupo roto: la siguiente tarea crea otro
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        print("Un proceso del grupo terminó inesperadamente: se creará otro grupo")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Eliminar el fondo en el sitio de una imagen que ya está en memoria compartida
+    # y escribir la máscara en el bloque mask_descriptor
+    def remove_background(self, descriptor, mask_descriptor, rembg_max_side=None, composite=True):
+        self._run(_remove_background_task, descriptor, mask_descriptor, rembg_max_side, composite)
+
+    # Si la imagen ya está en memoria compartida (descriptor) se usa sin copiarla,
+    # igual que su máscara (mask_descriptor); si no, se copian las dos
+    def extract_features(self, image, mask=None, descriptor=None, mask_descriptor=None):
+        if descriptor is not None:
+            return self._run(_extract_features_task, descriptor, mask_descriptor)
+        blocks = []
+        try:
+            source_shm, source = share_array(np.ascontiguousarray(image))
+            blocks.append(source_shm)
+            mask_source = None
+            if mask is not None:
+                mask_shm, mask_source = share_array(np.ascontiguousarray(mask))
+                blocks.append(mask_shm)
+            return self._run(_extract_features_task, source, mask_source)
+        finally:
+            release(*blocks)
+
+    # Características de cada objeto (ver features.extract_objects), con la imagen y
+    # la máscara en memoria compartida o copiadas a ella si no lo están
+    def extract_objects(
+        self, image, mask, descriptor=None, mask_descriptor=None, min_area=0.0, max_objects=None
+    ):
+        if descriptor is not None:
+            return self._run(
+                _extract_objects_task, descriptor, mask_descriptor, min_area, max_objects
+            )
+        source_shm, source = share_array(np.ascontiguousarray(image))
+        try:
+            mask_shm, mask_source = share_array(np.ascontiguousarray(mask))
+        except Exception:
+            release(source_shm)
+            raise
+        try:
+            return self._run(_extract_objects_task, source, mask_source, min_area, max_objects)
+        finally:
+            release(source_shm, mask_shm)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import onnxruntime as ort
+import rembg
+from PIL import Image
+from rembg.sessions import sessions_class
+
+
+# Pool de sesiones de rembg/onnxruntime creadas una sola vez por proceso.
+# rembg.remove() sin sesión vuelve a crear la sesión ONNX en cada llamada; aquí
+# cada hilo toma una sesión ya inicializada y la devuelve al terminar.
+class RembgSessionPool:
+    def __init__(self, model_name="u2net", size=8, intra_op_threads=0):
+        self.model_name = model_name
+        self.size = size
+        self.intra_op_threads = intra_op_threads
+        self._sessions = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.warm_up_seconds = None
+
+    @classmethod
+    def from_env(cls):
+        size = int(os.environ.get("REMBG_POOL_SIZE", os.environ.get("THREADS", 8)))
+        size = max(1, size)
+        # Por defecto repartir los núcleos entre las sesiones para no sobresuscribir la CPU
+        default_threads = max(1, (os.cpu_count() or 1) // size)
+        intra_op_threads = int(os.environ.get("REMBG_INTRA_OP_THREADS", default_threads))
+        return cls(
+            model_name=os.environ.get("REMBG_MODEL", "u2net"),
+            size=size,
+            intra_op_threads=intra_op_threads,
+        )
+
+    def _new_session(self):
+        session_class = next(
+            (sc for sc in sessions_class if sc.name() == self.model_name), None
+        )
+        if session_class is None:
+            raise ValueError(f"Modelo de rembg desconocido: {self.model_name}")
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = self.intra_op_threads
+        sess_opts.inter_op_num_threads = 1
+        return session_class(self.model_name, sess_opts)
+
+    # Crear una sesión nueva si el pool aún no está lleno
+    def _try_grow(self):
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+        try:
+            self._sessions.put(self._new_session())
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        return True
+
+    @contextmanager
+    def session(self):
+        try:
+            session = self._sessions.get_nowait()
+        except queue.Empty:
+            self._try_grow()
+            session = self._sessions.get()
+        try:
+            yield session
+        finally:
+            self._sessions.put(session)
+
+    # Eliminar el fondo usando una sesión del pool
+    def remove(self, data, **kwargs):
+        with self.session() as session:
+            return rembg.remove(data, session=session, **kwargs)
+
+    # Máscara del primer objeto (imagen "L" del tamaño de la entrada) llamando
+    # directamente a la sesión, sin las copias de rembg.remove()
+    def predict_mask(self, image):
+        with self.session() as session:
+            return session.predict(image)[0]
+
+    # Crear todas las sesiones y pasar una imagen ficticia por cada una
+    def warm_up(self):
+        start = time.perf_counter()
+        while self._try_grow():
+            pass
+        dummy = Image.new("RGB", (64, 64), (255, 255, 255))
+        sessions = [self._sessions.get() for _ in range(self._created)]
+        try:
+            for session in sessions:
+                rembg.remove(dummy, session=session)
+        finally:
+            for session in sessions:
+                self._sessions.put(session)
+        self.warm_up_seconds = time.perf_counter() - start
+        print(
+            f"Pool de rembg listo: {self._created} sesiones ({self.model_name}) "
+            f"en {self.warm_up_seconds:.2f} s"
+        )
+
+    def info(self):
+        return {
+            "model": self.model_name,
+            "size": self.size,
+            "created": self._created,
+            "available": self._sessions.qsize(),
+            "intra_op_threads": self.intra_op_threads,
+            "warm_up_seconds": self.warm_up_seconds,
+        }
@@ -0,0 +1,119 @@
+# Volver a puntuar con un modelo nuevo las características guardadas en el
+# almacén (feature_store.py, FEATURE_STORE_DIR) sin decodificar ninguna imagen:
+# las filas se leen con np.memmap y se predicen por bloques, así que un archivo
+# completo tarda segundos en lugar de horas.
+#
+# - El almacén tiene un directorio por extractor (versión y ajustes del pipeline);
+#   por defecto se usa el único cuya versión coincide con la del modelo
+#   (--list los muestra, --extractor elige uno).
+# - Con --baseline se predice también con otro modelo (p. ej. el actual) y se
+#   cuentan las filas cuya etiqueta cambia.
+# - La salida (CSV o JSONL, por la extensión o --format) tiene la clave de cada
+#   fila (SHA-256 de la imagen, en hexadecimal) y su predicción.
+#
+# Uso: python rescore.py --model nuevo.pkl [-o predicciones.csv] [--store DIR]
+#      [--extractor ID] [--baseline papas.pkl] [--list]
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from feature_store import FeatureStore
+from feature_store import iter_row_chunks
+from feature_store import select_store
+from model_registry import get_registry
+
+OUTPUT_FORMATS = ("csv", "jsonl")
+
+
+def list_extractors(root):
+    for name, path in FeatureStore.extractors(root).items():
+        store = FeatureStore.open(path)
+        settings = ", ".join(f"{key}={value}" for key, value in sorted(store.settings.items()))
+        print(f"{name}: {store.stats()['rows']} filas ({settings})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Volver a puntuar las características guardadas")
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "papas.pkl"))
+    parser.add_argument("-o", "--output", help="Archivo de predicciones")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Por defecto, la extensión")
+    parser.add_argument("--store", default=os.environ.get("FEATURE_STORE_DIR"))
+    parser.add_argument("--extractor", help="Identificador del extractor (ver --list)")
+    parser.add_argument("--baseline", help="Modelo con el que comparar las predicciones")
+    parser.add_argument("--list", action="store_true", help="Mostrar los extractores guardados")
+    args = parser.parse_args(argv)
+
+    if not args.store:
+        parser.error("indica el almacén con --store o FEATURE_STORE_DIR")
+    if args.list:
+        list_extractors(args.store)
+        return 0
+    output_format = None
+    if args.output:
+        output_format = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+        if output_format not in OUTPUT_FORMATS:
+            parser.error(f"formato de salida desconocido: {output_format}")
+
+    model = get_registry(args.model).get()
+    try:
+        store = select_store(args.store, model, args.extractor)
+        store.schema.check_model(model)
+        baseline = None
+        if args.baseline:
+            baseline = get_registry(args.baseline).get()
+            store.schema.check_model(baseline)
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    counts = {}
+    count = 0
+    changed = 0
+    file = open(args.output + ".tmp", "w", newline="") if args.output else None
+    try:
+        writer = csv.writer(file) if output_format == "csv" else None
+        if writer is not None:
+            writer.writerow(["key", "prediction"] + (["baseline"] if baseline else []))
+        for keys, rows in iter_row_chunks(store):
+            predictions = model.predict(rows).tolist()
+            previous = None
+            if baseline is not None:
+                previous = baseline.predict(rows).tolist()
+                changed += sum(new != old for new, old in zip(predictions, previous))
+            count += len(keys)
+            for prediction in predictions:
+                counts[prediction] = counts.get(prediction, 0) + 1
+            if writer is not None:
+                columns = [keys, predictions] + ([previous] if previous is not None else [])
+                writer.writerows(zip(*columns))
+            elif file is not None:
+                for index, key in enumerate(keys):
+                    record = {"key": key, "prediction": predictions[index]}
+                    if previous is not None:
+                        record["baseline"] = previous[index]
+                    file.write(json.dumps(record) + "\n")
+    finally:
+        if file is not None:
+            file.close()
+    if args.output:
+        os.replace(args.output + ".tmp", args.output)
+    elapsed = time.perf_counter() - start
+
+    rate = count / elapsed if elapsed else 0.0
+    print(
+        f"{count} filas del extractor {store.extractor} en {elapsed:.2f} s ({rate:.0f} filas/s)"
+    )
+    for prediction, prediction_count in sorted(counts.items()):
+        print(f"  {prediction}: {prediction_count}")
+    if baseline is not None:
+        print(f"Cambian {changed} de {count} predicciones respecto a {args.baseline}")
+    if args.output:
+        print(f"Predicciones en {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
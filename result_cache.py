@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+# Caché de resultados por contenido: la clave es el hash de los bytes subidos más
+# el hash del modelo y el identificador del extractor (feature_store.extractor_id:
+# resoluciones, recorte y modelo de rembg, que cambian la predicción y la imagen),
+# así un reintento con la misma foto no repite rembg ni el modelo.
+# Nivel en memoria con expulsión LRU por número de entradas y bytes totales, y un
+# nivel opcional en disco que sobrevive a los reinicios del worker, limitado a
+# disk_max_bytes: al superarlo se borran las entradas usadas hace más tiempo (el
+# orden se recupera al reiniciar por la fecha de modificación, que se actualiza en
+# cada acierto). Cada proceso lleva su propia cuenta del directorio.
+class ResultCache:
+    def __init__(
+        self,
+        max_entries=256,
+        max_bytes=256 * 1024 * 1024,
+        disk_dir=None,
+        disk_max_bytes=1024 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Entradas en disco (clave -> bytes), de la usada hace más tiempo a la última
+        self._disk_lock = threading.Lock()
+        self._disk_entries = OrderedDict()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(image_data, model_hash, extractor=None):
+        digest = hashlib.sha256()
+        digest.update((model_hash or "").encode("utf-8"))
+        digest.update(b"\0" + (extractor or "").encode("utf-8") + b"\0")
+        digest.update(image_data)
+        return digest.hexdigest()
+
+    # Devolver (predicción, imagen) o None si la entrada no está en caché
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._put_memory(key, entry)
+        return entry
+
+    def put(self, key, prediction, image):
+        entry = (prediction, image)
+        self._put_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def _put_memory(self, key, entry):
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1])
+                self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    # Recuperar las entradas que ya había en disco, ordenadas por fecha de uso
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name[: -len(".json")])
+                try:
+                    st = os.stat(path + ".json")
+                    size = st.st_size + os.path.getsize(path + ".png")
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, os.path.basename(path), size))
+        with self._disk_lock:
+            for _, key, size in sorted(entries):
+                self._disk_entries[key] = size
+                self._disk_bytes += size
+        self._evict_disk()
+
+    # Borrar las entradas usadas hace más tiempo hasta no pasar de disk_max_bytes
+    def _evict_disk(self):
+        while True:
+            with self._disk_lock:
+                if self._disk_bytes <= self.disk_max_bytes or not self._disk_entries:
+                    return
+                key, size = self._disk_entries.popitem(last=False)
+                self._disk_bytes -= size
+                self.disk_evictions += 1
+            path = self._disk_path(key)
+            # Primero el JSON: sin él la entrada deja de ser válida
+            for suffix in (".json", ".png"):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path + ".json", "r") as file:
+                prediction = json.load(file)["prediction"]
+            with open(path + ".png", "rb") as file:
+                image = file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        with self._disk_lock:
+            if key in self._disk_entries:
+                self._disk_entries.move_to_end(key)
+        try:
+            os.utime(path + ".json")
+        except OSError:
+            pass
+        return prediction, image
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        if len(entry[1]) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escribir la imagen antes que el JSON: una entrada solo es válida si existe el JSON
+        for suffix, data, mode in (
+            (".png", entry[1], "wb"),
+            (".json", json.dumps({"prediction": entry[0]}), "w"),
+        ):
+            tmp_path = f"{path}{suffix}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as file:
+                file.write(data)
+            os.replace(tmp_path, path + suffix)
+        size = os.path.getsize(path + ".json") + len(entry[1])
+        with self._disk_lock:
+            self._disk_bytes += size - self._disk_entries.pop(key, 0)
+            self._disk_entries[key] = size
+        self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_entries": len(self._disk_entries),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+                "disk_evictions": self.disk_evictions,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else None,
+            }
@@ -0,0 +1,278 @@
+import functools
+import math
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba es opcional: sin él se usa la versión NumPy
+    numba = None
+
+# Motor de textura: "numba" (si está instalado), "numpy" o "auto"
+TEXTURE_ENGINE = os.environ.get("TEXTURE_ENGINE", "auto")
+
+# Filas procesadas a la vez en la versión NumPy (limita los temporales float64)
+LBP_STRIP_ROWS = 256
+
+_LEVELS = 256
+_I, _J = np.ogrid[0:_LEVELS, 0:_LEVELS]
+_CONTRAST_WEIGHTS = ((_I - _J) ** 2).reshape((_LEVELS, _LEVELS, 1, 1))
+
+
+# Contraste GLCM para un único desplazamiento horizontal, idéntico bit a bit a
+# graycoprops(graycomatrix(gray, [distance], [0], levels=256, symmetric=True,
+# normed=True), "contrast")[0, 0]. Los pares de píxeles se cuentan con bincount en
+# lugar del bucle de skimage y luego se repiten exactamente sus mismas operaciones
+# de normalización y suma sobre la matriz 256x256.
+def glcm_contrast(gray_image, distance=5):
+    return _contrast_from_counts(_glcm_counts(gray_image, distance))
+
+
+# Matriz 256x256 con el número de pares (píxel, píxel `distance` columnas a la derecha)
+def _glcm_counts(gray_image, distance):
+    gray_image = np.ascontiguousarray(gray_image, dtype=np.uint8)
+    first = gray_image[:, :-distance]
+    second = gray_image[:, distance:]
+    pairs = (first.astype(np.uint16) << 8) | second
+    counts = np.bincount(pairs.ravel(), minlength=_LEVELS * _LEVELS)
+    return counts.reshape((_LEVELS, _LEVELS))
+
+
+# Contraste a partir de la matriz de pares (sin simetrizar ni normalizar)
+def _contrast_from_counts(counts):
+    # Matriz simétrica normalizada (graycomatrix)
+    P = (counts + counts.T).astype(np.float64).reshape((_LEVELS, _LEVELS, 1, 1))
+    glcm_sums = np.sum(P, axis=(0, 1), keepdims=True)
+    glcm_sums[glcm_sums == 0] = 1
+    P /= glcm_sums
+
+    # graycoprops vuelve a normalizar antes de aplicar los pesos
+    glcm_sums = np.sum(P, axis=(0, 1), keepdims=True)
+    glcm_sums[glcm_sums == 0] = 1
+    P /= glcm_sums
+    return float(np.sum(P * _CONTRAST_WEIGHTS, axis=(0, 1))[0, 0])
+
+
+# Desplazamientos de los vecinos igual que skimage (redondeados a 5 decimales)
+def _lbp_offsets(P, R):
+    angles = 2 * np.pi * np.arange(P, dtype=np.float64) / P
+    rp = np.round(-R * np.sin(angles), 5)
+    cp = np.round(R * np.cos(angles), 5)
+    return rp, cp
+
+
+# Valor interpolado de un vecino para un bloque de filas [start, stop), con la
+# misma interpolación bilineal y el mismo orden de operaciones que skimage
+# (modo constante con valor 0 fuera de la imagen, aquí mediante el relleno).
+# origin es la posición (fila, columna) del bloque dentro de la imagen completa:
+# las partes fraccionarias dependen de la coordenada absoluta (redondeo de r + rp).
+def _neighbor_values(padded, pad, start, stop, cols, rp, cp, origin=(0, 0)):
+    row0, col0 = origin
+    rr = np.arange(row0 + start, row0 + stop, dtype=np.float64)[:, None] + rp
+    cc = np.arange(col0, col0 + cols, dtype=np.float64)[None, :] + cp
+    minr = np.floor(rr)
+    minc = np.floor(cc)
+    dr = rr - minr
+    dc = cc - minc
+
+    r0 = int(minr[0, 0]) - row0 + pad
+    c0 = int(minc[0, 0]) - col0 + pad
+    r1 = int(math.ceil(rr[0, 0])) - row0 + pad
+    c1 = int(math.ceil(cc[0, 0])) - col0 + pad
+    rows = stop - start
+    top_left = padded[r0 : r0 + rows, c0 : c0 + cols]
+    if r0 == r1 and c0 == c1:
+        # Desplazamiento entero: la interpolación devuelve el píxel exacto
+        return top_left
+
+    top_right = padded[r0 : r0 + rows, c1 : c1 + cols]
+    bottom_left = padded[r1 : r1 + rows, c0 : c0 + cols]
+    bottom_right = padded[r1 : r1 + rows, c1 : c1 + cols]
+    top = (1 - dc) * top_left + dc * top_right
+    bottom = (1 - dc) * bottom_left + dc * bottom_right
+    return (1 - dr) * top + dr * bottom
+
+
+# Suma de los códigos LBP "uniform" (versión NumPy por bloques de filas)
+def _lbp_uniform_sum_numpy(gray_image, P, R, origin=(0, 0)):
+    image = np.asarray(gray_image, dtype=np.float64)
+    rows, cols = image.shape
+    pad = int(math.ceil(R)) + 1
+    padded = np.pad(image, pad)
+    rp, cp = _lbp_offsets(P, R)
+
+    total = 0
+    for start in range(0, rows, LBP_STRIP_ROWS):
+        stop = min(start + LBP_STRIP_ROWS, rows)
+        center = image[start:stop]
+        ones = np.zeros(center.shape, dtype=np.uint8)
+        changes = np.zeros(center.shape, dtype=np.uint8)
+        previous = None
+        for i in range(P):
+            neighbor = _neighbor_values(padded, pad, start, stop, cols, rp[i], cp[i], origin)
+            bit = neighbor - center >= 0
+            ones += bit
+            # skimage cuenta las transiciones sin cerrar el círculo
+            if previous is not None:
+                changes += bit != previous
+            previous = bit
+        codes = np.where(changes <= 2, ones, P + 1)
+        total += int(codes.sum(dtype=np.int64))
+    return total
+
+
+if numba is not None:
+
+    # Misma cuenta en un único recorrido compilado y sin temporales; libera el GIL.
+    # Las partes fraccionarias dr/dc dependen solo de la fila/columna, así que se
+    # calculan fuera (igual que en skimage: r + rp - floor(r + rp)).
+    # Si distance > 0, en el mismo recorrido se cuentan también los pares de la GLCM.
+    @numba.njit(cache=True, nogil=True)
+    def _lbp_uniform_sum_numba(padded, pad, P, offsets, dr, dc, distance, counts):
+        rows = padded.shape[0] - 2 * pad
+        cols = padded.shape[1] - 2 * pad
+        total = 0
+        for r in range(rows):
+            for c in range(cols):
+                pixel = padded[r + pad, c + pad]
+                if distance > 0 and c + distance < cols:
+                    counts[pixel, padded[r + pad, c + pad + distance]] += 1
+                center = float(pixel)
+                ones = 0
+                changes = 0
+                previous = -1
+                for i in range(P):
+                    r0 = r + pad + offsets[i, 0]
+                    c0 = c + pad + offsets[i, 1]
+                    r1 = r + pad + offsets[i, 2]
+                    c1 = c + pad + offsets[i, 3]
+                    if r0 == r1 and c0 == c1:
+                        value = float(padded[r0, c0])
+                    else:
+                        row_frac = dr[i, r]
+                        col_frac = dc[i, c]
+                        top = (1 - col_frac) * padded[r0, c0] + col_frac * padded[r0, c1]
+                        bottom = (1 - col_frac) * padded[r1, c0] + col_frac * padded[r1, c1]
+                        value = (1 - row_frac) * top + row_frac * bottom
+                    bit = 1 if value - center >= 0 else 0
+                    ones += bit
+                    if previous >= 0 and bit != previous:
+                        changes += 1
+                    previous = bit
+                total += ones if changes <= 2 else P + 1
+        return total
+
+    def _lbp_uniform_sum_jit(gray_image, P, R, distance=0, counts=None, origin=(0, 0)):
+        gray_image = np.asarray(gray_image, dtype=np.uint8)
+        rows, cols = gray_image.shape
+        # El relleno debe cubrir también el desplazamiento de la GLCM
+        pad = max(int(math.ceil(R)) + 1, distance)
+        padded = np.pad(gray_image, pad)
+        rp, cp = _lbp_offsets(P, R)
+
+        row0, col0 = origin
+        rr = np.arange(row0, row0 + rows, dtype=np.float64)[None, :] + rp[:, None]
+        cc = np.arange(col0, col0 + cols, dtype=np.float64)[None, :] + cp[:, None]
+        dr = rr - np.floor(rr)
+        dc = cc - np.floor(cc)
+        offsets = np.empty((P, 4), dtype=np.int64)
+        offsets[:, 0] = np.floor(rp)
+        offsets[:, 1] = np.floor(cp)
+        offsets[:, 2] = np.ceil(rp)
+        offsets[:, 3] = np.ceil(cp)
+        if counts is None:
+            counts = np.zeros((1, 1), dtype=np.int64)
+        return _lbp_uniform_sum_numba(padded, pad, P, offsets, dr, dc, distance, counts)
+
+
+def _resolve_engine(engine):
+    engine = engine or TEXTURE_ENGINE
+    if engine == "auto":
+        engine = "numba" if numba is not None else "numpy"
+    if engine == "numba" and numba is None:
+        raise RuntimeError("TEXTURE_ENGINE=numba pero numba no está instalado")
+    return engine
+
+
+def _lbp_uniform_sum(gray_image, P, R, engine):
+    if engine == "numba":
+        return _lbp_uniform_sum_jit(gray_image, P, R)
+    return _lbp_uniform_sum_numpy(gray_image, P, R)
+
+
+# Media del LBP "uniform", idéntica a local_binary_pattern(gray, P, R, "uniform").mean()
+def lbp_uniform_mean(gray_image, P=8, R=1, engine=None):
+    total = _lbp_uniform_sum(gray_image, P, R, _resolve_engine(engine))
+
+    # Los códigos son enteros: la suma es exacta y la división coincide con .mean()
+    return total / gray_image.size
+
+
+# Términos de la suma LBP de una imagen totalmente blanca. Con R=1 el código de cada
+# píxel solo depende de si está en el interior, en el borde superior/inferior, en el
+# lateral o en una esquina, así que basta con cuatro imágenes blancas pequeñas:
+# suma(filas, cols) = interior*(filas-2)*(cols-2) + sup_inf*(cols-2) + lat*(filas-2) + esquinas
+@functools.lru_cache(maxsize=None)
+def _white_lbp_terms(P, R, engine):
+    s33, s34, s43, s44 = (
+        _lbp_uniform_sum(np.full(shape, 255, dtype=np.uint8), P, R, engine)
+        for shape in ((3, 3), (3, 4), (4, 3), (4, 4))
+    )
+    interior = s44 - s34 - s43 + s33
+    top_bottom = s34 - s33 - interior
+    sides = s43 - s33 - interior
+    corners = s33 - interior - top_bottom - sides
+    return interior, top_bottom, sides, corners
+
+
+def _white_lbp_sum(rows, cols, P, R, engine):
+    interior, top_bottom, sides, corners = _white_lbp_terms(P, R, engine)
+    return (
+        interior * (rows - 2) * (cols - 2)
+        + top_bottom * (cols - 2)
+        + sides * (rows - 2)
+        + corners
+    )
+
+
+# Función para extraer características de textura (LBP medio y contraste GLCM)
+def extract_texture_features(gray_image, engine=None):
+    if _resolve_engine(engine) == "numba":
+        # LBP y pares de la GLCM en un único recorrido de la imagen
+        counts = np.zeros((_LEVELS, _LEVELS), dtype=np.int64)
+        total = _lbp_uniform_sum_jit(gray_image, 8, 1, distance=5, counts=counts)
+        return [total / gray_image.size, _contrast_from_counts(counts)]
+    return [lbp_uniform_mean(gray_image, engine=engine), glcm_contrast(gray_image)]
+
+
+# Igual que extract_texture_features() sobre una imagen gris de tamaño `shape` de la
+# que solo se recorre `region` (situada en `origin`), cuando todo lo que queda fuera
+# de la región es blanco (255) y la región deja al menos 2 filas y 5 columnas blancas
+# alrededor de cualquier píxel no blanco (o llega al borde de la imagen). Fuera de ese
+# margen los códigos LBP son los de una imagen blanca y los pares de la GLCM son todos
+# (255, 255):
+#   suma LBP = suma(región) - suma(región en blanco) + suma(imagen en blanco)
+# La región y la imagen deben medir al menos 2x2 píxeles.
+def extract_texture_features_region(region, shape, origin, engine=None):
+    engine = _resolve_engine(engine)
+    rows, cols = shape
+    region_rows, region_cols = region.shape
+    if engine == "numba":
+        counts = np.zeros((_LEVELS, _LEVELS), dtype=np.int64)
+        total = _lbp_uniform_sum_jit(
+            region, 8, 1, distance=5, counts=counts, origin=origin
+        )
+    else:
+        total = _lbp_uniform_sum_numpy(region, 8, 1, origin=origin)
+        counts = _glcm_counts(region, 5)
+
+    total += _white_lbp_sum(rows, cols, 8, 1, engine)
+    total -= _white_lbp_sum(region_rows, region_cols, 8, 1, engine)
+    counts[255, 255] += rows * max(cols - 5, 0) - region_rows * max(region_cols - 5, 0)
+    return [total / (rows * cols), _contrast_from_counts(counts)]
+
+
+# Compilar el núcleo de numba antes de la primera petición
+def warm_up():
+    extract_texture_features(np.zeros((16, 16), dtype=np.uint8))
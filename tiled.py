@@ -0,0 +1,207 @@
+import math
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # sin numba no hay decodificación por bloques (ver can_decode_tiled)
+    numba = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Canales de cada tipo de color PNG con 8 bits por muestra
+# (0 gris, 2 RGB, 3 paleta, 4 gris + alfa, 6 RGBA)
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Filas de la imagen original que se decodifican a la vez
+TILE_ROWS = 64
+# Filas de la imagen reducida que se calculan a la vez
+OUTPUT_ROWS = 16
+
+
+# Recorrer los chunks de un PNG: (tipo, datos) como memoryview, sin copiarlos
+def _png_chunks(data):
+    view = memoryview(data)
+    offset = len(PNG_SIGNATURE)
+    while offset + 8 <= len(view):
+        length, kind = struct.unpack(">I4s", view[offset : offset + 8])
+        start = offset + 8
+        yield kind, view[start : start + length]
+        offset = start + length + 4  # CRC
+        if kind == b"IEND":
+            return
+
+
+# Cabecera IHDR de un PNG: (ancho, alto, bits por muestra, tipo de color,
+# entrelazado), o None si los datos no son un PNG
+def png_header(data):
+    if data[: len(PNG_SIGNATURE)] != PNG_SIGNATURE or len(data) < 33:
+        return None
+    kind, ihdr = next(_png_chunks(data))
+    if kind != b"IHDR":
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+    return width, height, bit_depth, color_type, interlace
+
+
+# Solo los PNG no entrelazados de 8 bits se pueden decodificar fila a fila; el
+# deshacer los filtros (Paeth, media) es secuencial y sin numba sería muy lento
+def can_decode_tiled(data):
+    header = png_header(data)
+    if header is None or numba is None:
+        return False
+    _, _, bit_depth, color_type, interlace = header
+    return bit_depth == 8 and color_type in _PNG_CHANNELS and interlace == 0
+
+
+if numba is not None:
+
+    # Deshacer los filtros PNG de `rows` (cada fila empieza por el tipo de filtro)
+    # sobre `out`; `previous` es la última fila ya decodificada y se actualiza
+    @numba.njit(cache=True, nogil=True)
+    def _unfilter_rows(rows, previous, bpp, out):
+        stride = rows.shape[1] - 1
+        for r in range(rows.shape[0]):
+            kind = rows[r, 0]
+            prior = previous if r == 0 else out[r - 1]
+            current = out[r]
+            for i in range(stride):
+                x = np.int32(rows[r, i + 1])
+                a = np.int32(current[i - bpp]) if i >= bpp else 0
+                b = np.int32(prior[i])
+                if kind == 0:
+                    value = x
+                elif kind == 1:
+                    value = x + a
+                elif kind == 2:
+                    value = x + b
+                elif kind == 3:
+                    value = x + (a + b) // 2
+                else:
+                    c = np.int32(prior[i - bpp]) if i >= bpp else 0
+                    p = a + b - c
+                    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                    if pa <= pb and pa <= pc:
+                        value = x + a
+                    elif pb <= pc:
+                        value = x + b
+                    else:
+                        value = x + c
+                current[i] = value & 0xFF
+        previous[:] = out[rows.shape[0] - 1]
+
+
+# Filas de un PNG en bloques de hasta `tile_rows` filas, ya convertidas a RGB
+# (ndarray uint8 de forma (filas, ancho, 3)). Los datos comprimidos se descomprimen
+# poco a poco, así que solo hay en memoria un bloque de filas cada vez. Como en
+# Image.convert("RGB"), el alfa se descarta y el gris se repite en los tres canales.
+def iter_png_rows(data, tile_rows=TILE_ROWS):
+    width, height, _, color_type, _ = png_header(data)
+    channels = _PNG_CHANNELS[color_type]
+    stride = width * channels
+    palette = np.zeros((256, 3), dtype=np.uint8)
+
+    decompressor = zlib.decompressobj()
+    pending = bytearray()
+    previous = np.zeros(stride, dtype=np.uint8)
+    decoded = 0
+    tile_bytes = (stride + 1) * tile_rows
+
+    def convert(rows):
+        if color_type == 3:
+            return palette[rows[..., 0]]
+        if color_type in (0, 4):
+            return np.repeat(rows[..., :1], 3, axis=2)
+        return rows[..., :3]
+
+    def flush(count):
+        nonlocal decoded
+        size = count * (stride + 1)
+        rows = np.frombuffer(pending[:size], dtype=np.uint8).reshape((count, stride + 1))
+        del pending[:size]
+        out = np.empty((count, stride), dtype=np.uint8)
+        _unfilter_rows(rows, previous, channels, out)
+        decoded += count
+        return convert(out.reshape((count, width, channels)))
+
+    for kind, chunk in _png_chunks(data):
+        if kind == b"PLTE":
+            colors = np.frombuffer(chunk, dtype=np.uint8).reshape((-1, 3))[:256]
+            palette[: len(colors)] = colors
+        elif kind == b"IDAT":
+            compressed = chunk
+            while compressed:
+                # Limitar lo que se descomprime de una vez (un chunk puede expandirse mucho)
+                pending += decompressor.decompress(compressed, tile_bytes)
+                compressed = decompressor.unconsumed_tail
+                while len(pending) >= tile_bytes and decoded < height:
+                    yield flush(min(tile_rows, height - decoded))
+    pending += decompressor.flush()
+    while decoded < height:
+        count = min(tile_rows, height - decoded, len(pending) // (stride + 1))
+        if count == 0:
+            raise ValueError("PNG truncado")
+        yield flush(count)
+
+
+# Tamaño de Image.thumbnail((max_side, max_side)) para una imagen de width x height
+def thumbnail_size(width, height, max_side):
+    if max(width, height) <= max_side:
+        return width, height
+    aspect = width / height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    if aspect >= 1:
+        return max_side, round_aspect(max_side / aspect, lambda n: abs(aspect - max_side / n))
+    return round_aspect(max_side * aspect, lambda n: abs(aspect - n / max_side)), max_side
+
+
+# Decodificar un PNG por bloques de filas reduciéndolo a la vez (INTER_AREA) a un
+# lado mayor de `max_side`: nunca se tiene la imagen completa en memoria, solo la
+# reducida y un bloque de la original. Devuelve un ndarray RGB.
+def decode_png_tiled(data, max_side):
+    width, height = png_header(data)[:2]
+    out_width, out_height = thumbnail_size(width, height, max_side)
+    out = np.empty((out_height, out_width, 3), dtype=np.uint8)
+
+    tiles = iter_png_rows(data)
+    buffered, buffered_rows = [], 0
+    for start in range(0, out_height, OUTPUT_ROWS):
+        stop = min(start + OUTPUT_ROWS, out_height)
+        # Filas de la original que corresponden a las filas [start, stop) de la reducida
+        first = round(start * height / out_height)
+        needed = round(stop * height / out_height) - first
+        while buffered_rows < needed:
+            tile = next(tiles)
+            buffered.append(tile)
+            buffered_rows += len(tile)
+        block = np.concatenate(buffered) if len(buffered) > 1 else buffered[0]
+        rows, rest = block[:needed], block[needed:]
+        if rows.shape[:2] == (stop - start, out_width):
+            out[start:stop] = rows
+        else:
+            out[start:stop] = cv2.resize(
+                rows, (out_width, stop - start), interpolation=cv2.INTER_AREA
+            )
+        buffered, buffered_rows = ([rest], len(rest)) if len(rest) else ([], 0)
+    return out
+
+
+# Memoria aproximada (bytes) de decode_png_tiled: la imagen reducida y los bloques
+def tiled_decode_bytes(width, height, max_side):
+    out_width, out_height = thumbnail_size(width, height, max_side)
+    rows_per_output = math.ceil(height / out_height) * OUTPUT_ROWS
+    tile_bytes = width * 4 * (TILE_ROWS + rows_per_output) * 2
+    return out_width * out_height * 3 + tile_bytes
+
+
+# Compilar el núcleo de numba antes de la primera petición
+def warm_up():
+    if numba is not None:
+        rows = np.zeros((1, 4), dtype=np.uint8)
+        _unfilter_rows(rows, np.zeros(3, dtype=np.uint8), 3, np.empty((1, 3), dtype=np.uint8))
@@ -0,0 +1,125 @@
+import io
+import threading
+
+from flask import Request
+from flask import current_app
+
+# Firmas (magic bytes) de los tipos de archivo aceptados
+UPLOAD_SIGNATURES = {
+    "png": b"\x89PNG\r\n\x1a\n",
+    "jpeg": b"\xff\xd8\xff",
+    "zip": b"PK\x03\x04",
+}
+IMAGE_TYPES = ("png", "jpeg")
+SNIFF_BYTES = max(len(signature) for signature in UPLOAD_SIGNATURES.values())
+
+
+# Tipo de archivo según sus primeros bytes ("png", "jpeg", "zip") o None
+def sniff_type(head):
+    head = bytes(head[:SNIFF_BYTES])
+    return next(
+        (kind for kind, signature in UPLOAD_SIGNATURES.items() if head.startswith(signature)),
+        None,
+    )
+
+
+class UploadRejected(Exception):
+    def __init__(self, message, status, reason, bytes_read=0):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.bytes_read = bytes_read
+
+
+# Archivo subido en memoria (sin archivo temporal intermedio). Werkzeug escribe en
+# él cada trozo del cuerpo multipart a medida que lo lee, así que el archivo se
+# rechaza en cuanto supera max_size (archive_max_size si es un .zip) o sus primeros
+# bytes no son de un tipo aceptado: con `strict` se lanza UploadRejected sin leer el
+# resto de la petición; si no, se descarta lo recibido, se guarda el motivo en
+# `rejected` y el resto del archivo se lee sin guardarlo (los lotes siguen con los
+# demás archivos). El tipo detectado queda en `kind`.
+class UploadBuffer(io.BytesIO):
+    def __init__(self, max_size, archive_max_size=None, strict=True):
+        super().__init__()
+        self.max_size = max_size
+        self.archive_max_size = archive_max_size or max_size
+        self.strict = strict
+        self.kind = None
+        self.rejected = None
+        self.received = 0
+
+    def write(self, data):
+        self.received += len(data)
+        if self.rejected is not None:
+            return len(data)
+        max_size = self.archive_max_size if self.kind == "zip" else self.max_size
+        if self.received > max_size:
+            return self._reject(
+                f"El archivo supera el máximo de {max_size} bytes", 413, "too_large", len(data)
+            )
+        written = super().write(data)
+        if self.kind is None and self.received >= SNIFF_BYTES:
+            with self.getbuffer() as view:
+                self.kind = sniff_type(view)
+            if self.kind is None:
+                return self._reject("Tipo de archivo no admitido", 415, "unsupported_type", written)
+        return written
+
+    def _reject(self, message, status, reason, written):
+        self.rejected = UploadRejected(message, status, reason, self.received)
+        if self.strict:
+            raise self.rejected
+        self.seek(0)
+        self.truncate()
+        return written
+
+
+# Petición de Flask cuyos archivos se leen en UploadBuffer: MAX_UPLOAD_BYTES cada
+# imagen y, un .zip, lo que permita el tamaño máximo de la petición. Con
+# strict_uploads=False un archivo rechazado no detiene la lectura de los demás.
+class UploadRequest(Request):
+    strict_uploads = True
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return UploadBuffer(
+            current_app.config["MAX_UPLOAD_BYTES"],
+            archive_max_size=self.max_content_length,
+            strict=self.strict_uploads,
+        )
+
+
+# Contadores de subidas aceptadas y rechazadas. De las rechazadas se guardan los
+# bytes anunciados (Content-Length, o los recibidos si no se conoce) y los que se
+# llegaron a leer antes de rechazarlas: la diferencia es lo que se ahorra.
+class UploadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._accepted = 0
+        self._accepted_bytes = 0
+        self._rejected = {}
+        self._rejected_bytes = 0
+        self._read_bytes = 0
+
+    def accept(self, nbytes):
+        with self._lock:
+            self._accepted += 1
+            self._accepted_bytes += nbytes
+
+    def reject(self, reason, declared_bytes, read_bytes=0):
+        with self._lock:
+            self._rejected[reason] = self._rejected.get(reason, 0) + 1
+            self._rejected_bytes += max(declared_bytes or 0, read_bytes)
+            self._read_bytes += read_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "accepted": self._accepted,
+                "accepted_bytes": self._accepted_bytes,
+                "rejected": dict(self._rejected),
+                "rejected_bytes": self._rejected_bytes,
+                "rejected_bytes_read": self._read_bytes,
+                "rejected_bytes_saved": self._rejected_bytes - self._read_bytes,
+            }